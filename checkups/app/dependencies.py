@@ -1,9 +1,24 @@
-from common.models import SessionLocal, create_tables
+from typing import Optional
+from fastapi import Header
 
-def get_db():
-    create_tables()
-    db = SessionLocal()
+from common.models import AsyncSessionLocal, AsyncReadSessionLocal, AsyncSession
+from common.routing import CONSISTENCY_TOKEN_HEADER, apply_consistency_token
+
+
+async def get_db():
+    db = AsyncSessionLocal()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+async def get_read_db(
+    consistency_token: Optional[str] = Header(None, alias=CONSISTENCY_TOKEN_HEADER),
+):
+    db = AsyncReadSessionLocal()
     try:
+        await apply_consistency_token(db, consistency_token)
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        await db.close()
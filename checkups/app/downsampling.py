@@ -0,0 +1,42 @@
+from typing import List, Sequence
+
+
+def largest_triangle_three_buckets(xs: Sequence[float], ys: Sequence[float],
+                                   points: int) -> List[int]:
+    """Indexes of the `points` samples that best keep the shape of the series.
+
+    Largest-Triangle-Three-Buckets: the first and last samples are always
+    kept, the rest are split into equal buckets and each bucket keeps the
+    sample forming the largest triangle with the previously kept sample and
+    the average of the next bucket, so peaks and dips survive.
+    """
+    count = len(xs)
+    if points >= count or points < 3:
+        return list(range(count))
+
+    bucket_size = (count - 2) / (points - 2)
+    selected = [0]
+    previous = 0
+
+    for bucket in range(points - 2):
+        next_start = int((bucket + 1) * bucket_size) + 1
+        next_end = min(int((bucket + 2) * bucket_size) + 1, count)
+        next_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+        next_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+
+        previous_x = xs[previous]
+        previous_y = ys[previous]
+
+        best = start = int(bucket * bucket_size) + 1
+        best_area = -1.0
+        for index in range(start, next_start):
+            area = abs((previous_x - next_x) * (ys[index] - previous_y)
+                       - (previous_x - xs[index]) * (next_y - previous_y))
+            if area > best_area:
+                best, best_area = index, area
+
+        selected.append(best)
+        previous = best
+
+    selected.append(count - 1)
+    return selected
@@ -1,17 +1,41 @@
+import datetime
+import traceback
 import sqlalchemy
 from sqlalchemy.orm.exc import NoResultFound
 from common import models, database
-from common.models import create_tables
-from dependencies import get_db
+from common.models import engine
+from common.migrations import check_schema_version
+from common.partitioning import maintain_partitions
+from common.metrics import render_metrics
+from common.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    InvalidCursorError,
+    invalid_cursor_response,
+    set_next_link,
+)
+from common.routing import CONSISTENCY_TOKEN_HEADER, get_consistency_token
+from common.serialization import render_json
+from common.templates import TemplateDataError
+from dependencies import get_db, get_read_db
 import storage
 from typing import List, Optional
-from common.schemas.checkup import Checkup, CheckupIn
-from fastapi import FastAPI, status, Depends
-from fastapi.responses import JSONResponse
+from pydantic import conlist
+from common.schemas.checkup import (
+    Checkup,
+    CheckupBulkResult,
+    CheckupFilter,
+    CheckupIn,
+    CheckupSearch,
+    CheckupSeries,
+)
+from fastapi import Body, FastAPI, Query, Request, Response, status, Depends
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 app = FastAPI(title="Checkups",
-              description="Checkups service for HospiCloud app.")
+              description="Checkups service for HospiCloud app.",
+              default_response_class=ORJSONResponse)
 
 origins = ["*"]
 
@@ -24,14 +48,47 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+def verify_schema_version():
+    check_schema_version(engine)
+
+
+@app.on_event("startup")
+def create_upcoming_partitions():
+    # Retention runs from `python -m common.partitioning`, startup only makes
+    # sure new checkups always have a partition to land in. Until it works
+    # again they land in the default partition, which is no reason to stay down.
+    try:
+        maintain_partitions(engine, apply_retention=False)
+    except Exception:
+        print(traceback.format_exc())
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_metrics("checkups"))
+
+
 @app.get(
     "/checkups/doctor/{doctor_id}",
     status_code=status.HTTP_200_OK,
     tags=["checkups"],
 )
-async def read_checkups_by_doctor(doctor_id: int, patient_id: Optional[int] = None, db_session=Depends(get_db)):
-    checkups = storage.get_checkups_by_doctor(db_session, doctor_id, patient_id)
-    return checkups
+async def read_checkups_by_doctor(doctor_id: int, request: Request, response: Response,
+                                  patient_id: Optional[int] = None,
+                                  date_from: Optional[datetime.datetime] = None,
+                                  date_to: Optional[datetime.datetime] = None,
+                                  cursor: Optional[str] = None,
+                                  limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                                  db_session=Depends(get_read_db)):
+    try:
+        page = await storage.get_checkups_by_doctor(
+            db_session, doctor_id, patient_id, date_from, date_to, cursor, limit)
+    except InvalidCursorError:
+        return invalid_cursor_response()
+
+    set_next_link(request, response, page)
+    return render_json(page.items, response)
 
 
 @app.get(
@@ -39,9 +96,83 @@ async def read_checkups_by_doctor(doctor_id: int, patient_id: Optional[int] = No
     status_code=status.HTTP_200_OK,
     tags=["checkups"],
 )
-async def read_checkups_by_patient(patient_id: int, doctor_id: Optional[int] = None, db_session=Depends(get_db)):
-    checkups = storage.get_checkups_by_patient(db_session, patient_id, doctor_id)
-    return checkups
+async def read_checkups_by_patient(patient_id: int, request: Request, response: Response,
+                                   doctor_id: Optional[int] = None,
+                                   date_from: Optional[datetime.datetime] = None,
+                                   date_to: Optional[datetime.datetime] = None,
+                                   cursor: Optional[str] = None,
+                                   limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                                   db_session=Depends(get_read_db)):
+    try:
+        page = await storage.get_checkups_by_patient(
+            db_session, patient_id, doctor_id, date_from, date_to, cursor, limit)
+    except InvalidCursorError:
+        return invalid_cursor_response()
+
+    set_next_link(request, response, page)
+    return render_json(page.items, response)
+
+
+@app.get(
+    "/checkups/patient/{patient_id}/series",
+    response_model=CheckupSeries,
+    status_code=status.HTTP_200_OK,
+    tags=["checkups"],
+)
+async def read_patient_series(patient_id: int, field: str, response: Response,
+                              template_id: Optional[int] = None,
+                              date_from: Optional[datetime.datetime] = None,
+                              date_to: Optional[datetime.datetime] = None,
+                              points: int = Query(storage.DEFAULT_SERIES_POINTS, ge=3,
+                                                  le=storage.MAX_SERIES_POINTS),
+                              db_session=Depends(get_read_db)):
+    total_points, timestamps, values = await storage.get_patient_series(
+        db_session, field, patient_id, template_id, date_from, date_to, points)
+
+    return render_json({
+        "field": field,
+        "total_points": total_points,
+        "timestamps": timestamps,
+        "values": values,
+    }, response)
+
+
+@app.post(
+    "/checkups/search",
+    response_model=List[Checkup],
+    status_code=status.HTTP_200_OK,
+    tags=["checkups"],
+)
+async def search_checkups(search: CheckupSearch, request: Request, response: Response,
+                          cursor: Optional[str] = None,
+                          limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                          db_session=Depends(get_read_db)):
+    try:
+        page = await storage.get_checkups_by_data(db_session, search, cursor, limit)
+    except InvalidCursorError:
+        return invalid_cursor_response()
+
+    set_next_link(request, response, page)
+    return render_json(page.items, response)
+
+
+@app.post(
+    "/checkups/filter",
+    response_model=List[Checkup],
+    status_code=status.HTTP_200_OK,
+    tags=["checkups"],
+)
+async def filter_checkups(checkup_filter: CheckupFilter, request: Request, response: Response,
+                          cursor: Optional[str] = None,
+                          limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                          db_session=Depends(get_read_db)):
+    try:
+        page = await storage.get_checkups_by_fields(db_session, checkup_filter, cursor, limit)
+    except InvalidCursorError:
+        return invalid_cursor_response()
+
+    set_next_link(request, response, page)
+    return render_json(page.items, response)
 
 
 @app.post(
@@ -50,16 +181,42 @@ async def read_checkups_by_patient(patient_id: int, doctor_id: Optional[int] = N
     status_code=status.HTTP_201_CREATED,
     tags=["checkups"],
 )
-async def add_checkup(checkup: CheckupIn, db_session=Depends(get_db)):
+async def add_checkup(checkup: CheckupIn, response: Response, db_session=Depends(get_db)):
     try:
-        return storage.create_checkup(db_session, checkup)
+        new_checkup = await storage.create_checkup(db_session, checkup)
+        response.headers[CONSISTENCY_TOKEN_HEADER] = await get_consistency_token(db_session)
+
+        return new_checkup
     except NoResultFound:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content={"mesage": "missing patient identifier"},
         )
+    except TemplateDataError as err:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"message": str(err)},
+        )
     except sqlalchemy.exc.IntegrityError as err:
         return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST,
             content={"message": f"There has been an error inserting data. {err}"},
         )
+
+
+@app.post(
+    "/checkups/bulk",
+    response_model=List[CheckupBulkResult],
+    response_model_exclude_none=True,
+    status_code=status.HTTP_200_OK,
+    tags=["checkups"],
+)
+async def add_checkups_bulk(
+    response: Response,
+    checkups: conlist(CheckupIn, min_items=1, max_items=storage.MAX_BULK_CHECKUPS) = Body(...),
+    db_session=Depends(get_db),
+):
+    results = await storage.create_checkups_bulk(db_session, checkups)
+    response.headers[CONSISTENCY_TOKEN_HEADER] = await get_consistency_token(db_session)
+
+    return results
@@ -1,60 +1,422 @@
-from sqlalchemy.orm import Session
+import datetime
+import json
+import operator
+from typing import Dict, List, Tuple
+from sqlalchemy import and_, func, select
+from sqlalchemy.sql import Select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defaultload, joinedload
 from sqlalchemy.orm.exc import NoResultFound
-from typing import List
-from common.schemas.checkup import CheckupIn
-from common.models import Checkup, User
+from common.schemas.checkup import (
+    CheckupBulkResult,
+    CheckupFilter,
+    CheckupIn,
+    CheckupSearch,
+    FieldPredicate,
+)
+from common.care import record_visits, refresh_relationship
+from common.field_values import (
+    CHECKUP_COLUMNS,
+    delete_field_values,
+    record_field_values,
+)
+from common.models import (
+    Checkup,
+    CheckupFieldValue,
+    Doctor,
+    Patient,
+    User,
+    json_contains,
+    json_number,
+)
+from common.pagination import DEFAULT_PAGE_SIZE, Page, fetch_page
+from common.rollups import record_checkups, remove_checkup
+from common.templates import TemplateDataError, get_template_validators
 from common.utils import get_current_time
+from downsampling import largest_triangle_three_buckets
 
+# Loading profile for the Checkup response model: patient and doctor are
+# joined, the doctors' specialties come in one extra SELECT for the whole
+# page. Every other relationship (the users behind patients and doctors are
+# joined by default) is left out and raises if read, so a page always takes
+# the same two queries however many rows it has.
+CHECKUP_LOADING_OPTIONS = (
+    joinedload(Checkup.patient).raiseload("*"),
+    joinedload(Checkup.doctor).raiseload("*"),
+    defaultload(Checkup.doctor).selectinload(Doctor.specialties).raiseload("*"),
+)
 
-def get_checkup(db: Session, checkup_id: int) -> Checkup:
-    return db.query(Checkup).filter(Checkup.id == checkup_id).first()
+MAX_BULK_CHECKUPS = 10000
 
+DEFAULT_SERIES_POINTS = 500
+MAX_SERIES_POINTS = 5000
+
+BULK_COLUMNS = ("id", "template_id", "doctor_id", "patient_id", "data", "date")
+
+# Newest first, the id breaks ties between checkups sharing a timestamp.
+CHECKUP_PAGE_KEY = (Checkup.date, Checkup.id)
+
+PREDICATE_OPERATORS = {
+    "eq": operator.eq,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+
+
+def filter_by_date(statement: Select, date_from: datetime.datetime = None,
+                   date_to: datetime.datetime = None) -> Select:
+    # Bounds on the partition key let Postgres skip the monthly partitions
+    # outside the range instead of probing every one of them.
+    if date_from:
+        statement = statement.where(Checkup.date >= date_from)
+
+    if date_to:
+        statement = statement.where(Checkup.date < date_to)
+
+    return statement
+
+
+async def get_checkup(db: AsyncSession, checkup_id: int) -> Checkup:
+    result = await db.execute(
+        select(Checkup)
+        .options(*CHECKUP_LOADING_OPTIONS)
+        .where(Checkup.id == checkup_id)
+    )
+    return result.scalars().first()
+
+
+async def get_checkups_by_patient(db: AsyncSession, patient_id: int, doctor_id: int = None,
+                                  date_from: datetime.datetime = None,
+                                  date_to: datetime.datetime = None,
+                                  cursor: str = None, limit: int = DEFAULT_PAGE_SIZE) -> Page:
+    statement = select(Checkup).options(
+        *CHECKUP_LOADING_OPTIONS).where(Checkup.patient_id == patient_id)
 
-def get_checkups_by_patient(db: Session, patient_id: int, doctor_id: int = None) -> List[Checkup]:
     if doctor_id:
-        return db.query(Checkup).filter(Checkup.patient_id == patient_id, Checkup.doctor_id == doctor_id).all()
+        statement = statement.where(Checkup.doctor_id == doctor_id)
+
+    statement = filter_by_date(statement, date_from, date_to)
+
+    return await fetch_page(db, statement, CHECKUP_PAGE_KEY, cursor, limit, descending=True)
 
-    return db.query(Checkup).filter(Checkup.patient_id == patient_id).all()
 
+async def get_checkups_by_doctor(db: AsyncSession, doctor_id: int, patient_id: int = None,
+                                 date_from: datetime.datetime = None,
+                                 date_to: datetime.datetime = None,
+                                 cursor: str = None, limit: int = DEFAULT_PAGE_SIZE) -> Page:
+    statement = select(Checkup).options(
+        *CHECKUP_LOADING_OPTIONS).where(Checkup.doctor_id == doctor_id)
 
-def get_checkups_by_doctor(db: Session, doctor_id: int, patient_id: int = None) -> List[Checkup]:
     if patient_id:
-        return db.query(Checkup).filter(Checkup.doctor_id == doctor_id, Checkup.patient_id == patient_id).all()
+        statement = statement.where(Checkup.patient_id == patient_id)
+
+    statement = filter_by_date(statement, date_from, date_to)
+
+    return await fetch_page(db, statement, CHECKUP_PAGE_KEY, cursor, limit, descending=True)
+
+
+async def get_checkups_by_data(db: AsyncSession, search: CheckupSearch, cursor: str = None,
+                               limit: int = DEFAULT_PAGE_SIZE) -> Page:
+    # Containment is answered by the GIN index on checkup.data in Postgres.
+    statement = select(Checkup).options(
+        *CHECKUP_LOADING_OPTIONS).where(json_contains(Checkup.data, search.data))
+
+    if search.patient_id:
+        statement = statement.where(Checkup.patient_id == search.patient_id)
+
+    if search.doctor_id:
+        statement = statement.where(Checkup.doctor_id == search.doctor_id)
+
+    if search.template_id:
+        statement = statement.where(Checkup.template_id == search.template_id)
+
+    statement = filter_by_date(statement, search.date_from, search.date_to)
+
+    return await fetch_page(db, statement, CHECKUP_PAGE_KEY, cursor, limit, descending=True)
+
+
+def field_predicate(template_id: int, predicate: FieldPredicate):
+    """Checkup ids whose field matches `predicate`, answered by the checkup_field_value indexes."""
+    field = (CheckupFieldValue.template_id == template_id,
+             CheckupFieldValue.field == predicate.field)
+
+    statement = select(CheckupFieldValue.checkup_id).where(*field)
+    for name, compare in PREDICATE_OPERATORS.items():
+        bound = getattr(predicate, name)
+        if bound is not None:
+            statement = statement.where(compare(CheckupFieldValue.value, bound))
+
+    if predicate.latest:
+        latest = (
+            select(CheckupFieldValue.patient_id,
+                   func.max(CheckupFieldValue.date).label("date"))
+            .where(*field)
+            .group_by(CheckupFieldValue.patient_id)
+            .subquery()
+        )
+        statement = statement.join(latest, and_(
+            CheckupFieldValue.patient_id == latest.c.patient_id,
+            CheckupFieldValue.date == latest.c.date,
+        ))
+
+    return Checkup.id.in_(statement)
+
+
+async def get_checkups_by_fields(db: AsyncSession, checkup_filter: CheckupFilter,
+                                 cursor: str = None, limit: int = DEFAULT_PAGE_SIZE) -> Page:
+    statement = select(Checkup).options(*CHECKUP_LOADING_OPTIONS).where(
+        Checkup.template_id == checkup_filter.template_id,
+        *[field_predicate(checkup_filter.template_id, predicate)
+          for predicate in checkup_filter.predicates],
+    )
+
+    if checkup_filter.hospital_id:
+        statement = statement.where(Checkup.doctor_id.in_(
+            select(Doctor.id).where(Doctor.hospital_id == checkup_filter.hospital_id)))
+
+    if checkup_filter.patient_id:
+        statement = statement.where(Checkup.patient_id == checkup_filter.patient_id)
+
+    if checkup_filter.doctor_id:
+        statement = statement.where(Checkup.doctor_id == checkup_filter.doctor_id)
+
+    statement = filter_by_date(statement, checkup_filter.date_from, checkup_filter.date_to)
+
+    return await fetch_page(db, statement, CHECKUP_PAGE_KEY, cursor, limit, descending=True)
+
+
+async def get_patient_series(db: AsyncSession, field: str, patient_id: int,
+                             template_id: int = None,
+                             date_from: datetime.datetime = None,
+                             date_to: datetime.datetime = None,
+                             points: int = DEFAULT_SERIES_POINTS) -> Tuple[int, list, list]:
+    """Dates and values of a numeric field across a patient's checkups, oldest first.
+
+    The field is extracted in the database and checkups where it isn't a
+    number are skipped. Longer series are downsampled to `points` samples.
+    Returns the number of samples before downsampling with both lists.
+    """
+    value = json_number(Checkup.data, field)
+    statement = (
+        select(Checkup.date, value)
+        .where(Checkup.patient_id == patient_id, value.isnot(None))
+        .order_by(Checkup.date, Checkup.id)
+    )
+
+    if template_id:
+        statement = statement.where(Checkup.template_id == template_id)
 
-    return db.query(Checkup).filter(Checkup.doctor_id == doctor_id).all()
+    statement = filter_by_date(statement, date_from, date_to)
 
+    result = await db.execute(statement)
+    rows = result.all()
 
-def create_checkup(db: Session, checkup: CheckupIn) -> Checkup:
+    dates = [date for date, _ in rows]
+    values = [float(value) for _, value in rows]
+
+    if len(rows) > points:
+        selected = largest_triangle_three_buckets(
+            [date.timestamp() for date in dates], values, points)
+        dates = [dates[index] for index in selected]
+        values = [values[index] for index in selected]
+
+    return len(rows), dates, values
+
+
+async def create_checkup(db: AsyncSession, checkup: CheckupIn) -> Checkup:
     if checkup.document_number:
-        patient_id = validate_user_with_document_number(db, checkup.document_number)
-        
+        patient_id = await validate_user_with_document_number(db, checkup.document_number)
+
         checkup.patient_id = patient_id
 
+    validators = await get_template_validators(db, [checkup.template_id])
+    if checkup.template_id not in validators:
+        raise TemplateDataError("template not found")
+
+    checkup.data = validators[checkup.template_id].validate(checkup.data)
+
     new_checkup = Checkup(**checkup.dict(exclude={"document_number"}))
     new_checkup.date = get_current_time()
 
     db.add(new_checkup)
+    await db.flush()
+
+    await record_field_values(
+        db, [{name: getattr(new_checkup, name) for name in CHECKUP_COLUMNS}], validators)
+    await record_visits(
+        db, [(new_checkup.patient_id, new_checkup.doctor_id, new_checkup.date)])
+    await record_checkups(db, [(new_checkup.patient_id, new_checkup.doctor_id,
+                                new_checkup.template_id, new_checkup.date)])
+
+    await db.commit()
+
+    return await get_checkup(db, new_checkup.id)
+
+
+async def create_checkups_bulk(db: AsyncSession, checkups: List[CheckupIn]) -> List[CheckupBulkResult]:
+    """Inserts every valid checkup in one transaction and reports each row's outcome.
+
+    Document numbers and foreign keys are resolved with one query each
+    instead of once per checkup, so a bad row is reported instead of
+    aborting the whole load.
+    """
+    patient_ids = await get_patient_ids_by_document_number(
+        db, {checkup.document_number for checkup in checkups if checkup.document_number})
+
+    for checkup in checkups:
+        if checkup.document_number:
+            checkup.patient_id = patient_ids.get(checkup.document_number)
+
+    existing_patients = await get_existing_ids(
+        db, Patient.id, {checkup.patient_id for checkup in checkups})
+    existing_doctors = await get_existing_ids(
+        db, Doctor.id, {checkup.doctor_id for checkup in checkups})
+    validators = await get_template_validators(
+        db, {checkup.template_id for checkup in checkups})
+
+    date = get_current_time()
+    results = []
+    rows = []
+
+    for index, checkup in enumerate(checkups):
+        if checkup.patient_id not in existing_patients:
+            results.append(CheckupBulkResult(
+                index=index, error="missing patient identifier"))
+        elif checkup.doctor_id not in existing_doctors:
+            results.append(CheckupBulkResult(index=index, error="doctor not found"))
+        elif checkup.template_id not in validators:
+            results.append(CheckupBulkResult(index=index, error="template not found"))
+        else:
+            try:
+                data = validators[checkup.template_id].validate(checkup.data)
+            except TemplateDataError as err:
+                results.append(CheckupBulkResult(index=index, error=str(err)))
+                continue
+
+            result = CheckupBulkResult(index=index)
+            results.append(result)
+            rows.append((result, {
+                **checkup.dict(exclude={"document_number"}),
+                "data": data,
+                "date": date,
+            }))
+
+    if not rows:
+        return results
+
+    if db.bind.dialect.name == "postgresql":
+        ids = await copy_checkups(db, [row for _, row in rows])
+    else:
+        ids = await insert_checkups(db, [row for _, row in rows])
+
+    await record_field_values(
+        db, [{**row, "id": checkup_id} for (_, row), checkup_id in zip(rows, ids)],
+        validators)
+    await record_visits(
+        db, [(row["patient_id"], row["doctor_id"], row["date"]) for _, row in rows])
+    await record_checkups(
+        db, [(row["patient_id"], row["doctor_id"], row["template_id"], row["date"])
+             for _, row in rows])
+
+    await db.commit()
+
+    for (result, _), checkup_id in zip(rows, ids):
+        result.id = checkup_id
+
+    return results
+
+
+async def get_patient_ids_by_document_number(db: AsyncSession, document_numbers: set) -> Dict[str, int]:
+    if not document_numbers:
+        return {}
+
+    result = await db.execute(
+        select(User.document_number, Patient.id)
+        .join(Patient.user)
+        .where(User.document_number.in_(document_numbers))
+        .order_by(Patient.id.desc())
+    )
+
+    # Same pick as validate_user_with_document_number: the lowest patient id wins.
+    return {document_number: patient_id for document_number, patient_id in result.all()}
+
+
+async def get_existing_ids(db: AsyncSession, column, ids: set) -> set:
+    ids = {value for value in ids if value is not None}
+    if not ids:
+        return set()
+
+    result = await db.execute(select(column).where(column.in_(ids)))
+    return set(result.scalars().all())
+
+
+async def copy_checkups(db: AsyncSession, rows: List[dict]) -> List[int]:
+    # Ids are drawn up front so every row can be matched to its result
+    # without relying on the order rows come back from the server.
+    result = await db.execute(
+        text("SELECT nextval(pg_get_serial_sequence('checkup', 'id')) "
+             "FROM generate_series(1, :count)"),
+        {"count": len(rows)},
+    )
+    ids = result.scalars().all()
+
+    # The pooled connection of the session's transaction, driver_connection
+    # is the asyncpg connection behind SQLAlchemy's DBAPI adapter.
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    asyncpg_connection = raw_connection.driver_connection
+
+    await asyncpg_connection.copy_records_to_table(
+        Checkup.__tablename__,
+        columns=BULK_COLUMNS,
+        records=[
+            (checkup_id, row["template_id"], row["doctor_id"], row["patient_id"],
+             json.dumps(row["data"]), row["date"])
+            for checkup_id, row in zip(ids, rows)
+        ],
+    )
+
+    return ids
+
+
+async def insert_checkups(db: AsyncSession, rows: List[dict]) -> List[int]:
+    # Fallback for databases without COPY (SQLite in the tests), still a
+    # single transaction with no refresh per checkup.
+    new_checkups = [Checkup(**row) for row in rows]
 
-    db.commit()
-    db.refresh(new_checkup)
+    db.add_all(new_checkups)
+    await db.flush()
 
-    return new_checkup
+    return [checkup.id for checkup in new_checkups]
 
 
-def delete_checkup(db: Session, checkup_id: int) -> Checkup:
-    checkup = db.query(Checkup).get(checkup_id)
+async def delete_checkup(db: AsyncSession, checkup_id: int) -> Checkup:
+    checkup = await get_checkup(db, checkup_id)
     if not checkup:
         return None
 
-    db.delete(checkup)
-    db.commit()
+    await db.delete(checkup)
+    await delete_field_values(db, checkup.id)
+    await db.flush()
+    await refresh_relationship(db, checkup.patient_id, checkup.doctor_id)
+    await remove_checkup(
+        db, (checkup.patient_id, checkup.doctor_id, checkup.template_id, checkup.date))
+    await db.commit()
 
     return checkup
 
 
-def validate_user_with_document_number(db: Session, document_number: int):
-    user = db.query(User).filter(User.document_number == document_number).first()
-    if not user:
+async def validate_user_with_document_number(db: AsyncSession, document_number: int):
+    result = await db.execute(
+        select(Patient.id)
+        .join(Patient.user)
+        .where(User.document_number == document_number)
+        .order_by(Patient.id)
+    )
+    patient_id = result.scalars().first()
+    if not patient_id:
         raise NoResultFound
 
-    return user.patient.id
+    return patient_id
@@ -1,14 +1,17 @@
 import datetime
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 import pytest
 
 from main import app
 from common.database import start_engine
 from common.models import Base, User, Patient, Doctor, Template, Hospital, Checkup
-from dependencies import get_db
+from common.templates import template_validators
+from dependencies import get_db, get_read_db
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
@@ -19,6 +22,16 @@ TestingSessionLocal = sessionmaker(
 TestingSessionLocal = sessionmaker(
     autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+
+TestingAsyncSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+    bind=async_engine,
+    class_=AsyncSession,
+)
+
 
 @pytest.fixture()
 def test_db():
@@ -64,10 +77,10 @@ def test_db():
     ]
 
     template = Template(
-        numeric_fields=0,
+        numeric_fields=1,
         alphanumeric_fields=1,
         file_upload_fields=0,
-        headers="{'test':'str'}",
+        headers={"test": "string", "age": "int"},
     )
 
     checkups = [
@@ -75,13 +88,15 @@ def test_db():
             template_id=1,
             doctor_id=1,
             patient_id=1,
-            data="{'test':'str'}"
+            data={"test": "str"},
+            date=datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc),
         ),
         Checkup(
             template_id=1,
             doctor_id=1,
             patient_id=1,
-            data="{'test2':'str'}"
+            data={"test2": "str"},
+            date=datetime.datetime(2021, 1, 2, tzinfo=datetime.timezone.utc),
         ),
         Checkup(
             template_id=1,
@@ -98,16 +113,18 @@ def test_db():
     db.add(template)
     db.add_all(checkups)
     db.commit()
+    template_validators.clear()
     yield
     Base.metadata.drop_all(bind=engine)
 
 
-def override_get_db():
+async def override_get_db():
+    db = TestingAsyncSessionLocal()
     try:
-        db = TestingSessionLocal()
         yield db
     finally:
-        db.close()
+        await db.close()
 
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
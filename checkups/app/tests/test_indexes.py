@@ -0,0 +1,85 @@
+import datetime
+import pytest
+
+import storage
+from common import testing
+from common.models import Base, Checkup, Doctor, Patient, User
+from .test_db import engine, async_engine, TestingSessionLocal, TestingAsyncSessionLocal
+
+INDEXED_TABLES = ("checkup", "user", "patient", "doctor", "specialty", "doctor_specialty")
+
+
+@pytest.fixture()
+def seeded_db():
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+
+    users = [
+        User(
+            user_role="patient",
+            document_type="national_id",
+            name="test",
+            last_name="test",
+            email=f"patient{index}@test",
+            document_number=f"{index:011d}",
+            date_of_birth=datetime.date(2000, 1, 20),
+        )
+        for index in range(200)
+    ]
+    patients = [Patient(user=user, blood_type="a_plus") for user in users]
+    doctors = [Doctor(hospital_id=1, schedule="L 8:00 - 12:00")
+               for _ in range(10)]
+
+    db.add_all(users)
+    db.add_all(patients)
+    db.add_all(doctors)
+    db.flush()
+
+    start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    db.add_all([
+        Checkup(
+            template_id=1,
+            doctor_id=doctors[index % len(doctors)].id,
+            patient_id=patients[index % len(patients)].id,
+            date=start + datetime.timedelta(hours=index),
+        )
+        for index in range(2000)
+    ])
+    db.commit()
+    db.execute("ANALYZE")
+    db.close()
+
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+def capture_query_plans(query):
+    return testing.capture_query_plans(engine, async_engine, TestingAsyncSessionLocal, query)
+
+
+def assert_no_table_scans(plans):
+    testing.assert_no_table_scans(plans, INDEXED_TABLES)
+
+
+def test_get_checkups_by_patient_uses_indexes(seeded_db):
+    plans = capture_query_plans(
+        lambda db: storage.get_checkups_by_patient(db, 5))
+
+    assert_no_table_scans(plans)
+    assert any("ix_checkup_patient_id_date" in detail for detail in plans)
+
+
+def test_get_checkups_by_doctor_and_patient_uses_indexes(seeded_db):
+    plans = capture_query_plans(
+        lambda db: storage.get_checkups_by_doctor(db, 3, 13))
+
+    assert_no_table_scans(plans)
+    assert any("ix_checkup_doctor_id_patient_id_date" in detail for detail in plans)
+
+
+def test_validate_user_with_document_number_uses_indexes(seeded_db):
+    plans = capture_query_plans(
+        lambda db: storage.validate_user_with_document_number(db, "00000000042"))
+
+    assert_no_table_scans(plans)
+    assert any("ix_user_document_number" in detail for detail in plans)
@@ -1,18 +1,48 @@
+import asyncio
 import datetime
+import json
+from typing import List
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+from fastapi import Response
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker
 import pytest
 
+import storage
 from main import app
-from .test_db import test_db
+from common.database import start_async_engine
+from common.field_values import backfill_field_values
+from common.rollups import reconcile_rollups
+from common.models import (
+    CareRelationship,
+    Checkup as CheckupModel,
+    HospitalDailyCheckups,
+    HospitalPatient,
+    HospitalRollup,
+    Template,
+)
+from common.schemas.checkup import Checkup
+from common.serialization import render_json
+from common.templates import get_template_validators
+from .test_db import (
+    test_db,
+    engine,
+    async_engine,
+    TestingSessionLocal,
+    TestingAsyncSessionLocal,
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+)
 
 client = TestClient(app)
 
 
 def test_add_checkup(test_db):
     payload = {
-        "data": "{'test':'test'}",
+        "data": {"test": "test"},
         "doctor_id": 1,
         "patient_id": 1,
         "template_id": 1,
@@ -22,12 +52,12 @@ def test_add_checkup(test_db):
     assert response.status_code == 201
     assert data["doctor"]["id"] == 1
     assert data["patient"]["id"] == 1
-    assert data["data"] == "{'test':'test'}"
+    assert data["data"] == {"test": "test"}
 
 
 def test_get_checkups_by_patient(test_db):
     payload = {
-        "data": "{'test':'test'}",
+        "data": {"test": "test"},
         "doctor_id": 1,
         "patient_id": 1,
         "template_id": 1,
@@ -41,7 +71,7 @@ def test_get_checkups_by_patient(test_db):
 
 def test_get_checkups_by_doctor(test_db):
     payload = {
-        "data": "{'test':'test'}",
+        "data": {"test": "test"},
         "doctor_id": 1,
         "patient_id": 1,
         "template_id": 1,
@@ -53,6 +83,36 @@ def test_get_checkups_by_doctor(test_db):
     assert len(data) > 0
 
 
+def count_queries(url: str) -> int:
+    statements = []
+
+    def record(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+    assert response.status_code == 200
+    return len(statements)
+
+
+def test_checkup_lists_take_fixed_number_of_queries(test_db):
+    expected = count_queries("/checkups/patient/1")
+
+    payload = [
+        {"data": {"test": "load"}, "doctor_id": 1, "patient_id": patient_id, "template_id": 1}
+        for patient_id in (1, 2) for _ in range(10)
+    ]
+    client.post("/checkups/bulk", json=payload)
+
+    assert expected == 2
+    assert count_queries("/checkups/patient/1") == expected
+    assert count_queries("/checkups/doctor/1") == expected
+
+
 def test_get_checkups_by_doctor_from_specified_patient(test_db):
     response = client.get("/checkups/doctor/1?patient_id=1")
 
@@ -69,9 +129,79 @@ def test_get_checkups_by_patient_from_specified_doctor(test_db):
 
     assert response.status_code == 200
     assert len(data) == 2
+
+
+def test_get_checkups_by_patient_within_dates(test_db):
+    response = client.get(
+        "/checkups/patient/1?date_from=2021-01-01T00:00:00Z&date_to=2021-01-02T00:00:00Z")
+
+    data = response.json()
+
+    assert response.status_code == 200
+    assert len(data) == 1
+    assert data[0]["data"] == {"test": "str"}
+
+
+def test_get_checkups_by_patient_paginated(test_db):
+    response = client.get("/checkups/patient/1?limit=1")
+    first_page = response.json()
+
+    assert response.status_code == 200
+    assert first_page[0]["data"] == {"test2": "str"}
+
+    next_url = response.headers["link"].split(">;")[0].lstrip("<")
+    response = client.get(next_url)
+    second_page = response.json()
+
+    assert response.status_code == 200
+    assert second_page[0]["data"] == {"test": "str"}
+    assert "link" not in response.headers
+
+
+def test_search_checkups_by_data(test_db):
+    response = client.post("/checkups/search", json={"data": {"test": "str"}})
+
+    data = response.json()
+
+    assert response.status_code == 200
+    assert len(data) == 1
+    assert data[0]["data"] == {"test": "str"}
+
+
+def test_search_checkups_by_nested_data(test_db):
+    db = TestingSessionLocal()
+    db.add(CheckupModel(
+        template_id=1,
+        doctor_id=1,
+        patient_id=1,
+        data={"test": "nested", "vitals": {"pulse": 70, "tags": ["rest"]}, "note": None},
+    ))
+    db.commit()
+    db.close()
+
+    def search(data):
+        response = client.post("/checkups/search", json={"data": data})
+        assert response.status_code == 200
+        return [checkup["data"]["test"] for checkup in response.json()]
+
+    assert search({"vitals": {"pulse": 70, "tags": ["rest"]}}) == ["nested"]
+    assert search({"vitals": {"pulse": 80, "tags": ["rest"]}}) == []
+    assert search({"vitals": "{'pulse': 70, 'tags': ['rest']}"}) == []
+    assert search({"note": None, "test": "nested"}) == ["nested"]
+    assert search({"test": None}) == []
+
+
+def test_search_checkups_by_data_and_patient(test_db):
+    response = client.post(
+        "/checkups/search", json={"data": {"test2": "str"}, "patient_id": 2})
+
+    assert response.status_code == 200
+    assert len(response.json()) == 0
+
+
 def test_create_checkup_with_document_number(test_db):
     payload = {
-        "data": "{'test':'test'}",
+        "data": {"test": "test"},
         "doctor_id": 1,
         "document_number": "12345654321",
         "template_id": 1,
@@ -87,7 +217,7 @@ def test_create_checkup_with_document_number(test_db):
 
 def test_create_checkup_with_document_number_missing(test_db):
     payload = {
-        "data": "{'test':'test'}",
+        "data": {"test": "test"},
         "doctor_id": 1,
         "document_number": "14",
         "template_id": 1,
@@ -96,3 +226,291 @@ def test_create_checkup_with_document_number_missing(test_db):
     response = client.post("/checkups/", json=payload)
 
     assert response.status_code == 404
+
+
+def test_create_checkups_bulk(test_db):
+    payload = [
+        {"data": {"test": "bulk"}, "doctor_id": 1, "patient_id": 1, "template_id": 1},
+        {"data": {"test": "bulk"}, "doctor_id": 1,
+            "document_number": "12345654321", "template_id": 1},
+        {"data": {"test": "bulk"}, "doctor_id": 1,
+            "document_number": "14", "template_id": 1},
+        {"data": {"test": "bulk"}, "doctor_id": 99, "patient_id": 1, "template_id": 1},
+    ]
+
+    response = client.post("/checkups/bulk", json=payload)
+
+    data = response.json()
+
+    assert response.status_code == 200
+    assert [result["index"] for result in data] == [0, 1, 2, 3]
+    assert "error" not in data[0] and "error" not in data[1]
+    assert data[2]["error"] == "missing patient identifier"
+    assert data[3]["error"] == "doctor not found"
+
+    response = client.post(
+        "/checkups/search", json={"data": {"test": "bulk"}, "patient_id": 1})
+
+    assert len(response.json()) == 2
+
+
+def test_add_checkup_coerces_data_to_template(test_db):
+    payload = {
+        "data": {"test": "coerced", "age": "42"},
+        "doctor_id": 1,
+        "patient_id": 1,
+        "template_id": 1,
+    }
+
+    response = client.post("/checkups/", json=payload)
+
+    assert response.status_code == 201
+    assert response.json()["data"] == {"test": "coerced", "age": 42}
+
+
+@pytest.mark.parametrize("data, message", [
+    ({"test": "test", "unknown": "value"}, "unknown field unknown"),
+    ({"age": "forty"}, "age must be of type int"),
+])
+def test_add_checkup_rejects_data_not_matching_template(test_db, data, message):
+    payload = {"data": data, "doctor_id": 1, "patient_id": 1, "template_id": 1}
+
+    response = client.post("/checkups/", json=payload)
+
+    assert response.status_code == 400
+    assert response.json() == {"message": message}
+
+
+def test_create_checkups_bulk_reports_invalid_data(test_db):
+    payload = [
+        {"data": {"age": 30}, "doctor_id": 1, "patient_id": 1, "template_id": 1},
+        {"data": {"age": [30]}, "doctor_id": 1, "patient_id": 1, "template_id": 1},
+        {"data": {"age": 30}, "doctor_id": 1, "patient_id": 1, "template_id": 99},
+    ]
+
+    data = client.post("/checkups/bulk", json=payload).json()
+
+    assert "error" not in data[0]
+    assert data[1]["error"] == "age must be of type int"
+    assert data[2]["error"] == "template not found"
+
+
+def test_checkups_of_templates_with_invalid_headers_are_rejected(test_db):
+    db = TestingSessionLocal()
+    db.add(Template(id=2, title="legacy", headers={"age": "integer"}))
+    db.commit()
+    db.close()
+
+    payload = {"data": {"age": 30}, "doctor_id": 1, "patient_id": 1, "template_id": 2}
+    message = "template 2 has invalid headers: Invalid header type integer for age"
+
+    response = client.post("/checkups/", json=payload)
+
+    assert response.status_code == 400
+    assert response.json() == {"message": message}
+
+    data = client.post("/checkups/bulk", json=[payload, {**payload, "template_id": 1}]).json()
+
+    assert data[0]["error"] == message
+    assert "error" not in data[1]
+
+
+def test_template_validators_are_recompiled_after_update(test_db):
+    async def load_validator():
+        async with TestingAsyncSessionLocal() as db:
+            return (await get_template_validators(db, [1]))[1]
+
+    loop = asyncio.get_event_loop()
+    compiled = loop.run_until_complete(load_validator())
+
+    assert loop.run_until_complete(load_validator()) is compiled
+
+    db = TestingSessionLocal()
+    template = db.query(Template).get(1)
+    template.headers = {"test": "string"}
+    template.updated_at = datetime.datetime(2021, 2, 1, tzinfo=datetime.timezone.utc)
+    db.commit()
+    db.close()
+
+    recompiled = loop.run_until_complete(load_validator())
+
+    assert recompiled is not compiled
+    assert set(recompiled.fields) == {"test"}
+
+
+def add_age_checkups(ages, patient_id=1):
+    start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+    db = TestingSessionLocal()
+    db.add_all([
+        CheckupModel(
+            template_id=1,
+            doctor_id=1,
+            patient_id=patient_id,
+            data={"test": "series", "age": age},
+            date=start + datetime.timedelta(days=day),
+        )
+        for day, age in enumerate(ages)
+    ])
+    db.commit()
+    db.close()
+
+
+def test_get_patient_series(test_db):
+    add_age_checkups([30, "thirty-one", 32])
+    add_age_checkups([50], patient_id=2)
+
+    response = client.get("/checkups/patient/1/series?field=age")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["total_points"] == 2
+    assert data["values"] == [30, 32]
+    assert [timestamp[:10] for timestamp in data["timestamps"]] == ["2020-01-01", "2020-01-03"]
+
+
+def test_get_patient_series_is_downsampled(test_db):
+    ages = [20] * 100
+    ages[42] = 90
+    add_age_checkups(ages)
+
+    response = client.get("/checkups/patient/1/series?field=age&points=10")
+    data = response.json()
+
+    assert data["total_points"] == 100
+    assert len(data["values"]) == len(data["timestamps"]) == 10
+    assert 90 in data["values"]
+    assert data["timestamps"][0][:10] == "2020-01-01"
+    assert data["timestamps"][-1][:10] == "2020-04-09"
+
+
+def test_filter_checkups_by_field_value(test_db):
+    for age in (20, 45, 70):
+        client.post("/checkups/", json={
+            "data": {"test": "filter", "age": str(age)},
+            "doctor_id": 1,
+            "patient_id": 1,
+            "template_id": 1,
+        })
+
+    response = client.post("/checkups/filter", json={
+        "template_id": 1,
+        "predicates": [{"field": "age", "gt": 30, "lte": 70}],
+    })
+    data = response.json()
+
+    assert response.status_code == 200
+    assert sorted(checkup["data"]["age"] for checkup in data) == [45, 70]
+
+
+def test_filter_checkups_by_latest_value_after_backfill(test_db):
+    add_age_checkups([250, 100], patient_id=1)
+    add_age_checkups([100, 250], patient_id=2)
+
+    assert backfill_field_values(engine, batch_size=2) == 4
+    assert backfill_field_values(engine) == 4
+
+    response = client.post("/checkups/filter", json={
+        "template_id": 1,
+        "predicates": [{"field": "age", "gt": 200, "latest": True}],
+    })
+    data = response.json()
+
+    assert [(checkup["patient"]["id"], checkup["data"]["age"]) for checkup in data] == [(2, 250)]
+
+
+def test_render_json_of_checkups_matches_response_model(test_db):
+    async def load_checkups():
+        async with TestingAsyncSessionLocal() as db:
+            return (await storage.get_checkups_by_patient(db, 1)).items
+
+    checkups = asyncio.get_event_loop().run_until_complete(load_checkups())
+    expected = json.loads(json.dumps(jsonable_encoder(parse_obj_as(List[Checkup], checkups))))
+
+    assert len(checkups) > 0
+    assert orjson.loads(render_json(checkups, Response()).body) == expected
+
+
+def get_care_relationships():
+    db = TestingSessionLocal()
+    try:
+        return {
+            (relationship.patient_id, relationship.doctor_id): relationship.visit_count
+            for relationship in db.query(CareRelationship).all()
+        }
+    finally:
+        db.close()
+
+
+def test_checkups_maintain_care_relationships(test_db):
+    payload = {"data": {"test": "care"}, "doctor_id": 1, "template_id": 1}
+
+    client.post("/checkups/", json={**payload, "patient_id": 1})
+    client.post("/checkups/bulk", json=[
+        {**payload, "patient_id": 1},
+        {**payload, "patient_id": 2},
+        {**payload, "patient_id": 2},
+    ])
+
+    assert get_care_relationships() == {(1, 1): 2, (2, 1): 2}
+
+
+def get_rollups():
+    db = TestingSessionLocal()
+    try:
+        return {
+            "hospitals": [
+                (rollup.hospital_id, rollup.doctors, rollup.patients)
+                for rollup in db.query(HospitalRollup).order_by(HospitalRollup.hospital_id)
+            ],
+            "patients": sorted(
+                (row.hospital_id, row.patient_id) for row in db.query(HospitalPatient)),
+            "daily": sorted(
+                (row.hospital_id, row.day, row.specialty_id, row.checkups)
+                for row in db.query(HospitalDailyCheckups) if row.checkups),
+        }
+    finally:
+        db.close()
+
+
+def test_checkups_maintain_hospital_rollups(test_db):
+    reconcile_rollups(engine)
+    payload = {"data": {"test": "rollup"}, "doctor_id": 1, "template_id": 1}
+
+    created = client.post("/checkups/", json={**payload, "patient_id": 1}).json()
+    client.post("/checkups/bulk", json=[
+        {**payload, "patient_id": 1},
+        {**payload, "patient_id": 2},
+    ])
+
+    rollups = get_rollups()
+    assert rollups["hospitals"] == [(1, 1, 2)]
+    assert rollups["patients"] == [(1, 1), (1, 2)]
+
+    async def delete_checkup():
+        async with TestingAsyncSessionLocal() as db:
+            await storage.delete_checkup(db, created["id"])
+
+    asyncio.get_event_loop().run_until_complete(delete_checkup())
+    rollups = get_rollups()
+
+    reconcile_rollups(engine)
+
+    assert get_rollups() == rollups
+
+
+def test_metrics_exports_pool_usage(test_db):
+    engine = start_async_engine("metrics-test", ASYNC_SQLALCHEMY_DATABASE_URL)
+
+    async def run_query():
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+        await engine.dispose()
+
+    asyncio.get_event_loop().run_until_complete(run_query())
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert 'db_pool_checkout_wait_seconds_count{service="checkups",pool="metrics-test"} 1' in response.text
+    assert 'db_pool_checked_out{service="checkups",pool="primary"} 0' in response.text
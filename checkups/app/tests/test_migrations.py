@@ -0,0 +1,91 @@
+import os
+import pytest
+from sqlalchemy import create_engine, inspect
+
+from common.migrations import (
+    LATEST_VERSION,
+    SchemaVersionError,
+    check_schema_version,
+    migrate,
+    v001_initial_schema,
+)
+from common.models import Base
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test_migrations.db"
+
+
+@pytest.fixture()
+def migrations_engine():
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    )
+    yield engine
+    engine.dispose()
+    os.remove("./test_migrations.db")
+
+
+def test_check_schema_version_fails_on_empty_database(migrations_engine):
+    with pytest.raises(SchemaVersionError):
+        check_schema_version(migrations_engine)
+
+
+def test_migrate_applies_pending_migrations_once(migrations_engine):
+    applied = migrate(migrations_engine)
+
+    assert applied[-1] == LATEST_VERSION
+    assert migrate(migrations_engine) == []
+
+    check_schema_version(migrations_engine)
+
+
+def test_initial_schema_only_creates_the_baseline_tables(migrations_engine):
+    with migrations_engine.begin() as connection:
+        v001_initial_schema.upgrade(connection)
+
+    inspector = inspect(migrations_engine)
+
+    assert set(inspector.get_table_names()) == set(v001_initial_schema.metadata.tables)
+    assert inspector.get_indexes("checkup") == []
+
+
+def test_migrations_build_the_models_schema(migrations_engine):
+    migrate(migrations_engine)
+
+    inspector = inspect(migrations_engine)
+
+    for table in Base.metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        assert columns == set(table.columns.keys()), table.name
+
+        # The GIN index of migration 3 only exists on Postgres.
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        assert indexes == {index.name for index in table.indexes
+                           if index.name != "ix_checkup_data"}, table.name
+
+
+def test_migrations_backfill_existing_rows(migrations_engine):
+    with migrations_engine.begin() as connection:
+        v001_initial_schema.upgrade(connection)
+        connection.exec_driver_sql("INSERT INTO hospital (id, name) VALUES (1, 'Central')")
+        connection.exec_driver_sql(
+            "INSERT INTO user (id, email) VALUES (1, 'doctor@gmail.com'), (2, 'patient@gmail.com')")
+        connection.exec_driver_sql("INSERT INTO doctor (id, user_id, hospital_id) VALUES (1, 1, 1)")
+        connection.exec_driver_sql("INSERT INTO patient (id, user_id) VALUES (1, 2)")
+        connection.exec_driver_sql(
+            "INSERT INTO checkup (patient_id, doctor_id, data, date) VALUES "
+            "(1, 1, '{}', '2021-03-01 15:00:00.000000'), "
+            "(1, 1, '{}', '2021-03-02 15:00:00.000000')")
+
+    migrate(migrations_engine)
+
+    with migrations_engine.connect() as connection:
+        care = connection.exec_driver_sql(
+            "SELECT patient_id, doctor_id, visit_count FROM care_relationship").all()
+        rollup = connection.exec_driver_sql(
+            "SELECT hospital_id, doctors, admins, patients FROM hospital_rollup").all()
+        daily = connection.exec_driver_sql(
+            "SELECT day, specialty_id, checkups FROM hospital_daily_checkups ORDER BY day").all()
+
+    assert care == [(1, 1, 2)]
+    assert rollup == [(1, 1, 0, 1)]
+    assert daily == [("2021-03-01", 0, 1), ("2021-03-02", 0, 1)]
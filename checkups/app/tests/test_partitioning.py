@@ -0,0 +1,149 @@
+import datetime
+
+from sqlalchemy import delete
+
+import main
+from common.care import summarize_visits
+from common.field_values import backfill_field_values
+from common.models import (
+    CareRelationship,
+    Checkup,
+    CheckupFieldValue,
+    HospitalDailyCheckups,
+    HospitalPatient,
+)
+from common.partitioning import (
+    DEFAULT_PARTITION,
+    add_months,
+    create_partitions,
+    get_retention_cutoff,
+    maintain_partitions,
+    month_start,
+    partition_month,
+    partition_name,
+    prune_expired_dependents,
+    utc_midnight,
+)
+from common.rollups import reconcile_rollups
+from .test_db import engine, test_db, TestingSessionLocal
+
+
+def test_add_months_crosses_years():
+    assert add_months(datetime.date(2021, 11, 1), 3) == datetime.date(2022, 2, 1)
+    assert add_months(datetime.date(2021, 1, 1), -1) == datetime.date(2020, 12, 1)
+
+
+def test_month_start_uses_utc_months():
+    value = datetime.datetime(
+        2021, 3, 31, 22, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=-4)))
+
+    assert month_start(value) == datetime.date(2021, 4, 1)
+
+
+def test_partition_name_round_trips():
+    month = datetime.date(2021, 7, 1)
+
+    assert partition_name(month) == "checkup_p2021_07"
+    assert partition_month(partition_name(month)) == month
+    assert partition_month("checkup_default") is None
+
+
+def test_retention_cutoff(monkeypatch):
+    now = datetime.datetime(2021, 7, 15, tzinfo=datetime.timezone.utc)
+
+    monkeypatch.setenv("CHECKUP_RETENTION_MONTHS", "0")
+    assert get_retention_cutoff(now) is None
+
+    monkeypatch.setenv("CHECKUP_RETENTION_MONTHS", "24")
+    assert get_retention_cutoff(now) == datetime.date(2019, 7, 1)
+
+
+def test_maintain_partitions_skips_unpartitioned_databases():
+    assert maintain_partitions(engine) == ([], [])
+
+
+class RecordingConnection:
+    """Stands in for a Postgres connection whose default partition holds rows."""
+
+    def __init__(self, partitions):
+        self.partitions = partitions
+        self.statements = []
+
+    def execute(self, statement, parameters=None):
+        sql = str(statement)
+        self.statements.append(sql)
+
+        connection = self
+
+        class Result:
+            def scalar(self):
+                return sql.strip().startswith("SELECT EXISTS")
+
+            def scalars(self):
+                return self
+
+            def all(self):
+                return connection.partitions
+
+        return Result()
+
+    def exec_driver_sql(self, statement):
+        self.statements.append(statement)
+
+
+def test_create_partitions_moves_rows_out_of_the_default_partition():
+    connection = RecordingConnection([DEFAULT_PARTITION])
+    month = datetime.date(2021, 7, 1)
+
+    assert create_partitions(connection, month, month) == ["checkup_p2021_07"]
+
+    create, move, attach = [statement.strip() for statement in connection.statements[-3:]]
+    assert create.startswith("CREATE TABLE checkup_p2021_07 (LIKE checkup")
+    assert f"DELETE FROM {DEFAULT_PARTITION}" in move
+    assert "INSERT INTO checkup_p2021_07" in move
+    assert attach.startswith("ALTER TABLE checkup ATTACH PARTITION checkup_p2021_07")
+
+
+def test_startup_survives_partition_maintenance_errors(monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("updated partition constraint would be violated")
+
+    monkeypatch.setattr(main, "maintain_partitions", fail)
+
+    main.create_upcoming_partitions()
+
+
+def test_prune_expired_dependents_follows_the_retired_checkups(test_db):
+    db = TestingSessionLocal()
+    db.add_all([
+        Checkup(template_id=1, doctor_id=1, patient_id=patient_id, data={"age": 40},
+                date=datetime.datetime(2021, month, 10, tzinfo=datetime.timezone.utc))
+        for patient_id, month in ((1, 1), (1, 3), (2, 1))
+    ])
+    db.commit()
+
+    visits = db.query(Checkup.patient_id, Checkup.doctor_id, Checkup.date).all()
+    db.add_all([CareRelationship(**row) for row in summarize_visits(visits)])
+    db.commit()
+    backfill_field_values(engine)
+    reconcile_rollups(engine)
+
+    # What detaching the partitions before March does on Postgres.
+    cutoff = datetime.date(2021, 2, 1)
+    db.execute(delete(Checkup).where(Checkup.date < utc_midnight(cutoff)))
+    db.commit()
+
+    with engine.begin() as connection:
+        prune_expired_dependents(connection, cutoff)
+
+    try:
+        assert [value.date.month for value in db.query(CheckupFieldValue)] == [3]
+        relationships = {
+            relationship.patient_id: relationship for relationship in db.query(CareRelationship)}
+        assert {patient_id: relationship.visit_count
+                for patient_id, relationship in relationships.items()} == {1: 1, 2: 1}
+        assert relationships[1].first_seen.month == 3
+        assert sorted(row.patient_id for row in db.query(HospitalPatient)) == [1, 2]
+        assert all(row.day >= cutoff for row in db.query(HospitalDailyCheckups))
+    finally:
+        db.close()
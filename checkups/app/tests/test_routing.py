@@ -0,0 +1,90 @@
+import asyncio
+import os
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+import dependencies
+from main import app
+from common.models import Base, Hospital
+from common.routing import CONSISTENCY_TOKEN_HEADER, RoutingSession
+from dependencies import get_read_db
+from .test_db import test_db, async_engine
+
+REPLICA_DATABASE_URL = "sqlite:///./test_replica.db"
+ASYNC_REPLICA_DATABASE_URL = "sqlite+aiosqlite:///./test_replica.db"
+
+client = TestClient(app)
+
+
+@pytest.fixture()
+def replica_db(monkeypatch):
+    replica_engine = create_engine(
+        REPLICA_DATABASE_URL, connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=replica_engine)
+
+    async_replica_engine = create_async_engine(ASYNC_REPLICA_DATABASE_URL)
+
+    TestingRoutingSessionLocal = sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+        bind=async_engine,
+        class_=AsyncSession,
+        sync_session_class=RoutingSession,
+        replica=async_replica_engine.sync_engine,
+    )
+
+    monkeypatch.setattr(
+        dependencies, "AsyncReadSessionLocal", TestingRoutingSessionLocal)
+    monkeypatch.delitem(app.dependency_overrides, get_read_db)
+
+    yield
+
+    Base.metadata.drop_all(bind=replica_engine)
+    replica_engine.dispose()
+    os.remove("./test_replica.db")
+
+
+def test_reads_are_served_by_the_replica(test_db, replica_db):
+    response = client.get("/checkups/patient/1")
+
+    assert response.status_code == 200
+    assert len(response.json()) == 0
+
+
+def test_consistency_token_reads_own_writes(test_db, replica_db):
+    payload = {
+        "data": {"test": "test"},
+        "doctor_id": 1,
+        "patient_id": 1,
+        "template_id": 1,
+    }
+
+    response = client.post("/checkups/", json=payload)
+    token = response.headers[CONSISTENCY_TOKEN_HEADER]
+
+    response = client.get(
+        "/checkups/patient/1",
+        headers={CONSISTENCY_TOKEN_HEADER: token},
+    )
+
+    assert response.status_code == 200
+    assert len(response.json()) == 3
+
+
+def test_routing_session_sticks_to_primary_after_write(test_db, replica_db):
+    async def write_then_read():
+        db = dependencies.AsyncReadSessionLocal()
+        try:
+            db.add(Hospital(name="Written hospital"))
+            await db.flush()
+
+            return db.sync_session.use_primary
+        finally:
+            await db.close()
+
+    assert asyncio.get_event_loop().run_until_complete(write_then_read())
@@ -0,0 +1,102 @@
+"""Compares FastAPI's response_model path with render_json, as the list endpoints call it.
+
+    python -m common.benchmarks.serialization [rows]
+"""
+import datetime
+import json
+import sys
+import timeit
+from typing import List
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import parse_obj_as
+
+from common.models import Checkup, Doctor, Patient, Specialty, User
+from common.schemas.checkup import Checkup as CheckupSchema
+from common.schemas.user import User as UserSchema
+from common.serialization import render_json
+
+CREATED_AT = datetime.datetime(2021, 11, 1, 12, 30, tzinfo=datetime.timezone.utc)
+
+
+def make_doctor(index: int) -> Doctor:
+    return Doctor(
+        id=index,
+        hospital_id=1,
+        schedule="L, X, V 8:00 - 12:00, 4:00 - 6:00",
+        specialties=[Specialty(id=specialty, name=f"specialty {specialty}", hospital_id=1)
+                     for specialty in range(3)],
+    )
+
+
+def make_users(rows: int) -> List[User]:
+    users = []
+
+    for index in range(rows):
+        user = User(
+            id=index,
+            uid=f"uid-{index}",
+            user_role="doctor" if index % 2 else "patient",
+            document_type="national_id",
+            name="Maria",
+            last_name="Diaz",
+            email=f"user{index}@hospicloud.com",
+            document_number=f"{index:011d}",
+            date_of_birth=datetime.date(1980, 1, 1),
+            created_at=CREATED_AT,
+        )
+
+        if index % 2:
+            user.doctor = make_doctor(index)
+        else:
+            user.patient = Patient(id=index, blood_type="o_plus", medical_background="None")
+
+        users.append(user)
+
+    return users
+
+
+def make_checkups(rows: int) -> List[Checkup]:
+    doctor = make_doctor(1)
+    patient = Patient(id=1, blood_type="o_plus", medical_background="None")
+
+    return [
+        Checkup(id=index, date=CREATED_AT, doctor=doctor, patient=patient,
+                data={"weight": 70 + index % 10, "notes": "Routine checkup", "pressure": "120/80"})
+        for index in range(rows)
+    ]
+
+
+def response_model_path(schema, rows, exclude_none: bool) -> bytes:
+    # What FastAPI does with a response_model: validate, encode, json.dumps.
+    value = parse_obj_as(List[schema], rows)
+    return JSONResponse(jsonable_encoder(value, exclude_none=exclude_none)).body
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    cases = [
+        ("users", make_users(rows), UserSchema, True),
+        ("checkups", make_checkups(rows), CheckupSchema, False),
+    ]
+
+    print(f"{rows} rows, best of 5")
+
+    for name, items, schema, exclude_none in cases:
+        def render():
+            return render_json(items, Response(), exclude_none=exclude_none).body
+
+        assert json.loads(response_model_path(schema, items, exclude_none)) == json.loads(render())
+
+        old = min(timeit.repeat(
+            lambda: response_model_path(schema, items, exclude_none), number=10, repeat=5)) / 10
+        new = min(timeit.repeat(render, number=10, repeat=5)) / 10
+
+        print(f"{name:>10}: response_model {old * 1000:8.2f} ms, "
+              f"render_json {new * 1000:8.2f} ms, {old / new:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import datetime
+from typing import Iterable, List, Tuple
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.models import CareRelationship, Checkup
+
+# (patient_id, doctor_id, date) of a checkup.
+Visit = Tuple[int, int, datetime.datetime]
+
+
+def summarize_visits(visits: Iterable[Visit]) -> List[dict]:
+    pairs = {}
+
+    for patient_id, doctor_id, date in visits:
+        if patient_id is None or doctor_id is None:
+            continue
+
+        summary = pairs.get((patient_id, doctor_id))
+        if summary is None:
+            pairs[(patient_id, doctor_id)] = {
+                "patient_id": patient_id,
+                "doctor_id": doctor_id,
+                "first_seen": date,
+                "last_seen": date,
+                "visit_count": 1,
+            }
+        else:
+            summary["first_seen"] = min(summary["first_seen"], date)
+            summary["last_seen"] = max(summary["last_seen"], date)
+            summary["visit_count"] += 1
+
+    # A fixed order keeps concurrent writers from locking pairs in opposite orders.
+    return [pairs[pair] for pair in sorted(pairs)]
+
+
+async def record_visits(db: AsyncSession, visits: Iterable[Visit]):
+    """Folds new checkups into care_relationship within the caller's transaction.
+
+    Each patient/doctor pair is upserted once, however many of its checkups
+    are in `visits`.
+    """
+    rows = summarize_visits(visits)
+    if not rows:
+        return
+
+    if db.bind.dialect.name == "postgresql":
+        insert, greatest, least = postgresql.insert, func.greatest, func.least
+    else:
+        # SQLite's scalar min/max take several arguments.
+        insert, greatest, least = sqlite.insert, func.max, func.min
+
+    table = CareRelationship.__table__
+    statement = insert(table).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.patient_id, table.c.doctor_id],
+        set_={
+            "first_seen": least(table.c.first_seen, statement.excluded.first_seen),
+            "last_seen": greatest(table.c.last_seen, statement.excluded.last_seen),
+            "visit_count": table.c.visit_count + statement.excluded.visit_count,
+        },
+    )
+
+    await db.execute(statement)
+
+
+async def refresh_relationship(db: AsyncSession, patient_id: int, doctor_id: int):
+    """Recomputes one pair from its checkups, after a checkup was deleted."""
+    if patient_id is None or doctor_id is None:
+        return
+
+    result = await db.execute(
+        select(func.min(Checkup.date), func.max(Checkup.date), func.count())
+        .where(Checkup.patient_id == patient_id, Checkup.doctor_id == doctor_id)
+    )
+    first_seen, last_seen, visit_count = result.one()
+
+    pair = (CareRelationship.patient_id == patient_id,
+            CareRelationship.doctor_id == doctor_id)
+
+    if visit_count == 0:
+        await db.execute(delete(CareRelationship).where(*pair))
+    else:
+        await db.execute(
+            update(CareRelationship)
+            .where(*pair)
+            .values(first_seen=first_seen, last_seen=last_seen, visit_count=visit_count)
+        )
+
+
+def prune_relationships(connection: Connection, cutoff: datetime.datetime):
+    """Recomputes the pairs first seen before `cutoff`, once the checkups older
+    than it were retired by the partition retention.
+
+    Pairs left without checkups are deleted, last_seen of the others is
+    already past the cutoff.
+    """
+    pair_checkups = (
+        select(Checkup.date)
+        .where(Checkup.patient_id == CareRelationship.patient_id,
+               Checkup.doctor_id == CareRelationship.doctor_id)
+        .correlate(CareRelationship)
+    )
+
+    connection.execute(
+        update(CareRelationship)
+        .where(CareRelationship.first_seen < cutoff)
+        .values(
+            first_seen=pair_checkups.with_only_columns(func.min(Checkup.date)).scalar_subquery(),
+            visit_count=pair_checkups.with_only_columns(func.count()).scalar_subquery(),
+        )
+    )
+    connection.execute(delete(CareRelationship).where(CareRelationship.visit_count == 0))
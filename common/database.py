@@ -1,13 +1,137 @@
 import os
-from sqlalchemy import create_engine
+import time
+from typing import Dict, Optional
 
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 
-def start_engine():
-    db_host = os.getenv("DB_HOST", "postgres:5432")
+from common.metrics import Histogram, MetricFamily, register_collector
+
+CHECKOUT_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class PoolStats:
+    def __init__(self):
+        self.checkout_wait = Histogram(CHECKOUT_WAIT_BUCKETS)
+        self.checkout_timeouts = 0
+
+
+# Keyed by pool logging name, which survives engine.dispose() recreating the pool.
+pool_stats: Dict[str, PoolStats] = {}
+
+instrumented_engines: Dict[str, Engine] = {}
+
+
+class InstrumentedPoolMixin:
+    def connect(self):
+        stats = pool_stats.setdefault(self._orig_logging_name, PoolStats())
+        start = time.perf_counter()
+
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            stats.checkout_timeouts += 1
+            raise
+        finally:
+            stats.checkout_wait.observe(time.perf_counter() - start)
+
+
+class InstrumentedAsyncAdaptedQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def get_database_url(driver: str = "postgresql", db_host: str = None) -> str:
+    db_host = db_host or os.getenv("DB_HOST", "postgres:5432")
     db_user = os.getenv("DB_USER", "root")
     db_password = os.getenv("DB_PASSWORD", "password")
     db_name = os.getenv("DB_NAME", "postgres")
 
+    return f"{driver}://{db_user}:{db_password}@{db_host}/{db_name}"
+
+
+def get_replica_database_url(driver: str = "postgresql") -> Optional[str]:
+    replica_host = os.getenv("DB_REPLICA_HOST")
+    if not replica_host:
+        return None
+
+    return get_database_url(driver, replica_host)
+
+
+def get_echo():
+    # DB_ECHO=true logs every statement, DB_ECHO=debug also logs result rows.
+    echo = os.getenv("DB_ECHO", "false").lower()
+    if echo == "debug":
+        return "debug"
+
+    return echo == "true"
+
+
+def get_pool_options() -> dict:
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+    }
+
+
+def start_engine():
+    # The sync engine only runs migrations and the startup schema check,
+    # keeping idle connections around for it would waste Postgres slots.
     engine = create_engine(
-        f"postgresql://{db_user}:{db_password}@{db_host}/{db_name}", echo=True)
+        get_database_url(), echo=get_echo(), poolclass=NullPool)
     return engine
+
+
+def start_async_engine(name: str = "primary", url: str = None) -> AsyncEngine:
+    engine = create_async_engine(
+        url or get_database_url("postgresql+asyncpg"),
+        echo=get_echo(),
+        poolclass=InstrumentedAsyncAdaptedQueuePool,
+        pool_logging_name=name,
+        **get_pool_options(),
+    )
+    instrumented_engines[name] = engine.sync_engine
+    return engine
+
+
+def collect_pool_metrics():
+    size_samples = []
+    checked_out_samples = []
+    overflow_samples = []
+    timeout_samples = []
+    wait_samples = []
+
+    for name, engine in instrumented_engines.items():
+        labels = {"pool": name}
+        pool = engine.pool
+        stats = pool_stats.setdefault(name, PoolStats())
+
+        size_samples.append(("db_pool_size", labels, pool.size()))
+        checked_out_samples.append(
+            ("db_pool_checked_out", labels, pool.checkedout()))
+        overflow_samples.append(
+            ("db_pool_overflow", labels, max(pool.overflow(), 0)))
+        timeout_samples.append(
+            ("db_pool_checkout_timeouts_total", labels, stats.checkout_timeouts))
+        wait_samples.extend(stats.checkout_wait.samples(
+            "db_pool_checkout_wait_seconds", labels))
+
+    return [
+        MetricFamily("db_pool_size", "gauge",
+                     "Connections kept open by the pool.", size_samples),
+        MetricFamily("db_pool_checked_out", "gauge",
+                     "Connections currently in use.", checked_out_samples),
+        MetricFamily("db_pool_overflow", "gauge",
+                     "Connections open beyond the pool size.", overflow_samples),
+        MetricFamily("db_pool_checkout_timeouts_total", "counter",
+                     "Checkouts that gave up waiting for a connection.", timeout_samples),
+        MetricFamily("db_pool_checkout_wait_seconds", "histogram",
+                     "Time spent acquiring a connection from the pool.", wait_samples),
+    ]
+
+
+register_collector(collect_pool_metrics)
@@ -0,0 +1,115 @@
+import datetime
+import os
+from typing import Dict, Iterable, List
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.models import Checkup, CheckupFieldValue, Template
+from common.templates import CompiledTemplate, compile_template
+
+# Columns of a checkup needed to extract its field values.
+CHECKUP_COLUMNS = ("id", "template_id", "patient_id", "date", "data")
+
+
+def get_backfill_batch_size() -> int:
+    return int(os.getenv("FIELD_VALUE_BACKFILL_BATCH_SIZE", "1000"))
+
+
+def field_value_rows(checkup: dict, compiled: CompiledTemplate) -> List[dict]:
+    """checkup_field_value rows for one checkup, given as a dict of CHECKUP_COLUMNS."""
+    return [
+        {
+            "checkup_id": checkup["id"],
+            "field": field,
+            "template_id": checkup["template_id"],
+            "patient_id": checkup["patient_id"],
+            "date": checkup["date"],
+            "value": value,
+        }
+        for field, value in compiled.numeric_values(checkup["data"] or {}).items()
+    ]
+
+
+async def record_field_values(db: AsyncSession, checkups: Iterable[dict],
+                              validators: Dict[int, CompiledTemplate]):
+    """Extracts the numeric fields of new checkups within the caller's transaction."""
+    rows = [row for checkup in checkups
+            for row in field_value_rows(checkup, validators[checkup["template_id"]])]
+    if not rows:
+        return
+
+    await db.execute(CheckupFieldValue.__table__.insert(), rows)
+
+
+async def delete_field_values(db: AsyncSession, checkup_id: int):
+    await db.execute(
+        delete(CheckupFieldValue).where(CheckupFieldValue.checkup_id == checkup_id))
+
+
+def prune_field_values(connection: Connection, cutoff: datetime.datetime):
+    """Drops the values of the checkups retired by the partition retention."""
+    connection.execute(delete(CheckupFieldValue).where(CheckupFieldValue.date < cutoff))
+
+
+def load_templates(connection: Connection, template_ids: set,
+                   compiled: Dict[int, CompiledTemplate]):
+    missing = template_ids - compiled.keys()
+    if not missing:
+        return
+
+    result = connection.execute(
+        select(Template.id, Template.headers).where(Template.id.in_(missing)))
+
+    for template_id, headers in result.all():
+        # Templates with invalid headers have no fields to extract.
+        compiled[template_id] = compile_template(template_id, headers)
+
+
+def backfill_field_values(engine: Engine, batch_size: int = None) -> int:
+    """Extracts the field values of every existing checkup, returns how many were found.
+
+    Checkups are walked by id in batches, one transaction each, and rows
+    already extracted are left alone, so the job can be stopped and run
+    again at any time.
+    """
+    batch_size = batch_size or get_backfill_batch_size()
+    insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    columns = [getattr(Checkup, name) for name in CHECKUP_COLUMNS]
+
+    compiled: Dict[int, CompiledTemplate] = {}
+    last_id = 0
+    written = 0
+
+    while True:
+        with engine.begin() as connection:
+            checkups = connection.execute(
+                select(*columns)
+                .where(Checkup.id > last_id)
+                .order_by(Checkup.id)
+                .limit(batch_size)
+            ).mappings().all()
+            if not checkups:
+                return written
+
+            load_templates(
+                connection, {checkup["template_id"] for checkup in checkups}, compiled)
+
+            rows = [
+                row for checkup in checkups if checkup["template_id"] in compiled
+                for row in field_value_rows(checkup, compiled[checkup["template_id"]])
+            ]
+            if rows:
+                connection.execute(
+                    insert(CheckupFieldValue.__table__).on_conflict_do_nothing(), rows)
+
+            last_id = checkups[-1]["id"]
+            written += len(rows)
+
+
+if __name__ == "__main__":
+    from common.models import engine
+
+    print(f"Extracted field values: {backfill_field_values(engine)}")
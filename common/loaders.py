@@ -0,0 +1,28 @@
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defaultload, joinedload
+from sqlalchemy.sql import Select
+
+from common.models import Doctor, User
+from common.pagination import Page, fetch_page
+
+# Loading profile for the User response model. The role rows are one-to-one
+# so they are joined, the doctors' specialties come in one extra SELECT for
+# the whole page, and every other relationship raises if read. Any list of
+# users takes the same two queries whatever its size and mix of roles.
+USER_LOADING_OPTIONS = (
+    joinedload(User.patient).raiseload("*"),
+    joinedload(User.admin).raiseload("*"),
+    joinedload(User.doctor).raiseload("*"),
+    defaultload(User.doctor).selectinload(Doctor.specialties).raiseload("*"),
+)
+
+USER_PAGE_KEY = (User.id,)
+
+
+async def fetch_users_page(db: AsyncSession, statement: Select, cursor: Optional[str],
+                           limit: int) -> Page:
+    """Pages through the users selected by `statement` with USER_LOADING_OPTIONS applied."""
+    statement = statement.options(*USER_LOADING_OPTIONS)
+    return await fetch_page(db, statement, USER_PAGE_KEY, cursor, limit)
@@ -0,0 +1,65 @@
+import threading
+from typing import Callable, Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+Labels = Dict[str, str]
+
+
+class MetricFamily(NamedTuple):
+    name: str
+    type: str
+    documentation: str
+    samples: List[Tuple[str, Labels, float]]
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self._sum += value
+            self._count += 1
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[index] += 1
+
+    def samples(self, name: str, labels: Labels) -> List[Tuple[str, Labels, float]]:
+        with self._lock:
+            samples = [
+                (f"{name}_bucket", {**labels, "le": str(bound)}, count)
+                for bound, count in zip(self.buckets, self._counts)
+            ]
+            samples.append(
+                (f"{name}_bucket", {**labels, "le": "+Inf"}, self._count))
+            samples.append((f"{name}_sum", labels, self._sum))
+            samples.append((f"{name}_count", labels, self._count))
+
+        return samples
+
+
+_collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+
+
+def register_collector(collector: Callable[[], Iterable[MetricFamily]]):
+    _collectors.append(collector)
+
+
+def render_metrics(service: str) -> str:
+    lines = []
+
+    for collector in _collectors:
+        for family in collector():
+            lines.append(f"# HELP {family.name} {family.documentation}")
+            lines.append(f"# TYPE {family.name} {family.type}")
+
+            for name, labels, value in family.samples:
+                labels = {"service": service, **labels}
+                rendered_labels = ",".join(
+                    f'{key}="{value}"' for key, value in labels.items())
+                lines.append(f"{name}{{{rendered_labels}}} {value}")
+
+    return "\n".join(lines) + "\n"
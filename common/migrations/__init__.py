@@ -0,0 +1,105 @@
+from typing import List
+
+from sqlalchemy import Column, MetaData, Table, inspect, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql import func, text
+from sqlalchemy.types import DateTime, Integer, String
+
+from common.utils import get_current_time
+from . import (
+    v001_initial_schema,
+    v002_lookup_indexes,
+    v003_jsonb_documents,
+    v004_partition_checkups,
+    v005_import_jobs,
+    v006_outbox,
+    v007_care_relationships,
+    v008_hospital_search,
+    v009_checkup_template_index,
+    v010_checkup_field_values,
+    v011_hospital_rollups,
+)
+
+MIGRATIONS = [
+    v001_initial_schema,
+    v002_lookup_indexes,
+    v003_jsonb_documents,
+    v004_partition_checkups,
+    v005_import_jobs,
+    v006_outbox,
+    v007_care_relationships,
+    v008_hospital_search,
+    v009_checkup_template_index,
+    v010_checkup_field_values,
+    v011_hospital_rollups,
+]
+
+LATEST_VERSION = MIGRATIONS[-1].VERSION
+
+# Arbitrary key used to serialize concurrent migration runs on Postgres.
+MIGRATION_LOCK_ID = 7418529
+
+metadata = MetaData()
+
+schema_version = Table(
+    "schema_version",
+    metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String),
+    Column("applied_at", DateTime(timezone=True)),
+)
+
+
+class SchemaVersionError(RuntimeError):
+    pass
+
+
+def get_schema_version(connection: Connection) -> int:
+    if not inspect(connection).has_table(schema_version.name):
+        return 0
+
+    version = connection.execute(
+        select(func.max(schema_version.c.version))).scalar()
+
+    return version or 0
+
+
+def migrate(engine: Engine) -> List[int]:
+    applied = []
+
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(
+                text("SELECT pg_advisory_xact_lock(:lock_id)"),
+                {"lock_id": MIGRATION_LOCK_ID},
+            )
+
+        metadata.create_all(connection)
+        current_version = get_schema_version(connection)
+
+        for migration in MIGRATIONS:
+            if migration.VERSION <= current_version:
+                continue
+
+            migration.upgrade(connection)
+            connection.execute(
+                schema_version.insert().values(
+                    version=migration.VERSION,
+                    description=migration.DESCRIPTION,
+                    applied_at=get_current_time(),
+                )
+            )
+            applied.append(migration.VERSION)
+
+    return applied
+
+
+def check_schema_version(engine: Engine):
+    with engine.connect() as connection:
+        version = get_schema_version(connection)
+
+    if version != LATEST_VERSION:
+        raise SchemaVersionError(
+            f"Database schema is at version {version}, expected {LATEST_VERSION}. "
+            "Run `python -m common.migrations` before starting the service."
+        )
@@ -0,0 +1,10 @@
+from common.models import engine
+from common.migrations import LATEST_VERSION, migrate
+
+if __name__ == "__main__":
+    applied = migrate(engine)
+
+    if applied:
+        print(f"Applied migrations: {', '.join(map(str, applied))}")
+
+    print(f"Database schema is at version {LATEST_VERSION}")
@@ -0,0 +1,122 @@
+from sqlalchemy import Column, ForeignKey, MetaData, Table
+from sqlalchemy.types import JSON, Date, DateTime, Enum, Integer, String
+
+from common.models import BloodType, DocumentType, Province, UserRole
+
+VERSION = 1
+DESCRIPTION = "Initial schema"
+
+# The schema as it was before versioned migrations, frozen here so later
+# changes to common/models.py only reach the database through their own
+# migration.
+metadata = MetaData()
+
+Table(
+    "location",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("address", String(length=250)),
+    Column("province", Enum(Province)),
+)
+
+Table(
+    "hospital",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String),
+    Column("description", String),
+    Column("schedule", String(250)),
+    Column("location_id", Integer, ForeignKey("location.id")),
+    Column("created_at", DateTime(timezone=True)),
+    Column("updated_at", DateTime(timezone=True)),
+)
+
+Table(
+    "user",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("uid", String),
+    Column("user_role", Enum(UserRole)),
+    Column("document_type", Enum(DocumentType)),
+    Column("name", String(length=50)),
+    Column("last_name", String(length=50)),
+    Column("password", String),
+    Column("email", String, unique=True),
+    Column("document_number", String(11)),
+    Column("date_of_birth", Date),
+    Column("created_at", DateTime(timezone=True)),
+    Column("updated_at", DateTime(timezone=True)),
+)
+
+Table(
+    "admin",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("user.id")),
+    Column("hospital_id", Integer, ForeignKey("hospital.id")),
+)
+
+Table(
+    "doctor",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("user.id")),
+    Column("hospital_id", Integer, ForeignKey("hospital.id")),
+    Column("schedule", String(250)),
+)
+
+Table(
+    "patient",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("user.id")),
+    Column("blood_type", Enum(BloodType)),
+    Column("medical_background", String),
+)
+
+Table(
+    "specialty",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String),
+    Column("hospital_id", Integer, ForeignKey("hospital.id")),
+)
+
+Table(
+    "doctor_specialty",
+    metadata,
+    Column("doctor_id", ForeignKey("doctor.id")),
+    Column("specialty_id", ForeignKey("specialty.id")),
+)
+
+Table(
+    "template",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("title", String),
+    Column("specialty_id", Integer, ForeignKey("specialty.id")),
+    Column("hospital_id", Integer, ForeignKey("hospital.id")),
+    Column("headers", JSON),
+    Column("numeric_fields", Integer),
+    Column("alphanumeric_fields", Integer),
+    Column("file_upload_fields", Integer),
+    Column("created_at", DateTime(timezone=True)),
+    Column("updated_at", DateTime(timezone=True)),
+)
+
+Table(
+    "checkup",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("template_id", Integer, ForeignKey("template.id")),
+    Column("doctor_id", Integer, ForeignKey("doctor.id")),
+    Column("patient_id", Integer, ForeignKey("patient.id")),
+    Column("data", JSON),
+    Column("date", DateTime(timezone=True)),
+)
+
+
+def upgrade(connection):
+    # Databases created before versioned migrations already hold these tables,
+    # create_all only adds the ones that are missing.
+    metadata.create_all(connection)
@@ -0,0 +1,60 @@
+from sqlalchemy import inspect
+
+VERSION = 2
+DESCRIPTION = "Indexes for the hot lookup columns"
+
+# table: [(index name, columns, unique, columns only included on Postgres)]
+INDEXES = {
+    "user": [
+        ("ix_user_uid", ["uid"], True, []),
+        ("ix_user_document_number", ["document_number"], False, []),
+    ],
+    "patient": [("ix_patient_user_id", ["user_id"], False, [])],
+    "admin": [
+        ("ix_admin_hospital_id", ["hospital_id"], False, ["user_id"]),
+        ("ix_admin_user_id", ["user_id"], False, []),
+    ],
+    "doctor": [
+        ("ix_doctor_hospital_id", ["hospital_id"], False, ["user_id"]),
+        ("ix_doctor_user_id", ["user_id"], False, []),
+    ],
+    "specialty": [("ix_specialty_hospital_id_name", ["hospital_id", "name"], False, [])],
+    "doctor_specialty": [
+        ("ix_doctor_specialty_doctor_id_specialty_id", ["doctor_id", "specialty_id"], False, []),
+        ("ix_doctor_specialty_specialty_id_doctor_id", ["specialty_id", "doctor_id"], False, []),
+    ],
+    "template": [
+        ("ix_template_hospital_id", ["hospital_id"], False, []),
+        ("ix_template_specialty_id_hospital_id", ["specialty_id", "hospital_id"], False, []),
+    ],
+    "checkup": [
+        ("ix_checkup_patient_id_date", ["patient_id", "date"], False, []),
+        ("ix_checkup_doctor_id_patient_id_date", ["doctor_id", "patient_id", "date"], False, []),
+        ("ix_checkup_date", ["date"], False, []),
+    ],
+}
+
+
+def upgrade(connection):
+    inspector = inspect(connection)
+    quote = connection.dialect.identifier_preparer.quote
+    is_postgres = connection.dialect.name == "postgresql"
+
+    for table_name, indexes in INDEXES.items():
+        existing = {index["name"] for index in inspector.get_indexes(table_name)}
+
+        for index_name, columns, unique, include in indexes:
+            if index_name in existing:
+                continue
+
+            statement = (
+                f"CREATE {'UNIQUE ' if unique else ''}INDEX {index_name} "
+                f"ON {quote(table_name)} ({', '.join(columns)})")
+            if include and is_postgres:
+                statement += f" INCLUDE ({', '.join(include)})"
+
+            connection.exec_driver_sql(statement)
+
+    if is_postgres:
+        connection.exec_driver_sql(
+            "ANALYZE \"user\", patient, admin, doctor, specialty, doctor_specialty, template, checkup")
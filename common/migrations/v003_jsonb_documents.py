@@ -0,0 +1,50 @@
+from sqlalchemy import inspect
+
+VERSION = 3
+DESCRIPTION = "Store checkup data and template headers as JSONB"
+
+DOCUMENT_COLUMNS = {
+    "checkup": "data",
+    "template": "headers",
+}
+
+# Rows written before this migration hold the document JSON-encoded inside
+# a JSON string. Anything that no longer parses is kept under "raw".
+PARSE_LEGACY_JSON = """
+CREATE FUNCTION pg_temp.parse_legacy_json(value text) RETURNS jsonb AS $$
+BEGIN
+    RETURN value::jsonb;
+EXCEPTION WHEN others THEN
+    RETURN jsonb_build_object('raw', value);
+END;
+$$ LANGUAGE plpgsql IMMUTABLE
+"""
+
+
+def upgrade(connection):
+    if connection.dialect.name != "postgresql":
+        return
+
+    inspector = inspect(connection)
+    connection.exec_driver_sql(PARSE_LEGACY_JSON)
+
+    for table_name, column_name in DOCUMENT_COLUMNS.items():
+        column = next(
+            column for column in inspector.get_columns(table_name)
+            if column["name"] == column_name
+        )
+
+        if column["type"].__visit_name__ != "JSONB":
+            connection.exec_driver_sql(
+                f"ALTER TABLE {table_name} ALTER COLUMN {column_name} "
+                f"TYPE jsonb USING {column_name}::text::jsonb")
+
+        connection.exec_driver_sql(
+            f"UPDATE {table_name} "
+            f"SET {column_name} = pg_temp.parse_legacy_json({column_name} #>> '{{}}') "
+            f"WHERE jsonb_typeof({column_name}) = 'string'")
+
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_checkup_data "
+        "ON checkup USING gin (data jsonb_path_ops)")
+    connection.exec_driver_sql("ANALYZE checkup, template")
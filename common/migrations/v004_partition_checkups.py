@@ -0,0 +1,81 @@
+from sqlalchemy import inspect
+from sqlalchemy.sql import text
+
+from common.partitioning import (
+    DEFAULT_PARTITION,
+    add_months,
+    create_partitions,
+    get_months_ahead,
+    is_partitioned,
+    month_start,
+)
+from common.utils import get_current_time
+
+VERSION = 4
+DESCRIPTION = "Partition checkups by month"
+
+UNPARTITIONED_TABLE = "checkup_unpartitioned"
+
+# The checkup indexes of migrations 2 and 3, rebuilt on the partitioned table.
+CHECKUP_INDEXES = [
+    "CREATE INDEX ix_checkup_patient_id_date ON checkup (patient_id, date)",
+    "CREATE INDEX ix_checkup_doctor_id_patient_id_date ON checkup (doctor_id, patient_id, date)",
+    "CREATE INDEX ix_checkup_date ON checkup (date)",
+    "CREATE INDEX ix_checkup_data ON checkup USING gin (data jsonb_path_ops)",
+]
+
+
+def upgrade(connection):
+    if connection.dialect.name != "postgresql" or is_partitioned(connection):
+        return
+
+    # Every key of a partitioned table has to include the partition column.
+    connection.exec_driver_sql(
+        "UPDATE checkup SET date = now() WHERE date IS NULL")
+
+    for index in inspect(connection).get_indexes("checkup"):
+        connection.exec_driver_sql(f"DROP INDEX {index['name']}")
+
+    connection.exec_driver_sql(f"ALTER TABLE checkup RENAME TO {UNPARTITIONED_TABLE}")
+    connection.exec_driver_sql(
+        f"ALTER TABLE {UNPARTITIONED_TABLE} RENAME CONSTRAINT checkup_pkey "
+        f"TO {UNPARTITIONED_TABLE}_pkey")
+
+    connection.exec_driver_sql(f"""
+        CREATE TABLE checkup (
+            LIKE {UNPARTITIONED_TABLE} INCLUDING DEFAULTS,
+            PRIMARY KEY (id, date),
+            FOREIGN KEY (template_id) REFERENCES template (id),
+            FOREIGN KEY (doctor_id) REFERENCES doctor (id),
+            FOREIGN KEY (patient_id) REFERENCES patient (id)
+        ) PARTITION BY RANGE (date)
+    """)
+    connection.exec_driver_sql("ALTER TABLE checkup ALTER COLUMN date SET NOT NULL")
+
+    for statement in CHECKUP_INDEXES:
+        connection.exec_driver_sql(statement)
+
+    oldest = connection.execute(
+        text(f"SELECT min(date) FROM {UNPARTITIONED_TABLE}")).scalar()
+    current_month = month_start(get_current_time())
+
+    create_partitions(
+        connection,
+        month_start(oldest) if oldest else current_month,
+        add_months(current_month, get_months_ahead()),
+    )
+    connection.exec_driver_sql(
+        f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF checkup DEFAULT")
+
+    connection.exec_driver_sql(
+        f"INSERT INTO checkup SELECT * FROM {UNPARTITIONED_TABLE}")
+
+    sequence = connection.execute(
+        text("SELECT pg_get_serial_sequence(:table, 'id')"),
+        {"table": UNPARTITIONED_TABLE},
+    ).scalar()
+    if sequence:
+        connection.exec_driver_sql(f"ALTER SEQUENCE {sequence} OWNED BY checkup.id")
+
+    connection.exec_driver_sql(f"DROP TABLE {UNPARTITIONED_TABLE}")
+    connection.exec_driver_sql("ANALYZE checkup")
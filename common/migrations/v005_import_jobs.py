@@ -0,0 +1,29 @@
+from sqlalchemy import Column, ForeignKey, MetaData, Table
+from sqlalchemy.types import DateTime, Enum, Integer, String
+
+from common.models import ImportJobStatus
+
+VERSION = 5
+DESCRIPTION = "Bulk user import jobs"
+
+metadata = MetaData()
+
+# Referenced by the foreign key, already created by migration 1.
+Table("hospital", metadata, Column("id", Integer, primary_key=True))
+
+import_job = Table(
+    "import_job",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("hospital_id", Integer, ForeignKey("hospital.id"), index=True),
+    Column("status", Enum(ImportJobStatus)),
+    Column("total_rows", Integer),
+    Column("processed_rows", Integer),
+    Column("error", String),
+    Column("created_at", DateTime(timezone=True)),
+    Column("updated_at", DateTime(timezone=True)),
+)
+
+
+def upgrade(connection):
+    import_job.create(connection, checkfirst=True)
@@ -0,0 +1,30 @@
+from sqlalchemy import Column, Index, MetaData, Table
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.types import JSON, DateTime, Enum, Integer, String
+
+from common.models import OutboxStatus
+
+VERSION = 6
+DESCRIPTION = "Outbox for identity provider changes"
+
+metadata = MetaData()
+
+outbox_message = Table(
+    "outbox_message",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("kind", String(50)),
+    Column("user_id", Integer, index=True),
+    Column("payload", JSON().with_variant(JSONB(), "postgresql")),
+    Column("status", Enum(OutboxStatus)),
+    Column("attempts", Integer),
+    Column("last_error", String),
+    Column("available_at", DateTime(timezone=True)),
+    Column("created_at", DateTime(timezone=True)),
+    Column("processed_at", DateTime(timezone=True)),
+    Index("ix_outbox_message_status_available_at", "status", "available_at"),
+)
+
+
+def upgrade(connection):
+    outbox_message.create(connection, checkfirst=True)
@@ -0,0 +1,50 @@
+from sqlalchemy import Column, ForeignKey, Index, MetaData, Table, func, select
+from sqlalchemy.sql import column, table
+from sqlalchemy.types import DateTime, Integer
+
+VERSION = 7
+DESCRIPTION = "Patient/doctor care relationships backfilled from checkups"
+
+metadata = MetaData()
+
+# Referenced by the foreign keys, already created by migration 1.
+Table("patient", metadata, Column("id", Integer, primary_key=True))
+Table("doctor", metadata, Column("id", Integer, primary_key=True))
+
+care_relationship = Table(
+    "care_relationship",
+    metadata,
+    Column("patient_id", Integer, ForeignKey("patient.id"), primary_key=True),
+    Column("doctor_id", Integer, ForeignKey("doctor.id"), primary_key=True),
+    Column("first_seen", DateTime(timezone=True)),
+    Column("last_seen", DateTime(timezone=True)),
+    Column("visit_count", Integer),
+    Index("ix_care_relationship_patient_id_last_seen",
+          "patient_id", "last_seen", "doctor_id"),
+    Index("ix_care_relationship_doctor_id_last_seen",
+          "doctor_id", "last_seen", "patient_id"),
+)
+
+checkup = table(
+    "checkup",
+    column("patient_id", Integer),
+    column("doctor_id", Integer),
+    column("date", DateTime(timezone=True)),
+)
+
+
+def upgrade(connection):
+    care_relationship.create(connection, checkfirst=True)
+
+    connection.execute(care_relationship.insert().from_select(
+        ["patient_id", "doctor_id", "first_seen", "last_seen", "visit_count"],
+        select(
+            checkup.c.patient_id,
+            checkup.c.doctor_id,
+            func.min(checkup.c.date),
+            func.max(checkup.c.date),
+            func.count(),
+        )
+        .where(checkup.c.patient_id.isnot(None), checkup.c.doctor_id.isnot(None))
+        .group_by(checkup.c.patient_id, checkup.c.doctor_id),
+    ))
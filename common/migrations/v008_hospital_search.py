@@ -0,0 +1,22 @@
+VERSION = 8
+DESCRIPTION = "Trigram index for accent-insensitive hospital search"
+
+# unaccent() is only STABLE, index expressions need an IMMUTABLE function.
+# Pinning the dictionary makes the wrapper safe to mark as such.
+SEARCH_NAME_FUNCTION = """
+CREATE OR REPLACE FUNCTION search_name(value text) RETURNS text AS $$
+    SELECT lower(public.unaccent('public.unaccent'::regdictionary, value))
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+"""
+
+
+def upgrade(connection):
+    if connection.dialect.name != "postgresql":
+        return
+
+    connection.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    connection.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS unaccent")
+    connection.exec_driver_sql(SEARCH_NAME_FUNCTION)
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_hospital_name_trgm "
+        "ON hospital USING gin (search_name(name) gin_trgm_ops)")
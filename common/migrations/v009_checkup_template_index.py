@@ -0,0 +1,8 @@
+VERSION = 9
+DESCRIPTION = "Index checkups by template for the template stats"
+
+
+def upgrade(connection):
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_checkup_template_id_date "
+        "ON checkup (template_id, date)")
@@ -0,0 +1,28 @@
+from sqlalchemy import Column, Index, MetaData, String, Table
+from sqlalchemy.types import DateTime, Float, Integer
+
+VERSION = 10
+DESCRIPTION = "Numeric checkup field values for predicate search"
+
+metadata = MetaData()
+
+checkup_field_value = Table(
+    "checkup_field_value",
+    metadata,
+    Column("checkup_id", Integer, primary_key=True),
+    Column("field", String, primary_key=True),
+    Column("template_id", Integer, nullable=False),
+    Column("patient_id", Integer),
+    Column("date", DateTime(timezone=True), nullable=False),
+    Column("value", Float, nullable=False),
+    Index("ix_checkup_field_value_template_id_field_value",
+          "template_id", "field", "value"),
+    Index("ix_checkup_field_value_template_id_field_patient_id_date",
+          "template_id", "field", "patient_id", "date"),
+)
+
+
+def upgrade(connection):
+    # Existing checkups are extracted by `python -m common.field_values`,
+    # which runs in batches instead of one long migration transaction.
+    checkup_field_value.create(connection, checkfirst=True)
@@ -0,0 +1,131 @@
+import datetime
+from collections import Counter
+
+from sqlalchemy import Column, Date, MetaData, Table, cast, func, select
+from sqlalchemy.sql import column, table
+from sqlalchemy.types import DateTime, Integer
+
+from common.utils import DR_TIMEZONE, DR_TIMEZONE_NAME
+
+VERSION = 11
+DESCRIPTION = "Hospital dashboard rollups"
+
+# Stands for templates without a specialty, the column is part of the key.
+NO_SPECIALTY = 0
+
+metadata = MetaData()
+
+hospital_rollup = Table(
+    "hospital_rollup",
+    metadata,
+    Column("hospital_id", Integer, primary_key=True),
+    Column("doctors", Integer, nullable=False),
+    Column("admins", Integer, nullable=False),
+    Column("patients", Integer, nullable=False),
+)
+
+hospital_patient = Table(
+    "hospital_patient",
+    metadata,
+    Column("hospital_id", Integer, primary_key=True),
+    Column("patient_id", Integer, primary_key=True),
+)
+
+hospital_daily_checkups = Table(
+    "hospital_daily_checkups",
+    metadata,
+    Column("hospital_id", Integer, primary_key=True),
+    Column("day", Date, primary_key=True),
+    Column("specialty_id", Integer, primary_key=True),
+    Column("checkups", Integer, nullable=False),
+)
+
+hospital = table("hospital", column("id", Integer))
+doctor = table("doctor", column("id", Integer), column("hospital_id", Integer),
+               column("user_id", Integer))
+admin = table("admin", column("hospital_id", Integer), column("user_id", Integer))
+template = table("template", column("id", Integer), column("specialty_id", Integer))
+care_relationship = table(
+    "care_relationship", column("patient_id", Integer), column("doctor_id", Integer))
+checkup = table(
+    "checkup",
+    column("doctor_id", Integer),
+    column("template_id", Integer),
+    column("date", DateTime(timezone=True)),
+)
+
+
+def count_by_hospital(source, *conditions):
+    return (select(func.count()).select_from(source)
+            .where(source.c.hospital_id == hospital.c.id, *conditions).scalar_subquery())
+
+
+def select_hospital_checkups(*columns):
+    return (
+        select(*columns)
+        .select_from(checkup)
+        .join(doctor, doctor.c.id == checkup.c.doctor_id)
+        .outerjoin(template, template.c.id == checkup.c.template_id)
+        .where(doctor.c.hospital_id.isnot(None))
+    )
+
+
+def checkup_day(date: datetime.datetime) -> datetime.date:
+    # SQLite hands dates back without a timezone, they are stored in UTC.
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+
+    return date.astimezone(DR_TIMEZONE).date()
+
+
+def backfill_daily_checkups(connection):
+    specialty_id = func.coalesce(template.c.specialty_id, NO_SPECIALTY)
+
+    if connection.dialect.name == "postgresql":
+        day = cast(func.timezone(DR_TIMEZONE_NAME, checkup.c.date), Date)
+        connection.execute(hospital_daily_checkups.insert().from_select(
+            ["hospital_id", "day", "specialty_id", "checkups"],
+            select_hospital_checkups(doctor.c.hospital_id, day, specialty_id, func.count())
+            .group_by(doctor.c.hospital_id, day, specialty_id),
+        ))
+        return
+
+    # SQLite has no time zones, the days are counted here instead.
+    result = connection.execute(
+        select_hospital_checkups(doctor.c.hospital_id, checkup.c.date, specialty_id))
+    daily = Counter(
+        (hospital_id, checkup_day(date), specialty)
+        for hospital_id, date, specialty in result
+    )
+    if daily:
+        connection.execute(hospital_daily_checkups.insert(), [
+            {"hospital_id": hospital_id, "day": day, "specialty_id": specialty,
+             "checkups": count}
+            for (hospital_id, day, specialty), count in daily.items()
+        ])
+
+
+def upgrade(connection):
+    metadata.create_all(connection)
+
+    connection.execute(hospital_patient.insert().from_select(
+        ["hospital_id", "patient_id"],
+        select(doctor.c.hospital_id, care_relationship.c.patient_id)
+        .select_from(care_relationship)
+        .join(doctor, doctor.c.id == care_relationship.c.doctor_id)
+        .where(doctor.c.hospital_id.isnot(None))
+        .distinct(),
+    ))
+
+    # Doctors and admins of deleted users keep their row, without a user.
+    connection.execute(hospital_rollup.insert().from_select(
+        ["hospital_id", "doctors", "admins", "patients"],
+        select(
+            hospital.c.id,
+            count_by_hospital(doctor, doctor.c.user_id.isnot(None)),
+            count_by_hospital(admin, admin.c.user_id.isnot(None)),
+            count_by_hospital(hospital_patient),
+        ),
+    ))
+
+    backfill_daily_checkups(connection)
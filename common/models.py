@@ -1,28 +1,43 @@
 import enum
 import datetime
-from sqlalchemy import Column, ForeignKey, Table
-from sqlalchemy.sql import func
+import json
+from sqlalchemy import Column, ForeignKey, Index, Table, and_
+from sqlalchemy.sql import func, literal
+from sqlalchemy.sql.functions import FunctionElement
 from sqlalchemy.schema import DropTable
 from sqlalchemy.ext.compiler import compiles
-from sqlalchemy.types import JSON, DateTime, Date, Enum, Integer, String, Boolean, Time
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.types import JSON, DateTime, Date, Enum, Float, Integer, String, Boolean, Time
 from sqlalchemy.orm import backref, declarative_base, relationship, sessionmaker, Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from common.database import start_engine
+from common.database import start_engine, start_async_engine, get_replica_database_url
+from common.routing import RoutingSession
+from common.utils import get_current_time
 
 Base = declarative_base()
 
+# JSONB on Postgres so documents are stored parsed and can be GIN indexed,
+# plain JSON elsewhere (SQLite in the tests).
+JSONDocument = JSON().with_variant(JSONB(), "postgresql")
+
 doctor_to_specialty_association = Table(
     "doctor_specialty",
     Base.metadata,
     Column("doctor_id", ForeignKey("doctor.id")),
     Column("specialty_id", ForeignKey("specialty.id")),
+    Index("ix_doctor_specialty_doctor_id_specialty_id", "doctor_id", "specialty_id"),
+    Index("ix_doctor_specialty_specialty_id_doctor_id", "specialty_id", "doctor_id"),
 )
 
 
 class Admin(Base):
     __tablename__ = "admin"
+    __table_args__ = (
+        Index("ix_admin_hospital_id", "hospital_id", postgresql_include=["user_id"]),
+    )
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("user.id"))
+    user_id = Column(Integer, ForeignKey("user.id"), index=True)
     hospital_id = Column(Integer, ForeignKey("hospital.id"))
 
     user = relationship(
@@ -33,12 +48,22 @@ class Admin(Base):
 
 class Checkup(Base):
     __tablename__ = "checkup"
+    __table_args__ = (
+        Index("ix_checkup_patient_id_date", "patient_id", "date"),
+        Index("ix_checkup_doctor_id_patient_id_date",
+              "doctor_id", "patient_id", "date"),
+        Index("ix_checkup_template_id_date", "template_id", "date"),
+        Index("ix_checkup_data", "data", postgresql_using="gin",
+              postgresql_ops={"data": "jsonb_path_ops"}),
+    )
     id = Column(Integer, primary_key=True)
     template_id = Column(Integer, ForeignKey("template.id"))
     doctor_id = Column(Integer, ForeignKey("doctor.id"))
     patient_id = Column(Integer, ForeignKey("patient.id"))
-    data = Column(JSON)
-    date = Column(DateTime(timezone=True))
+    data = Column(JSONDocument)
+    # Partition key on Postgres, see common/partitioning.py.
+    date = Column(DateTime(timezone=True), nullable=False,
+                  default=get_current_time, index=True)
     patient = relationship(
         "Patient", back_populates="checkups", lazy="joined", join_depth=2)
     doctor = relationship(
@@ -100,8 +125,11 @@ class Hospital(Base):
 
 class Doctor(Base):
     __tablename__ = "doctor"
+    __table_args__ = (
+        Index("ix_doctor_hospital_id", "hospital_id", postgresql_include=["user_id"]),
+    )
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("user.id"))
+    user_id = Column(Integer, ForeignKey("user.id"), index=True)
     hospital_id = Column(Integer, ForeignKey("hospital.id"))
     schedule = Column(String(250))
 
@@ -121,6 +149,9 @@ class Doctor(Base):
 
 class Specialty(Base):
     __tablename__ = "specialty"
+    __table_args__ = (
+        Index("ix_specialty_hospital_id_name", "hospital_id", "name"),
+    )
     id = Column(Integer, primary_key=True)
     name = Column(String)
     hospital_id = Column(Integer, ForeignKey("hospital.id"))
@@ -152,11 +183,15 @@ class BloodType(str, enum.Enum):
 
 class Template(Base):
     __tablename__ = "template"
+    __table_args__ = (
+        Index("ix_template_specialty_id_hospital_id",
+              "specialty_id", "hospital_id"),
+    )
     id = Column(Integer, primary_key=True)
     title = Column(String)
     specialty_id = Column(Integer, ForeignKey("specialty.id"))
-    hospital_id = Column(Integer, ForeignKey("hospital.id"))
-    headers = Column(JSON)
+    hospital_id = Column(Integer, ForeignKey("hospital.id"), index=True)
+    headers = Column(JSONDocument)
     numeric_fields = Column(Integer)
     alphanumeric_fields = Column(Integer)
     file_upload_fields = Column(Integer)
@@ -178,7 +213,7 @@ class DocumentType(str, enum.Enum):
 class Patient(Base):
     __tablename__ = "patient"
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("user.id"))
+    user_id = Column(Integer, ForeignKey("user.id"), index=True)
     blood_type = Column(Enum(BloodType))
     medical_background = Column(String)
 
@@ -195,14 +230,14 @@ class Patient(Base):
 class User(Base):
     __tablename__ = "user"
     id = Column(Integer, primary_key=True)
-    uid = Column(String)
+    uid = Column(String, unique=True, index=True)
     user_role = Column(Enum(UserRole))
     document_type = Column(Enum(DocumentType))
     name = Column(String(length=50))
     last_name = Column(String(length=50))
     password = Column(String)
     email = Column(String, unique=True)
-    document_number = Column(String(11))
+    document_number = Column(String(11), index=True)
     date_of_birth = Column(Date)
     created_at = Column(DateTime(timezone=True))
     updated_at = Column(DateTime(timezone=True))
@@ -212,17 +247,237 @@ class User(Base):
     admin = relationship("Admin", back_populates="user", uselist=False)
 
 
+class ImportJobStatus(str, enum.Enum):
+    pending = "pending"
+    running = "running"
+    completed = "completed"
+    failed = "failed"
+
+
+class ImportJob(Base):
+    __tablename__ = "import_job"
+    id = Column(Integer, primary_key=True)
+    hospital_id = Column(Integer, ForeignKey("hospital.id"), index=True)
+    status = Column(Enum(ImportJobStatus), default=ImportJobStatus.pending)
+    total_rows = Column(Integer, default=0)
+    processed_rows = Column(Integer, default=0)
+    error = Column(String)
+    created_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True))
+
+
+class CareRelationship(Base):
+    """Every patient/doctor pair with at least one checkup, see common/care.py."""
+
+    __tablename__ = "care_relationship"
+    __table_args__ = (
+        Index("ix_care_relationship_patient_id_last_seen",
+              "patient_id", "last_seen", "doctor_id"),
+        Index("ix_care_relationship_doctor_id_last_seen",
+              "doctor_id", "last_seen", "patient_id"),
+    )
+    patient_id = Column(Integer, ForeignKey("patient.id"), primary_key=True)
+    doctor_id = Column(Integer, ForeignKey("doctor.id"), primary_key=True)
+    first_seen = Column(DateTime(timezone=True))
+    last_seen = Column(DateTime(timezone=True))
+    visit_count = Column(Integer, default=0)
+
+
+class CheckupFieldValue(Base):
+    """Numeric field of a checkup, extracted at write time, see common/field_values.py.
+
+    There is no foreign key to checkup: it is partitioned on Postgres and
+    its primary key includes the date.
+    """
+
+    __tablename__ = "checkup_field_value"
+    __table_args__ = (
+        Index("ix_checkup_field_value_template_id_field_value",
+              "template_id", "field", "value"),
+        Index("ix_checkup_field_value_template_id_field_patient_id_date",
+              "template_id", "field", "patient_id", "date"),
+    )
+    checkup_id = Column(Integer, primary_key=True)
+    field = Column(String, primary_key=True)
+    template_id = Column(Integer, nullable=False)
+    patient_id = Column(Integer)
+    date = Column(DateTime(timezone=True), nullable=False)
+    value = Column(Float, nullable=False)
+
+
+class HospitalRollup(Base):
+    """Staff and patient counters of a hospital, see common/rollups.py."""
+
+    __tablename__ = "hospital_rollup"
+    hospital_id = Column(Integer, primary_key=True)
+    doctors = Column(Integer, nullable=False, default=0)
+    admins = Column(Integer, nullable=False, default=0)
+    patients = Column(Integer, nullable=False, default=0)
+
+
+class HospitalPatient(Base):
+    """Patients with at least one checkup by a doctor of the hospital."""
+
+    __tablename__ = "hospital_patient"
+    hospital_id = Column(Integer, primary_key=True)
+    patient_id = Column(Integer, primary_key=True)
+
+
+class HospitalDailyCheckups(Base):
+    """Checkups per hospital, day and specialty of their template (0 when it has none)."""
+
+    __tablename__ = "hospital_daily_checkups"
+    hospital_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    specialty_id = Column(Integer, primary_key=True)
+    checkups = Column(Integer, nullable=False, default=0)
+
+
+class OutboxStatus(str, enum.Enum):
+    pending = "pending"
+    sent = "sent"
+    failed = "failed"
+
+
+class OutboxMessage(Base):
+    """Identity provider change written in the same transaction as the user it belongs to."""
+
+    __tablename__ = "outbox_message"
+    __table_args__ = (
+        Index("ix_outbox_message_status_available_at", "status", "available_at"),
+    )
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(50))
+    # No foreign key: account deletions outlive the user row.
+    user_id = Column(Integer, index=True)
+    payload = Column(JSONDocument)
+    status = Column(Enum(OutboxStatus), default=OutboxStatus.pending)
+    attempts = Column(Integer, default=0)
+    last_error = Column(String)
+    available_at = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True))
+    processed_at = Column(DateTime(timezone=True))
+
+
 engine = start_engine()
 
 SessionLocal = sessionmaker(
     autocommit=False, autoflush=False, bind=engine)
 
+async_engine = start_async_engine()
+
+# Objects must stay readable after commit: lazy attribute refreshes cannot
+# run outside of an awaitable context once the route returns them.
+AsyncSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+    bind=async_engine,
+    class_=AsyncSession,
+)
+
+replica_database_url = get_replica_database_url("postgresql+asyncpg")
+
+replica_async_engine = (
+    start_async_engine("replica", replica_database_url)
+    if replica_database_url
+    else async_engine
+)
+
+# Sessions for read-only handlers: queries go to the replica until the
+# session writes or a consistency token pins it to the primary.
+AsyncReadSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+    bind=async_engine,
+    class_=AsyncSession,
+    sync_session_class=RoutingSession,
+    replica=replica_async_engine.sync_engine,
+)
+
 
 @ compiles(DropTable, "postgresql")
 def _compile_drop_table(element, compiler, **kwargs):
     return compiler.visit_drop_table(element) + " CASCADE"
 
 
-def create_tables():
-    # Base.metadata.drop_all(engine)
-    Base.metadata.create_all(engine)
+class json_contains(FunctionElement):
+    """True when the JSON document in `column` contains every key/value of `document`."""
+
+    type = Boolean()
+    name = "json_contains"
+    # The SQLite rendering depends on the document keys, not just the binds.
+    inherit_cache = False
+
+    def __init__(self, column, document: dict):
+        self.column = column
+        self.document = document
+        super().__init__(column, literal(document, JSONB()))
+
+
+@ compiles(json_contains, "postgresql")
+def _compile_json_contains_postgresql(element, compiler, **kwargs):
+    column, document = element.clauses
+    return f"{compiler.process(column, **kwargs)} @> {compiler.process(document, **kwargs)}"
+
+
+@ compiles(json_contains)
+def _compile_json_contains(element, compiler, **kwargs):
+    # Without a containment operator, compare the top-level keys one by one.
+    # Objects and arrays under a key have to match as a whole, as serialized
+    # by json(), where Postgres also matches the documents they contain.
+    comparisons = []
+
+    for key, value in element.document.items():
+        field = element.column[key]
+        path = json.dumps([key])[1:-1]
+        value_type = func.json_type(element.column, f"$.{path}")
+
+        if value is None:
+            comparisons.append(value_type == "null")
+        elif isinstance(value, bool):
+            comparisons.append(field.as_boolean() == value)
+        elif isinstance(value, int):
+            comparisons.append(field.as_integer() == value)
+        elif isinstance(value, float):
+            comparisons.append(field.as_float() == value)
+        elif isinstance(value, (dict, list)):
+            comparisons.append(and_(
+                value_type == ("object" if isinstance(value, dict) else "array"),
+                func.json(func.json_extract(element.column, f"$.{path}"))
+                == func.json(json.dumps(value)),
+            ))
+        else:
+            comparisons.append(field.as_string() == value)
+
+    return compiler.process(and_(*comparisons), **kwargs)
+
+
+class json_number(FunctionElement):
+    """The number under `key` in the JSON document in `column`, NULL for any other value."""
+
+    type = Float()
+    name = "json_number"
+    # The key is rendered inline, so it is part of the statement.
+    inherit_cache = False
+
+    def __init__(self, column, key: str):
+        self.key = key
+        super().__init__(column)
+
+
+@ compiles(json_number, "postgresql")
+def _compile_json_number_postgresql(element, compiler, **kwargs):
+    column = compiler.process(element.clauses.clauses[0], **kwargs)
+    key = compiler.render_literal_value(element.key, String())
+    return (f"CASE WHEN jsonb_typeof({column} -> {key}) = 'number' "
+            f"THEN ({column} ->> {key})::float8 END")
+
+
+@ compiles(json_number)
+def _compile_json_number(element, compiler, **kwargs):
+    column = compiler.process(element.clauses.clauses[0], **kwargs)
+    path = compiler.render_literal_value(f'$."{element.key}"', String())
+    return (f"CASE WHEN json_type({column}, {path}) IN ('integer', 'real') "
+            f"THEN json_extract({column}, {path}) END")
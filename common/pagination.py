@@ -0,0 +1,100 @@
+import base64
+import binascii
+import datetime
+import json
+from typing import Any, List, NamedTuple, Optional, Sequence
+
+from fastapi import Request, Response, status
+from fastapi.responses import JSONResponse
+from sqlalchemy import and_, literal, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+class Page(NamedTuple):
+    items: List[Any]
+    next_cursor: Optional[str]
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    encoded = [
+        value.isoformat() if isinstance(value, datetime.datetime) else value
+        for value in values
+    ]
+    return base64.urlsafe_b64encode(json.dumps(encoded).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, columns: Sequence[Any]) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise InvalidCursorError("Invalid cursor")
+
+        return [
+            datetime.datetime.fromisoformat(value)
+            if column.type.python_type is datetime.datetime else column.type.python_type(value)
+            for column, value in zip(columns, values)
+        ]
+    except (binascii.Error, UnicodeError, TypeError, ValueError) as e:
+        raise InvalidCursorError("Invalid cursor") from e
+
+
+def paginate(statement: Select, columns: Sequence[Any], cursor: Optional[str],
+             limit: int, descending: bool = False) -> Select:
+    """Orders `statement` by `columns` and keeps the rows after `cursor`.
+
+    One extra row is fetched so `build_page` can tell whether there is a next page.
+    """
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        bounds = tuple_(*[literal(value, column.type)
+                        for column, value in zip(columns, values)])
+
+        # The leading column on its own keeps the comparison usable by an index
+        # that only covers it.
+        if descending:
+            statement = statement.where(and_(
+                columns[0] <= values[0], tuple_(*columns) < bounds))
+        else:
+            statement = statement.where(and_(
+                columns[0] >= values[0], tuple_(*columns) > bounds))
+
+    order_by = [column.desc() if descending else column for column in columns]
+    return statement.order_by(*order_by).limit(limit + 1)
+
+
+def build_page(rows: Sequence[Any], columns: Sequence[Any], limit: int) -> Page:
+    if len(rows) <= limit:
+        return Page(list(rows), None)
+
+    items = list(rows[:limit])
+    last = items[-1]
+    return Page(items, encode_cursor([getattr(last, column.key) for column in columns]))
+
+
+async def fetch_page(db: AsyncSession, statement: Select, columns: Sequence[Any],
+                     cursor: Optional[str], limit: int, descending: bool = False) -> Page:
+    statement = paginate(statement, columns, cursor, limit, descending)
+
+    result = await db.execute(statement)
+    return build_page(result.scalars().all(), columns, limit)
+
+
+def set_next_link(request: Request, response: Response, page: Page):
+    if page.next_cursor:
+        next_url = request.url.include_query_params(cursor=page.next_cursor)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+
+
+def invalid_cursor_response() -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content={"message": "Invalid cursor"},
+    )
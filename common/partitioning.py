@@ -0,0 +1,228 @@
+import datetime
+import os
+from typing import List, Optional, Tuple
+
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql import text
+
+from common.care import prune_relationships
+from common.field_values import prune_field_values
+from common.rollups import lock_rollups, rebuild_rollups
+from common.utils import get_current_time
+
+PARTITIONED_TABLE = "checkup"
+
+# Catches rows outside every monthly partition so inserts never fail,
+# it should stay empty as long as upcoming partitions are created ahead.
+DEFAULT_PARTITION = f"{PARTITIONED_TABLE}_default"
+
+# Arbitrary key used to serialize partition maintenance across workers.
+PARTITION_LOCK_ID = 7418530
+
+
+def get_months_ahead() -> int:
+    return int(os.getenv("CHECKUP_PARTITION_MONTHS_AHEAD", "3"))
+
+
+def get_retention_months() -> int:
+    # 0 keeps every partition.
+    return int(os.getenv("CHECKUP_RETENTION_MONTHS", "0"))
+
+
+def get_retention_action() -> str:
+    # "detach" keeps expired partitions around as standalone tables for
+    # archiving, "drop" deletes them.
+    return os.getenv("CHECKUP_RETENTION_ACTION", "detach").lower()
+
+
+def month_start(value: datetime.datetime) -> datetime.date:
+    # Partition bounds are UTC months.
+    if value.tzinfo:
+        value = value.astimezone(datetime.timezone.utc)
+
+    return datetime.date(value.year, value.month, 1)
+
+
+def add_months(month: datetime.date, months: int) -> datetime.date:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime.date) -> str:
+    return f"{PARTITIONED_TABLE}_p{month:%Y_%m}"
+
+
+def partition_month(name: str) -> Optional[datetime.date]:
+    prefix = f"{PARTITIONED_TABLE}_p"
+    if not name.startswith(prefix):
+        return None
+
+    return datetime.datetime.strptime(name[len(prefix):], "%Y_%m").date()
+
+
+def get_retention_cutoff(now: datetime.datetime = None) -> Optional[datetime.date]:
+    retention_months = get_retention_months()
+    if retention_months <= 0:
+        return None
+
+    return add_months(month_start(now or get_current_time()), -retention_months)
+
+
+def is_partitioned(connection: Connection) -> bool:
+    if connection.dialect.name != "postgresql":
+        return False
+
+    return connection.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table
+            WHERE partrelid = to_regclass(:table)
+        )
+    """), {"table": PARTITIONED_TABLE}).scalar()
+
+
+def get_partitions(connection: Connection) -> List[str]:
+    result = connection.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        INNER JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(:table)
+        ORDER BY child.relname
+    """), {"table": PARTITIONED_TABLE})
+
+    return result.scalars().all()
+
+
+def partition_bounds(month: datetime.date) -> str:
+    return (f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') "
+            f"TO ('{add_months(month, 1).isoformat()} 00:00:00+00')")
+
+
+def utc_midnight(day: datetime.date) -> datetime.datetime:
+    return datetime.datetime(day.year, day.month, day.day, tzinfo=datetime.timezone.utc)
+
+
+def month_range(month: datetime.date) -> dict:
+    return {"month_start": utc_midnight(month), "month_end": utc_midnight(add_months(month, 1))}
+
+
+def default_partition_has_rows(connection: Connection, month: datetime.date) -> bool:
+    return connection.execute(text(f"""
+        SELECT EXISTS (
+            SELECT 1 FROM {DEFAULT_PARTITION}
+            WHERE date >= :month_start AND date < :month_end
+        )
+    """), month_range(month)).scalar()
+
+
+def create_partition(connection: Connection, month: datetime.date,
+                     has_default: bool = False):
+    name = partition_name(month)
+
+    if not has_default or not default_partition_has_rows(connection, month):
+        connection.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {name} "
+            f"PARTITION OF {PARTITIONED_TABLE} {partition_bounds(month)}")
+        return
+
+    # Postgres refuses to create a partition over rows already sitting in the
+    # default one: they are moved to a standalone table which is then attached.
+    connection.exec_driver_sql(
+        f"CREATE TABLE {name} (LIKE {PARTITIONED_TABLE} INCLUDING DEFAULTS)")
+    connection.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION}
+            WHERE date >= :month_start AND date < :month_end
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """), month_range(month))
+    connection.exec_driver_sql(
+        f"ALTER TABLE {PARTITIONED_TABLE} ATTACH PARTITION {name} {partition_bounds(month)}")
+
+
+def create_partitions(connection: Connection, first_month: datetime.date,
+                      last_month: datetime.date) -> List[str]:
+    existing = set(get_partitions(connection))
+    has_default = DEFAULT_PARTITION in existing
+    created = []
+
+    month = first_month
+    while month <= last_month:
+        name = partition_name(month)
+        if name not in existing:
+            create_partition(connection, month, has_default)
+            created.append(name)
+
+        month = add_months(month, 1)
+
+    return created
+
+
+def detach_expired_partitions(connection: Connection, cutoff: datetime.date) -> List[str]:
+    detached = []
+
+    for name in get_partitions(connection):
+        month = partition_month(name)
+        if month is None or add_months(month, 1) > cutoff:
+            continue
+
+        connection.exec_driver_sql(
+            f"ALTER TABLE {PARTITIONED_TABLE} DETACH PARTITION {name}")
+
+        if get_retention_action() == "drop":
+            connection.exec_driver_sql(f"DROP TABLE {name}")
+
+        detached.append(name)
+
+    return detached
+
+
+def prune_expired_dependents(connection: Connection, cutoff: datetime.date):
+    """Brings the tables derived from checkups in line with the retired partitions.
+
+    checkup_field_value rows older than the cutoff are deleted,
+    care_relationship pairs are recomputed from the remaining checkups and
+    the hospital rollups rebuilt.
+    """
+    expired_before = utc_midnight(cutoff)
+
+    prune_field_values(connection, expired_before)
+    prune_relationships(connection, expired_before)
+
+    lock_rollups(connection)
+    rebuild_rollups(connection)
+
+
+def maintain_partitions(engine: Engine, apply_retention: bool = True) -> Tuple[List[str], List[str]]:
+    """Create the upcoming monthly partitions and retire the expired ones."""
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            return [], []
+
+        connection.execute(
+            text("SELECT pg_advisory_xact_lock(:lock_id)"),
+            {"lock_id": PARTITION_LOCK_ID},
+        )
+
+        current_month = month_start(get_current_time())
+        created = create_partitions(
+            connection, current_month, add_months(current_month, get_months_ahead()))
+
+        cutoff = get_retention_cutoff()
+        detached = []
+        if apply_retention and cutoff:
+            detached = detach_expired_partitions(connection, cutoff)
+
+        if detached:
+            prune_expired_dependents(connection, cutoff)
+
+    return created, detached
+
+
+if __name__ == "__main__":
+    from common.models import engine
+
+    created, detached = maintain_partitions(engine)
+
+    print(f"Created partitions: {', '.join(created) or 'none'}")
+    print(f"Retired partitions: {', '.join(detached) or 'none'}")
@@ -0,0 +1,304 @@
+import datetime
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import Date, Table, and_, cast, delete, exists, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.models import (
+    Admin,
+    CareRelationship,
+    Checkup,
+    Doctor,
+    Hospital,
+    HospitalDailyCheckups,
+    HospitalPatient,
+    HospitalRollup,
+    Template,
+    UserRole,
+)
+from common.utils import DR_TIMEZONE, DR_TIMEZONE_NAME
+
+# (patient_id, doctor_id, template_id, date) of a checkup.
+CheckupKey = Tuple[int, int, int, datetime.datetime]
+
+# (hospital_id, user_role, +1 or -1) of a staff member added or removed.
+StaffChange = Tuple[Optional[int], str, int]
+
+STAFF_COUNTERS = {
+    UserRole.admin: "admins",
+    UserRole.doctor: "doctors",
+}
+
+# Stands for templates without a specialty, the column is part of the key.
+NO_SPECIALTY = 0
+
+ROLLUP_TABLES = (HospitalRollup, HospitalPatient, HospitalDailyCheckups)
+
+
+def checkup_day(date: datetime.datetime) -> datetime.date:
+    # Dates are stored in UTC, SQLite hands them back without a timezone.
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+
+    return date.astimezone(DR_TIMEZONE).date()
+
+
+def get_insert(dialect_name: str):
+    return postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+
+
+def rollup_row(hospital_id: int, doctors: int = 0, admins: int = 0, patients: int = 0) -> dict:
+    return {"hospital_id": hospital_id, "doctors": doctors, "admins": admins,
+            "patients": patients}
+
+
+async def add_to_counters(db: AsyncSession, table: Table, keys: List[str], rows: List[dict]):
+    """Adds the counters in `rows` to the rows with the same keys, creating the missing ones."""
+    if not rows:
+        return
+
+    # A fixed order keeps concurrent writers from locking rows in opposite orders.
+    rows = sorted(rows, key=lambda row: tuple(row[key] for key in keys))
+    counters = [name for name in rows[0] if name not in keys]
+
+    insert = get_insert(db.bind.dialect.name)
+    statement = insert(table).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c[key] for key in keys],
+        set_={name: table.c[name] + statement.excluded[name] for name in counters},
+    )
+
+    await db.execute(statement)
+
+
+async def get_doctor_hospitals(db: AsyncSession, doctor_ids: Set[int]) -> Dict[int, int]:
+    result = await db.execute(
+        select(Doctor.id, Doctor.hospital_id).where(Doctor.id.in_(doctor_ids)))
+    return {doctor_id: hospital_id for doctor_id, hospital_id in result.all()
+            if hospital_id is not None}
+
+
+async def get_template_specialties(db: AsyncSession, template_ids: Set[int]) -> Dict[int, int]:
+    result = await db.execute(
+        select(Template.id, Template.specialty_id).where(Template.id.in_(template_ids)))
+    return {template_id: specialty_id or NO_SPECIALTY
+            for template_id, specialty_id in result.all()}
+
+
+async def record_checkups(db: AsyncSession, checkups: Iterable[CheckupKey]):
+    """Counts new checkups in the rollups within the caller's transaction."""
+    checkups = [checkup for checkup in checkups if checkup[1] is not None]
+    if not checkups:
+        return
+
+    hospitals = await get_doctor_hospitals(db, {doctor_id for _, doctor_id, _, _ in checkups})
+    specialties = await get_template_specialties(
+        db, {template_id for _, _, template_id, _ in checkups})
+
+    daily = Counter()
+    seen = set()
+
+    for patient_id, doctor_id, template_id, date in checkups:
+        hospital_id = hospitals.get(doctor_id)
+        if hospital_id is None:
+            continue
+
+        daily[(hospital_id, checkup_day(date),
+               specialties.get(template_id, NO_SPECIALTY))] += 1
+
+        if patient_id is not None:
+            seen.add((hospital_id, patient_id))
+
+    await add_to_counters(
+        db, HospitalDailyCheckups.__table__, ["hospital_id", "day", "specialty_id"],
+        [{"hospital_id": hospital_id, "day": day, "specialty_id": specialty_id,
+          "checkups": count}
+         for (hospital_id, day, specialty_id), count in daily.items()])
+
+    await add_patients(db, seen)
+
+
+async def add_patients(db: AsyncSession, pairs: Set[Tuple[int, int]]):
+    if not pairs:
+        return
+
+    result = await db.execute(
+        select(HospitalPatient.hospital_id, HospitalPatient.patient_id).where(
+            HospitalPatient.hospital_id.in_({hospital_id for hospital_id, _ in pairs}),
+            HospitalPatient.patient_id.in_({patient_id for _, patient_id in pairs}),
+        ))
+    new_pairs = sorted(pairs - set(result.all()))
+    if not new_pairs:
+        return
+
+    # Two first checkups of a patient committed at the same time can both
+    # count them, the nightly reconciliation corrects it.
+    insert = get_insert(db.bind.dialect.name)
+    await db.execute(
+        insert(HospitalPatient.__table__)
+        .values([{"hospital_id": hospital_id, "patient_id": patient_id}
+                 for hospital_id, patient_id in new_pairs])
+        .on_conflict_do_nothing())
+
+    new_patients = Counter(hospital_id for hospital_id, _ in new_pairs)
+    await add_to_counters(
+        db, HospitalRollup.__table__, ["hospital_id"],
+        [rollup_row(hospital_id, patients=count) for hospital_id, count in new_patients.items()])
+
+
+async def remove_checkup(db: AsyncSession, checkup: CheckupKey):
+    """Takes a deleted checkup out of the rollups.
+
+    Must run after its care relationship was refreshed, a patient stays
+    counted while they have a checkup with any doctor of the hospital.
+    """
+    patient_id, doctor_id, template_id, date = checkup
+    if doctor_id is None:
+        return
+
+    hospitals = await get_doctor_hospitals(db, {doctor_id})
+    hospital_id = hospitals.get(doctor_id)
+    if hospital_id is None:
+        return
+
+    specialties = await get_template_specialties(db, {template_id})
+    await add_to_counters(
+        db, HospitalDailyCheckups.__table__, ["hospital_id", "day", "specialty_id"],
+        [{"hospital_id": hospital_id, "day": checkup_day(date),
+          "specialty_id": specialties.get(template_id, NO_SPECIALTY), "checkups": -1}])
+
+    if patient_id is None:
+        return
+
+    result = await db.execute(select(exists().where(and_(
+        CareRelationship.patient_id == patient_id,
+        CareRelationship.doctor_id.in_(
+            select(Doctor.id).where(Doctor.hospital_id == hospital_id)),
+    ))))
+    if result.scalar():
+        return
+
+    result = await db.execute(delete(HospitalPatient).where(
+        HospitalPatient.hospital_id == hospital_id,
+        HospitalPatient.patient_id == patient_id,
+    ))
+    if result.rowcount:
+        await add_to_counters(
+            db, HospitalRollup.__table__, ["hospital_id"],
+            [rollup_row(hospital_id, patients=-1)])
+
+
+async def record_staff(db: AsyncSession, changes: Iterable[StaffChange]):
+    """Counts admins and doctors added or removed within the caller's transaction."""
+    rows: Dict[int, dict] = {}
+
+    for hospital_id, user_role, delta in changes:
+        counter = STAFF_COUNTERS.get(UserRole(user_role))
+        if hospital_id is None or counter is None:
+            continue
+
+        row = rows.setdefault(hospital_id, rollup_row(hospital_id))
+        row[counter] += delta
+
+    await add_to_counters(db, HospitalRollup.__table__, ["hospital_id"], list(rows.values()))
+
+
+def count_by_hospital(model, *conditions):
+    return (select(func.count()).select_from(model)
+            .where(model.hospital_id == Hospital.id, *conditions).scalar_subquery())
+
+
+def count_staff(model):
+    # Deleting a user keeps its doctor or admin row for the checkup history,
+    # with user_id set to NULL, record_staff already took it out of the counts.
+    return count_by_hospital(model, model.user_id.isnot(None))
+
+
+def select_hospital_checkups(*columns):
+    return (
+        select(*columns)
+        .select_from(Checkup)
+        .join(Doctor, Doctor.id == Checkup.doctor_id)
+        .outerjoin(Template, Template.id == Checkup.template_id)
+        .where(Doctor.hospital_id.isnot(None))
+    )
+
+
+def rebuild_daily_checkups(connection: Connection):
+    table = HospitalDailyCheckups.__table__
+    specialty_id = func.coalesce(Template.specialty_id, NO_SPECIALTY)
+
+    if connection.dialect.name == "postgresql":
+        day = cast(func.timezone(DR_TIMEZONE_NAME, Checkup.date), Date)
+        connection.execute(table.insert().from_select(
+            ["hospital_id", "day", "specialty_id", "checkups"],
+            select_hospital_checkups(Doctor.hospital_id, day, specialty_id, func.count())
+            .group_by(Doctor.hospital_id, day, specialty_id),
+        ))
+        return
+
+    # SQLite has no time zones, the days are counted here instead.
+    result = connection.execute(
+        select_hospital_checkups(Doctor.hospital_id, Checkup.date, specialty_id))
+    daily = Counter(
+        (hospital_id, checkup_day(date), specialty)
+        for hospital_id, date, specialty in result
+    )
+    if daily:
+        connection.execute(table.insert(), [
+            {"hospital_id": hospital_id, "day": day, "specialty_id": specialty,
+             "checkups": count}
+            for (hospital_id, day, specialty), count in daily.items()
+        ])
+
+
+def rebuild_rollups(connection: Connection):
+    """Recomputes every rollup from the source tables."""
+    for model in ROLLUP_TABLES:
+        connection.execute(delete(model))
+
+    connection.execute(HospitalPatient.__table__.insert().from_select(
+        ["hospital_id", "patient_id"],
+        select(Doctor.hospital_id, CareRelationship.patient_id)
+        .join(Doctor, Doctor.id == CareRelationship.doctor_id)
+        .where(Doctor.hospital_id.isnot(None))
+        .distinct(),
+    ))
+
+    connection.execute(HospitalRollup.__table__.insert().from_select(
+        ["hospital_id", "doctors", "admins", "patients"],
+        select(
+            Hospital.id,
+            count_staff(Doctor),
+            count_staff(Admin),
+            count_by_hospital(HospitalPatient),
+        ),
+    ))
+
+    rebuild_daily_checkups(connection)
+
+
+def lock_rollups(connection: Connection):
+    if connection.dialect.name == "postgresql":
+        # Writers wait for the rebuild instead of updating rows it replaces.
+        connection.exec_driver_sql(
+            "LOCK TABLE hospital_rollup, hospital_patient, hospital_daily_checkups "
+            "IN EXCLUSIVE MODE")
+
+
+def reconcile_rollups(engine: Engine):
+    """Nightly job fixing any drift between the rollups and the source tables."""
+    with engine.begin() as connection:
+        lock_rollups(connection)
+        rebuild_rollups(connection)
+
+
+if __name__ == "__main__":
+    from common.models import engine
+
+    reconcile_rollups(engine)
+
+    print("Hospital rollups reconciled")
@@ -0,0 +1,62 @@
+from typing import Optional
+
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text
+
+CONSISTENCY_TOKEN_HEADER = "X-Consistency-Token"
+
+# Handed out when the primary cannot report a WAL position (e.g. SQLite),
+# a replica can never prove it has caught up with it.
+PRIMARY_ONLY_TOKEN = "primary"
+
+
+class RoutingSession(Session):
+    """Reads from the replica until the session writes, then sticks to the primary."""
+
+    def __init__(self, replica=None, **kwargs):
+        super().__init__(**kwargs)
+        self.replica = replica
+        self.use_primary = replica is None
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.use_primary or self._flushing or getattr(clause, "is_dml", False):
+            self.use_primary = True
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+        return self.replica
+
+
+def use_primary(db: AsyncSession):
+    db.sync_session.use_primary = True
+
+
+async def get_consistency_token(db: AsyncSession) -> str:
+    if db.bind.dialect.name != "postgresql":
+        return PRIMARY_ONLY_TOKEN
+
+    result = await db.execute(text("SELECT pg_current_wal_lsn()::text"))
+    return result.scalar()
+
+
+async def apply_consistency_token(db: AsyncSession, token: Optional[str]):
+    if not token or getattr(db.sync_session, "use_primary", True):
+        return
+
+    if token == PRIMARY_ONLY_TOKEN or db.sync_session.replica.dialect.name != "postgresql":
+        use_primary(db)
+        return
+
+    try:
+        result = await db.execute(
+            text("SELECT pg_last_wal_replay_lsn() >= CAST(:token AS pg_lsn)"),
+            {"token": token},
+        )
+        caught_up = result.scalar()
+    except DBAPIError:
+        await db.rollback()
+        caught_up = False
+
+    if not caught_up:
+        use_primary(db)
@@ -1,12 +1,12 @@
 import datetime
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, conlist
+from typing import Any, Dict, List, Optional
 from .patient import Patient
 from .doctor import Doctor
 
 
 class CheckupBase(BaseModel):
-    data: str
+    data: Dict[str, Any]
 
 
 class CheckupIn(CheckupBase):
@@ -16,6 +16,49 @@ class CheckupIn(CheckupBase):
     template_id: int
 
 
+class CheckupSearch(BaseModel):
+    data: Dict[str, Any]
+    patient_id: Optional[int] = None
+    doctor_id: Optional[int] = None
+    template_id: Optional[int] = None
+    date_from: Optional[datetime.datetime] = None
+    date_to: Optional[datetime.datetime] = None
+
+
+class FieldPredicate(BaseModel):
+    field: str
+    eq: Optional[float] = None
+    gt: Optional[float] = None
+    gte: Optional[float] = None
+    lt: Optional[float] = None
+    lte: Optional[float] = None
+    # Only test each patient's most recent value of the field.
+    latest: bool = False
+
+
+class CheckupFilter(BaseModel):
+    template_id: int
+    predicates: conlist(FieldPredicate, min_items=1)
+    hospital_id: Optional[int] = None
+    patient_id: Optional[int] = None
+    doctor_id: Optional[int] = None
+    date_from: Optional[datetime.datetime] = None
+    date_to: Optional[datetime.datetime] = None
+
+
+class CheckupBulkResult(BaseModel):
+    index: int
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class CheckupSeries(BaseModel):
+    field: str
+    total_points: int
+    timestamps: List[datetime.datetime]
+    values: List[float]
+
+
 class Checkup(CheckupBase):
     id: int
     patient: Patient
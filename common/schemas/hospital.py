@@ -1,6 +1,6 @@
 import datetime
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 
 from pydantic.types import constr
 from .location import LocationIn, Location, LocationUpdate
@@ -25,9 +25,34 @@ class HospitalUpdate(BaseModel):
     location: Optional[LocationUpdate] = None
 
 
+class HospitalSuggestion(BaseModel):
+    id: int
+    name: str
+
+    class Config:
+        orm_mode = True
+
+
 class Hospital(HospitalBase):
     id: int
     location: Location
 
     class Config:
         orm_mode = True
+
+
+class DailyCheckups(BaseModel):
+    day: datetime.date
+    specialty_id: Optional[int] = None
+    checkups: int
+
+
+class HospitalStats(BaseModel):
+    hospital_id: int
+    doctors: int
+    admins: int
+    patients: int
+    date_from: datetime.date
+    date_to: datetime.date
+    total_checkups: int
+    checkups: List[DailyCheckups]
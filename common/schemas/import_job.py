@@ -0,0 +1,18 @@
+import datetime
+from typing import Optional
+from pydantic import BaseModel
+from common.models import ImportJobStatus
+
+
+class ImportJob(BaseModel):
+    id: int
+    hospital_id: int
+    status: ImportJobStatus
+    total_rows: int
+    processed_rows: int
+    error: Optional[str] = None
+    created_at: datetime.datetime
+    updated_at: Optional[datetime.datetime] = None
+
+    class Config:
+        orm_mode = True
@@ -1,5 +1,5 @@
 import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 from pydantic.types import constr
 
@@ -8,7 +8,7 @@ from .specialty import Specialty
 
 class TemplateBase(BaseModel):
     title: constr(strip_whitespace=True)
-    headers: constr(strip_whitespace=True)
+    headers: Dict[str, str]
     numeric_fields: Optional[int] = None
     alphanumeric_fields: Optional[int] = None
     created_at: Optional[datetime.datetime] = None
@@ -22,7 +22,7 @@ class TemplateIn(TemplateBase):
 
 class TemplateUpdate(BaseModel):
     title: Optional[constr(strip_whitespace=True)] = None
-    headers: Optional[constr(strip_whitespace=True)] = None
+    headers: Optional[Dict[str, str]] = None
 
 
 class Template(TemplateBase):
@@ -32,3 +32,26 @@ class Template(TemplateBase):
 
     class Config:
         orm_mode = True
+
+
+class Histogram(BaseModel):
+    edges: List[float]
+    counts: List[int]
+
+
+class FieldStats(BaseModel):
+    count: int
+    mean: Optional[float] = None
+    stddev: Optional[float] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+    percentiles: Dict[str, float]
+    histogram: Optional[Histogram] = None
+
+
+class TemplateStats(BaseModel):
+    template_id: int
+    date_from: Optional[datetime.datetime] = None
+    date_to: Optional[datetime.datetime] = None
+    checkups: int
+    fields: Dict[str, FieldStats]
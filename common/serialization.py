@@ -0,0 +1,120 @@
+from typing import Any, Callable, Dict
+
+import orjson
+from fastapi import Response, status
+
+from common.models import Admin, Checkup, Doctor, Patient, Specialty, User
+
+# Same as ORJSONResponse.
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def without_none(document: dict) -> dict:
+    return {key: value for key, value in document.items() if value is not None}
+
+
+# The fields below mirror the schemas in common.schemas, related rows are
+# left as ORM objects for orjson to hand back to the encoder.
+
+def specialty_fields(specialty: Specialty) -> dict:
+    return {
+        "name": specialty.name,
+        "hospital_id": specialty.hospital_id,
+        "id": specialty.id,
+    }
+
+
+def doctor_fields(doctor: Doctor) -> dict:
+    return {
+        "hospital_id": doctor.hospital_id,
+        "schedule": doctor.schedule,
+        "id": doctor.id,
+        "specialties": doctor.specialties,
+    }
+
+
+def patient_fields(patient: Patient) -> dict:
+    return {
+        "blood_type": patient.blood_type,
+        "medical_background": patient.medical_background,
+        "id": patient.id,
+    }
+
+
+def admin_fields(admin: Admin) -> dict:
+    return {"hospital_id": admin.hospital_id, "id": admin.id}
+
+
+def user_fields(user: User) -> dict:
+    return {
+        "user_role": user.user_role,
+        "document_type": user.document_type,
+        "name": user.name,
+        "last_name": user.last_name,
+        "email": user.email,
+        "document_number": user.document_number,
+        "date_of_birth": user.date_of_birth,
+        "created_at": user.created_at,
+        "updated_at": user.updated_at,
+        "id": user.id,
+        "uid": user.uid,
+        "patient": user.patient,
+        "admin": user.admin,
+        "doctor": user.doctor,
+    }
+
+
+def checkup_fields(checkup: Checkup) -> dict:
+    return {
+        "data": checkup.data,
+        "id": checkup.id,
+        "patient": checkup.patient,
+        "doctor": checkup.doctor,
+        "date": checkup.date,
+    }
+
+
+MODEL_FIELDS: Dict[type, Callable[[Any], dict]] = {
+    Specialty: specialty_fields,
+    Doctor: doctor_fields,
+    Patient: patient_fields,
+    Admin: admin_fields,
+    User: user_fields,
+    Checkup: checkup_fields,
+}
+
+
+def encode_model(value: Any) -> dict:
+    """orjson `default` hook turning the ORM rows met while encoding into objects."""
+    fields = MODEL_FIELDS.get(type(value))
+    if fields is None:
+        raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+    return fields(value)
+
+
+def encode_model_without_none(value: Any) -> dict:
+    return without_none(encode_model(value))
+
+
+def render_json(content: Any, response: Response, status_code: int = status.HTTP_200_OK,
+                exclude_none: bool = False) -> Response:
+    """Encodes `content`, ORM rows included, with orjson and sends it as is.
+
+    Returning a response skips the response_model validation and
+    jsonable_encoder pass, which dominate the time spent on large lists:
+    orjson walks the rows itself and only calls back into Python for each
+    ORM object, dates, datetimes and enums are encoded natively.
+    `exclude_none` drops the rows' null fields, like
+    response_model_exclude_none. Headers set on the route's `response`
+    parameter are carried over, as FastAPI does for the responses it builds.
+    """
+    body = orjson.dumps(
+        content,
+        default=encode_model_without_none if exclude_none else encode_model,
+        option=ORJSON_OPTIONS,
+    )
+
+    rendered = Response(body, status_code=status_code, media_type="application/json")
+    rendered.headers.raw.extend(response.headers.raw)
+    return rendered
@@ -0,0 +1,216 @@
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.models import Template
+
+VALID_HEADER_TYPE = {
+    "string": "str",
+    "int": "int"
+}
+
+MAX_CACHED_TEMPLATES = 1000
+
+
+class TemplateDataError(ValueError):
+    """Raised when checkup data does not match its template."""
+
+
+def coerce_str(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise TypeError(value)
+
+    return str(value)
+
+
+def coerce_int(value: Any) -> int:
+    if isinstance(value, bool):
+        raise TypeError(value)
+
+    if isinstance(value, int):
+        return value
+
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+
+    if isinstance(value, str):
+        return int(value.strip())
+
+    raise TypeError(value)
+
+
+COERCERS: Dict[str, Callable[[Any], Any]] = {
+    "str": coerce_str,
+    "int": coerce_int,
+}
+
+
+class CompiledTemplate:
+    """Validates and coerces checkup data for one version of a template.
+
+    Header types are resolved once here, so validating a checkup is a
+    dictionary walk with no parsing.
+    """
+
+    __slots__ = ("fields", "numeric_field_names", "numeric_fields", "alphanumeric_fields")
+
+    def __init__(self, headers: Dict[str, str]):
+        self.fields: Dict[str, Tuple[str, Callable[[Any], Any]]] = {}
+
+        for name, header_type in headers.items():
+            field_type = VALID_HEADER_TYPE.get(header_type)
+            if field_type is None:
+                raise ValueError(f"Invalid header type {header_type} for {name}")
+
+            self.fields[name] = (header_type, COERCERS[field_type])
+
+        self.numeric_field_names = [
+            name for name, (header_type, _) in self.fields.items()
+            if VALID_HEADER_TYPE[header_type] == "int"]
+        self.numeric_fields = len(self.numeric_field_names)
+        self.alphanumeric_fields = len(self.fields) - self.numeric_fields
+
+    def validate(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Returns `data` with its values coerced to the template's types.
+
+        Fields left out or set to null are accepted, fields the template
+        doesn't have are not.
+        """
+        fields = self.fields
+        coerced = {}
+
+        for name, value in data.items():
+            field = fields.get(name)
+            if field is None:
+                raise TemplateDataError(f"unknown field {name}")
+
+            if value is None:
+                coerced[name] = None
+                continue
+
+            header_type, coerce = field
+            try:
+                coerced[name] = coerce(value)
+            except (TypeError, ValueError):
+                raise TemplateDataError(f"{name} must be of type {header_type}")
+
+        return coerced
+
+    def numeric_values(self, data: Dict[str, Any]) -> Dict[str, int]:
+        """Values of the template's int fields in `data`, skipping the ones that don't coerce."""
+        values = {}
+
+        for name in self.numeric_field_names:
+            value = data.get(name)
+            if value is None:
+                continue
+
+            try:
+                values[name] = coerce_int(value)
+            except (TypeError, ValueError):
+                continue
+
+        return values
+
+
+class InvalidTemplate(CompiledTemplate):
+    """Stands in for a template whose headers don't compile, rejecting all its checkups."""
+
+    __slots__ = ("error",)
+
+    def __init__(self, template_id: int, error: ValueError):
+        super().__init__({})
+        self.error = f"template {template_id} has invalid headers: {error}"
+
+    def validate(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        raise TemplateDataError(self.error)
+
+
+def compile_template(template_id: int, headers: Optional[Dict[str, str]]) -> CompiledTemplate:
+    try:
+        return CompiledTemplate(headers or {})
+    except ValueError as err:
+        # Legacy templates can hold header types the API no longer accepts.
+        return InvalidTemplate(template_id, err)
+
+
+class TemplateValidatorCache:
+    """LRU of compiled templates, keyed by template id and updated_at.
+
+    A template updated since it was compiled no longer matches its entry
+    and is compiled again, whichever service made the update.
+    """
+
+    def __init__(self, max_entries: int = MAX_CACHED_TEMPLATES):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[int, Tuple[Optional[datetime.datetime], CompiledTemplate]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, template_id: int,
+            updated_at: Optional[datetime.datetime]) -> Optional[CompiledTemplate]:
+        with self.lock:
+            entry = self.entries.get(template_id)
+            if entry is None or entry[0] != updated_at:
+                return None
+
+            self.entries.move_to_end(template_id)
+            return entry[1]
+
+    def put(self, template_id: int, updated_at: Optional[datetime.datetime],
+            compiled: CompiledTemplate):
+        with self.lock:
+            self.entries[template_id] = (updated_at, compiled)
+            self.entries.move_to_end(template_id)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+template_validators = TemplateValidatorCache()
+
+
+async def get_template_validators(db: AsyncSession,
+                                  template_ids: Iterable[int]) -> Dict[int, CompiledTemplate]:
+    """Compiled templates for the existing templates among `template_ids`.
+
+    Only the ids and versions are read when every template is cached, the
+    headers are fetched for the ones that are missing or outdated.
+    """
+    template_ids = {template_id for template_id in template_ids if template_id is not None}
+    if not template_ids:
+        return {}
+
+    result = await db.execute(
+        select(Template.id, Template.updated_at).where(Template.id.in_(template_ids)))
+
+    validators = {}
+    outdated = []
+    for template_id, updated_at in result.all():
+        compiled = template_validators.get(template_id, updated_at)
+        if compiled is None:
+            outdated.append(template_id)
+        else:
+            validators[template_id] = compiled
+
+    if outdated:
+        result = await db.execute(
+            select(Template.id, Template.updated_at, Template.headers)
+            .where(Template.id.in_(outdated)))
+
+        for template_id, updated_at, headers in result.all():
+            compiled = compile_template(template_id, headers)
+            template_validators.put(template_id, updated_at, compiled)
+            validators[template_id] = compiled
+
+    return validators
@@ -0,0 +1,49 @@
+import asyncio
+import re
+from typing import Awaitable, Callable, Iterable, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+
+def capture_query_plans(engine: Engine, async_engine: AsyncEngine, session_factory: sessionmaker,
+                        query: Callable[[AsyncSession], Awaitable]) -> List[str]:
+    """Runs `query` in a new session and returns the SQLite plans of its statements."""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    async def operation():
+        db = session_factory()
+        try:
+            await query(db)
+        finally:
+            await db.close()
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        asyncio.get_event_loop().run_until_complete(operation())
+    finally:
+        event.remove(async_engine.sync_engine,
+                     "before_cursor_execute", capture)
+
+    plans = []
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            rows = connection.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", tuple(parameters)).all()
+            plans.extend(row[3] for row in rows)
+
+    return plans
+
+
+def assert_no_table_scans(plans: List[str], indexed_tables: Iterable[str]):
+    assert plans
+    for detail in plans:
+        # Eager loads alias their tables as e.g. doctor_1.
+        scanned_table = detail.startswith("SCAN ") and re.sub(
+            r"_\d+$", "", detail.split()[1].strip('"'))
+        assert scanned_table not in indexed_tables, detail
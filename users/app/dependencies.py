@@ -1,5 +1,7 @@
 import os
-from fastapi.param_functions import Depends
+from typing import Optional
+from fastapi import HTTPException, status
+from fastapi.param_functions import Depends, Header
 from fastapi.requests import Request
 from fastapi.security import (
     OAuth2PasswordBearer,
@@ -7,10 +9,11 @@ from fastapi.security import (
     HTTPBearer,
 )
 from fastapi.openapi.models import OAuthFlowImplicit
-from firebase_admin import auth
 
-from common.models import SessionLocal, Session, create_tables
+from common.models import AsyncSessionLocal, AsyncReadSessionLocal, AsyncSession
+from common.routing import CONSISTENCY_TOKEN_HEADER, apply_consistency_token
 from common.schemas.auth import FirebaseUser
+from token_verifier import KeysUnavailableError, TokenVerificationError, get_token_verifier
 
 
 class TokenBearer(HTTPBearer):
@@ -25,16 +28,43 @@ class TokenBearer(HTTPBearer):
 
 
 async def get_current_user(token: str = Depends(TokenBearer())):
-    # check the token with firebase auth
-    user_dict = auth.verify_id_token(token)
+    # check the token against Firebase's signing keys
+    try:
+        user_dict = await get_token_verifier().verify_async(token)
+    except TokenVerificationError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication token",
+        )
+    except KeysUnavailableError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication is temporarily unavailable",
+        )
+
     user = FirebaseUser(**user_dict)
     return user
 
 
-def get_db():
-    create_tables()
-    db = SessionLocal()
+async def get_db():
+    db = AsyncSessionLocal()
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
+
+
+async def get_read_db(
+    consistency_token: Optional[str] = Header(None, alias=CONSISTENCY_TOKEN_HEADER),
+):
+    db = AsyncReadSessionLocal()
+    try:
+        await apply_consistency_token(db, consistency_token)
+        yield db
+    finally:
+        await db.close()
+
+
+def get_import_session_factory():
+    # Import jobs outlive the request, so they open their own sessions.
+    return AsyncSessionLocal
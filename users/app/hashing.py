@@ -0,0 +1,134 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import bcrypt
+
+from common.metrics import Histogram, MetricFamily, register_collector
+
+HASHING_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_executor: ProcessPoolExecutor = None
+_semaphore: asyncio.Semaphore = None
+_semaphore_loop: asyncio.AbstractEventLoop = None
+
+
+class HashingStats:
+    def __init__(self):
+        self.waiting = 0
+        self.in_flight = 0
+        self.wait = Histogram(HASHING_BUCKETS)
+        self.duration = Histogram(HASHING_BUCKETS)
+
+
+stats = HashingStats()
+
+
+def get_hashing_workers() -> int:
+    return int(os.getenv("HASHING_WORKERS", str(os.cpu_count() or 1)))
+
+
+def get_max_pending() -> int:
+    # Jobs handed to the pool at once, the rest wait on the event loop
+    # instead of piling up inside the executor's unbounded queue.
+    return int(os.getenv("HASHING_MAX_PENDING", str(get_hashing_workers() * 2)))
+
+
+def get_bcrypt_rounds() -> int:
+    return int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # Forking a worker that already runs threads (the event loop's thread
+        # pool, the database drivers) can copy locks held by other threads.
+        _executor = ProcessPoolExecutor(
+            max_workers=get_hashing_workers(),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    return _executor
+
+
+def get_semaphore() -> asyncio.Semaphore:
+    global _semaphore, _semaphore_loop
+
+    loop = asyncio.get_running_loop()
+    if _semaphore is None or _semaphore_loop is not loop:
+        _semaphore = asyncio.Semaphore(get_max_pending())
+        _semaphore_loop = loop
+
+    return _semaphore
+
+
+def hash_many(passwords: List[str], rounds: int) -> List[bytes]:
+    return [
+        bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=rounds))
+        for password in passwords
+    ]
+
+
+async def run_in_pool(passwords: List[str]) -> List[bytes]:
+    semaphore = get_semaphore()
+    queued_at = time.perf_counter()
+
+    stats.waiting += 1
+    try:
+        await semaphore.acquire()
+    finally:
+        stats.waiting -= 1
+
+    stats.wait.observe(time.perf_counter() - queued_at)
+    stats.in_flight += 1
+    started_at = time.perf_counter()
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            get_executor(), hash_many, passwords, get_bcrypt_rounds())
+    finally:
+        stats.in_flight -= 1
+        semaphore.release()
+        stats.duration.observe(time.perf_counter() - started_at)
+
+
+async def hash_passwords(passwords: List[str]) -> List[bytes]:
+    """Hashes `passwords` in the process pool, split evenly across its workers.
+
+    The outbox dispatcher hashes a whole batch of new accounts at once,
+    bcrypt would otherwise stall the event loop for the entire batch.
+    """
+    if not passwords:
+        return []
+
+    workers = get_hashing_workers()
+    chunk_size = -(-len(passwords) // workers)
+    chunks = [passwords[index:index + chunk_size]
+              for index in range(0, len(passwords), chunk_size)]
+
+    hashed_chunks = await asyncio.gather(*[run_in_pool(chunk) for chunk in chunks])
+
+    return [hashed for chunk in hashed_chunks for hashed in chunk]
+
+
+def collect_hashing_metrics():
+    return [
+        MetricFamily("password_hashing_queue_depth", "gauge",
+                     "Hashing jobs waiting for a free slot in the pool.",
+                     [("password_hashing_queue_depth", {}, stats.waiting)]),
+        MetricFamily("password_hashing_in_flight", "gauge",
+                     "Hashing jobs running in the pool.",
+                     [("password_hashing_in_flight", {}, stats.in_flight)]),
+        MetricFamily("password_hashing_wait_seconds", "histogram",
+                     "Time hashing jobs waited before reaching the pool.",
+                     stats.wait.samples("password_hashing_wait_seconds", {})),
+        MetricFamily("password_hashing_duration_seconds", "histogram",
+                     "Time hashing jobs spent in the pool.",
+                     stats.duration.samples("password_hashing_duration_seconds", {})),
+    ]
+
+
+register_collector(collect_hashing_metrics)
@@ -0,0 +1,215 @@
+import csv
+import io
+import json
+import traceback
+from typing import List
+
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+import outbox
+import storage
+from common.models import ImportJobStatus, Specialty, User
+from common.rollups import record_staff
+from common.schemas.user import UserIn, UserRole
+from common.utils import get_current_time
+from dependencies import AsyncSession
+
+CSV_MEDIA_TYPE = "text/csv"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+IMPORT_MEDIA_TYPES = (CSV_MEDIA_TYPE, NDJSON_MEDIA_TYPE)
+
+MAX_IMPORT_ROWS = 20000
+
+# Users inserted and committed together, also how often the job's progress moves.
+IMPORT_BATCH_SIZE = 500
+
+IMPORTABLE_ROLES = (UserRole.doctor, UserRole.patient)
+
+USER_COLUMNS = ("user_role", "document_type", "name", "last_name",
+                "email", "document_number", "date_of_birth")
+
+
+class InvalidImportError(ValueError):
+    def __init__(self, message: str, errors: List[dict] = None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+def csv_row_to_user(row: dict, hospital_id: int) -> dict:
+    row = {key: value.strip() for key, value in row.items()
+           if key and value and value.strip()}
+    user = {key: row.get(key) for key in USER_COLUMNS}
+
+    if row.get("user_role") == UserRole.patient:
+        user["patient"] = {
+            "blood_type": row.get("blood_type"),
+            "medical_background": row.get("medical_background"),
+        }
+    elif row.get("user_role") == UserRole.doctor:
+        user["doctor"] = {
+            "hospital_id": hospital_id,
+            "schedule": row.get("schedule"),
+            "specialties": [specialty for specialty in row.get("specialties", "").split(";") if specialty],
+        }
+
+    return user
+
+
+def parse_rows(content: bytes, media_type: str, hospital_id: int) -> List[dict]:
+    try:
+        text = content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise InvalidImportError("File is not UTF-8 encoded")
+
+    if media_type == CSV_MEDIA_TYPE:
+        rows = [csv_row_to_user(row, hospital_id)
+                for row in csv.DictReader(io.StringIO(text))]
+    else:
+        rows = []
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+
+            try:
+                row = json.loads(line)
+            except ValueError:
+                raise InvalidImportError(
+                    "Invalid JSON", [{"row": line_number, "error": "invalid JSON"}])
+
+            if isinstance(row, dict) and isinstance(row.get("doctor"), dict):
+                row["doctor"].setdefault("hospital_id", hospital_id)
+
+            rows.append(row)
+
+    if not rows:
+        raise InvalidImportError("File has no rows")
+
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise InvalidImportError(f"Files are limited to {MAX_IMPORT_ROWS} rows")
+
+    return rows
+
+
+def format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(map(str, detail['loc']))}: {detail['msg']}" for detail in error.errors()
+    )
+
+
+async def validate_rows(db: AsyncSession, rows: List[dict], hospital_id: int) -> List[UserIn]:
+    """Validates every row before anything is written.
+
+    Raises InvalidImportError listing each failing row, so a file with an
+    invalid row imports nothing. A valid file can still fail while it is
+    written, see run_import_job.
+    """
+    errors = []
+    users = []
+    seen_emails = set()
+
+    for row_number, row in enumerate(rows, start=1):
+        try:
+            user = UserIn.parse_obj(row)
+        except ValidationError as e:
+            errors.append({"row": row_number, "error": format_validation_error(e)})
+            continue
+
+        if user.user_role not in IMPORTABLE_ROLES:
+            error = "only doctors and patients can be imported"
+        elif user.user_role == UserRole.patient and user.patient is None:
+            error = "patient fields are missing"
+        elif user.user_role == UserRole.doctor and user.doctor is None:
+            error = "doctor fields are missing"
+        elif user.user_role == UserRole.doctor and user.doctor.hospital_id != hospital_id:
+            error = "doctors can only be imported into your hospital"
+        elif user.email in seen_emails:
+            error = "email is repeated in the file"
+        else:
+            error = None
+
+        if error:
+            errors.append({"row": row_number, "error": error})
+            continue
+
+        seen_emails.add(user.email)
+        users.append((row_number, user))
+
+    emails = [user.email for _, user in users]
+    specialty_ids = {specialty for _, user in users if user.doctor
+                     for specialty in user.doctor.specialties}
+
+    existing_emails = set()
+    if emails:
+        result = await db.execute(select(User.email).where(User.email.in_(emails)))
+        existing_emails = set(result.scalars().all())
+
+    hospital_specialties = set()
+    if specialty_ids:
+        result = await db.execute(select(Specialty.id).where(
+            Specialty.hospital_id == hospital_id, Specialty.id.in_(specialty_ids)))
+        hospital_specialties = set(result.scalars().all())
+
+    for row_number, user in users:
+        if user.email in existing_emails:
+            errors.append({"row": row_number, "error": "email is already used"})
+        elif user.doctor and not set(user.doctor.specialties) <= hospital_specialties:
+            errors.append({"row": row_number, "error": "unknown specialty"})
+
+    if errors:
+        raise InvalidImportError(
+            "The file has invalid rows", sorted(errors, key=lambda error: error["row"]))
+
+    return [user for _, user in users]
+
+
+async def run_import_job(session_factory: sessionmaker, job_id: int,
+                         users: List[UserIn], is_test: bool = False):
+    """Writes the validated users in batches of IMPORT_BATCH_SIZE, one transaction each.
+
+    A failure, such as an email registered since validation, only rolls back
+    its own batch: the job is marked failed and its processed_rows counts
+    the users already imported.
+    """
+    async with session_factory() as db:
+        job = await storage.get_import_job(db, job_id)
+        job.status = ImportJobStatus.running
+        job.updated_at = get_current_time()
+        await db.commit()
+
+        try:
+            specialty_ids = {specialty for user in users if user.doctor
+                             for specialty in user.doctor.specialties}
+            result = await db.execute(
+                select(Specialty).where(Specialty.id.in_(specialty_ids)))
+            specialties = {specialty.id: specialty for specialty in result.scalars().all()}
+
+            for start in range(0, len(users), IMPORT_BATCH_SIZE):
+                batch = users[start:start + IMPORT_BATCH_SIZE]
+                db_users = storage.add_imported_users(db, batch, specialties)
+                await record_staff(db, [(user.doctor.hospital_id, user.user_role, 1)
+                                        for user in batch if user.doctor])
+
+                if not is_test:
+                    await storage.add_account_messages(db, db_users, job.hospital_id)
+
+                job.processed_rows += len(batch)
+                job.updated_at = get_current_time()
+                await db.commit()
+                outbox.notify()
+        except Exception as e:
+            await db.rollback()
+            print(traceback.format_exc())
+
+            job = await storage.get_import_job(db, job_id)
+            job.status = ImportJobStatus.failed
+            job.error = f"Unexpected error after importing {job.processed_rows} rows: {e}"
+            job.updated_at = get_current_time()
+            await db.commit()
+            return
+
+        job.status = ImportJobStatus.completed
+        job.updated_at = get_current_time()
+        await db.commit()
@@ -1,17 +1,42 @@
 import traceback
 import os
 from typing import List, Optional
-from fastapi import FastAPI, status, Depends
-from fastapi.responses import JSONResponse
+from fastapi import BackgroundTasks, FastAPI, Query, Request, Response, status, Depends
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_cloudauth.firebase import FirebaseClaims
 
+import imports
+import outbox
 import storage
 from common.schemas.user import UserIn, User, UserRole, UserUpdate, DoctorOut
 from common.schemas.auth import FirebaseUser
-from dependencies import Session, get_db, get_current_user
+from common.schemas.import_job import ImportJob
+from common.models import AsyncSessionLocal, engine
+from common.migrations import check_schema_version
+from common.metrics import render_metrics
+from common.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    InvalidCursorError,
+    invalid_cursor_response,
+    set_next_link,
+)
+from common.routing import CONSISTENCY_TOKEN_HEADER, get_consistency_token
+from common.serialization import render_json
+from dependencies import (
+    AsyncSession,
+    get_db,
+    get_read_db,
+    get_current_user,
+    get_import_session_factory,
+)
 
-app = FastAPI(title="Users", description="Users service for HospiCloud app.")
+app = FastAPI(
+    title="Users",
+    description="Users service for HospiCloud app.",
+    default_response_class=ORJSONResponse,
+)
 
 origins = ["*"]
 
@@ -24,6 +49,26 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+def verify_schema_version():
+    check_schema_version(engine)
+
+
+@app.on_event("startup")
+async def start_outbox_dispatcher():
+    outbox.start_dispatcher(AsyncSessionLocal, outbox.FirebaseIdentityProvider())
+
+
+@app.on_event("shutdown")
+async def stop_outbox_dispatcher():
+    await outbox.stop_dispatcher()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_metrics("users"))
+
+
 @app.get("/")
 async def home():
     return JSONResponse(
@@ -39,23 +84,31 @@ async def home():
     response_model_exclude_none=True,
     tags=["users"],
 )
-async def register(user: UserIn, db: Session = Depends(get_db), test: bool = False):
+async def register(
+    user: UserIn,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    test: bool = False,
+):
     try:
-        existing_user = storage.get_user_by_email(db, user.email)
+        existing_user = await storage.get_user_by_email(db, user.email)
         if existing_user:
             return JSONResponse(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 content={"message": "Email is already used"},
             )
         if user.user_role == UserRole.admin:
-            return storage.create_admin(db, user, test)
+            db_user = await storage.create_admin(db, user, test)
         elif user.user_role == UserRole.patient:
-            return storage.create_patient(db, user, test)
+            db_user = await storage.create_patient(db, user, test)
         else:
             return JSONResponse(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 content={"message": "Can only register admin or patient."},
             )
+
+        response.headers[CONSISTENCY_TOKEN_HEADER] = await get_consistency_token(db)
+        return db_user
     except Exception:
         print(traceback.format_exc())
 
@@ -74,12 +127,13 @@ async def register(user: UserIn, db: Session = Depends(get_db), test: bool = Fal
 )
 async def create_user(
     user: UserIn,
-    db: Session = Depends(get_db),
+    response: Response,
+    db: AsyncSession = Depends(get_db),
     current_user: FirebaseUser = Depends(get_current_user),
     test: bool = False,
 ):
     try:
-        existing_user = storage.get_user_by_email(db, user.email)
+        existing_user = await storage.get_user_by_email(db, user.email)
         if existing_user:
             return JSONResponse(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -93,17 +147,20 @@ async def create_user(
                 user.user_role == UserRole.doctor
                 and user.doctor.hospital_id == current_user.hospital_id
             ):
-                return storage.create_doctor(db, user, test)
+                db_user = await storage.create_doctor(db, user, test)
             elif (
                 user.user_role == UserRole.admin
                 and user.admin.hospital_id == current_user.hospital_id
             ):
-                return storage.create_admin(db, user, test)
+                db_user = await storage.create_admin(db, user, test)
             else:
                 return JSONResponse(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     content={"message": "User can't add to this hospital."},
                 )
+
+            response.headers[CONSISTENCY_TOKEN_HEADER] = await get_consistency_token(db)
+            return db_user
         else:
             return JSONResponse(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -129,10 +186,20 @@ async def create_user(
 )
 async def get_doctors_by_hospital_id(
     hospital_id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db),
     current_user: FirebaseUser = Depends(get_current_user),
 ):
-    return storage.get_doctors_by_hospital_id(db, hospital_id)
+    try:
+        page = await storage.get_doctors_by_hospital_id(db, hospital_id, cursor, limit)
+    except InvalidCursorError:
+        return invalid_cursor_response()
+
+    set_next_link(request, response, page)
+    return render_json(page.items, response, exclude_none=True)
 
 
 @app.get(
@@ -143,21 +210,112 @@ async def get_doctors_by_hospital_id(
     tags=["users"],
 )
 async def get_users(
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
     user_role: Optional[UserRole] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
     current_user: FirebaseUser = Depends(get_current_user),
 ):
-    if current_user.user_role == UserRole.admin:
-        if user_role and user_role.value != UserRole.patient:
-            return storage.get_users(db, user_role, current_user.hospital_id)
-        else:
-            return storage.get_users(db, hospital_id=current_user.hospital_id)
-    else:
+    if current_user.user_role != UserRole.admin:
         return JSONResponse(
             status_code=status.HTTP_401_UNAUTHORIZED,
             content={"message": "User is not an admin."},
         )
 
+    if not user_role or user_role.value == UserRole.patient:
+        user_role = None
+
+    try:
+        page = await storage.get_users(
+            db, user_role, current_user.hospital_id, cursor, limit)
+    except InvalidCursorError:
+        return invalid_cursor_response()
+
+    set_next_link(request, response, page)
+    return render_json(page.items, response, exclude_none=True)
+
+
+@app.post(
+    "/users/import",
+    response_model=ImportJob,
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["users"],
+)
+async def import_users(
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
+    current_user: FirebaseUser = Depends(get_current_user),
+    session_factory=Depends(get_import_session_factory),
+    test: bool = False,
+):
+    if current_user.user_role != UserRole.admin:
+        return JSONResponse(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={"message": "User is not an admin."},
+        )
+
+    media_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if media_type not in imports.IMPORT_MEDIA_TYPES:
+        return JSONResponse(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            content={"message": f"Send the file as {' or '.join(imports.IMPORT_MEDIA_TYPES)}."},
+        )
+
+    try:
+        rows = imports.parse_rows(
+            await request.body(), media_type, current_user.hospital_id)
+        users = await imports.validate_rows(db, rows, current_user.hospital_id)
+    except imports.InvalidImportError as e:
+        return JSONResponse(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            content={"message": str(e), "errors": e.errors},
+        )
+
+    try:
+        job = await storage.create_import_job(db, current_user.hospital_id, len(users))
+    except Exception:
+        print(traceback.format_exc())
+
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content={"message": "Internal server error, try again later"},
+        )
+
+    background_tasks.add_task(
+        imports.run_import_job, session_factory, job.id, users, test)
+
+    response.headers["Location"] = f"/users/import/{job.id}"
+    return job
+
+
+@app.get(
+    "/users/import/{job_id}",
+    response_model=ImportJob,
+    status_code=status.HTTP_200_OK,
+    tags=["users"],
+)
+async def get_import_job(
+    job_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: FirebaseUser = Depends(get_current_user),
+):
+    job = await storage.get_import_job(db, job_id)
+    if (
+        job is None
+        or current_user.user_role != UserRole.admin
+        or job.hospital_id != current_user.hospital_id
+    ):
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": "Import job not found"},
+        )
+
+    return job
+
 
 @app.get(
     "/users/{user_id}",
@@ -168,10 +326,10 @@ async def get_users(
 )
 async def get_user(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: FirebaseUser = Depends(get_current_user),
 ):
-    db_user = storage.get_user(db, user_id)
+    db_user = await storage.get_user(db, user_id)
     if db_user is None:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND, content={
@@ -190,10 +348,10 @@ async def get_user(
 )
 async def get_user_with_document_number(
     document_number: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: FirebaseUser = Depends(get_current_user),
 ):
-    db_user = storage.get_user(db, document_number=document_number)
+    db_user = await storage.get_user(db, document_number=document_number)
     if db_user is None:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -218,10 +376,11 @@ async def get_user_with_document_number(
 async def update_user(
     user_id: int,
     user_update: UserUpdate,
-    db: Session = Depends(get_db),
+    response: Response,
+    db: AsyncSession = Depends(get_db),
     current_user: FirebaseUser = Depends(get_current_user),
 ):
-    user = storage.get_user(db, user_id)
+    user = await storage.get_user(db, user_id)
 
     if not user:
         return JSONResponse(
@@ -245,7 +404,8 @@ async def update_user(
         ) or (
             current_user.user_role == UserRole.patient and current_user.uid == user.uid
         ):
-            db_user = storage.update_user(db, user_id, user_update)
+            db_user = await storage.update_user(db, user_id, user_update)
+            response.headers[CONSISTENCY_TOKEN_HEADER] = await get_consistency_token(db)
             return db_user
         else:
             return JSONResponse(
@@ -268,11 +428,11 @@ async def update_user(
 )
 async def delete_user(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: FirebaseUser = Depends(get_current_user),
     test: bool = False,
 ):
-    user = storage.get_user(db, user_id)
+    user = await storage.get_user(db, user_id)
 
     if not user:
         return JSONResponse(
@@ -296,7 +456,7 @@ async def delete_user(
         ) or (
             current_user.user_role == UserRole.patient and current_user.uid == user.uid
         ):
-            db_user = storage.delete_user(db, user_id, test)
+            db_user = await storage.delete_user(db, user_id, test)
             return db_user
         else:
             return JSONResponse(
@@ -319,7 +479,11 @@ async def delete_user(
 )
 async def get_user_history(
     user_id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db),
     current_user: FirebaseUser = Depends(get_current_user)
 ):
     if current_user.user_role not in [UserRole.patient, UserRole.doctor]:
@@ -328,4 +492,13 @@ async def get_user_history(
             content={"message": "User unathorized"},
         )
 
-    return storage.get_history(db, user_id)
+    try:
+        page = await storage.get_history(db, user_id, cursor, limit)
+    except InvalidCursorError:
+        return invalid_cursor_response()
+
+    if page is None:
+        return None
+
+    set_next_link(request, response, page)
+    return render_json(page.items, response, exclude_none=True)
@@ -0,0 +1,289 @@
+import asyncio
+import datetime
+import os
+import traceback
+from typing import Dict, List, Optional, Protocol
+
+from firebase_admin import auth, initialize_app
+from sqlalchemy import select, update
+from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from common.models import OutboxMessage, OutboxStatus, User
+from common.schemas.user import UserRole
+from common.utils import get_current_time
+from dependencies import AsyncSession
+from hashing import hash_passwords
+from utils import generate_password
+
+CREATE_ACCOUNT = "create_account"
+DELETE_ACCOUNT = "delete_account"
+
+firebase_app = initialize_app()
+
+_dispatcher: "OutboxDispatcher" = None
+
+
+def get_batch_size() -> int:
+    return int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+
+
+def get_poll_interval() -> float:
+    return float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+
+
+def get_max_attempts() -> int:
+    return int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+
+
+def get_retry_delay(attempts: int) -> datetime.timedelta:
+    # 2s, 4s, 8s... capped at OUTBOX_MAX_RETRY_DELAY.
+    base = float(os.getenv("OUTBOX_RETRY_DELAY", "2"))
+    cap = float(os.getenv("OUTBOX_MAX_RETRY_DELAY", "600"))
+    return datetime.timedelta(seconds=min(cap, base * 2 ** (attempts - 1)))
+
+
+class IdentityProvider(Protocol):
+    def create_account(self, email: str, password: str, display_name: str,
+                       claims: dict) -> str:
+        """Creates the account with its custom claims and returns its uid."""
+
+    def delete_account(self, uid: str):
+        """Deletes the account, accounts that are already gone are ignored."""
+
+
+class FirebaseIdentityProvider:
+    def create_account(self, email: str, password: str, display_name: str,
+                       claims: dict) -> str:
+        try:
+            firebase_user: auth.UserRecord = auth.create_user(
+                email=email,
+                password=password,
+                display_name=display_name,
+            )
+        except auth.EmailAlreadyExistsError:
+            # An earlier attempt created the account but failed before the
+            # claims, its password was never stored so it gets this one.
+            firebase_user = auth.get_user_by_email(email)
+            auth.update_user(firebase_user.uid, password=password)
+
+        auth.set_custom_user_claims(firebase_user.uid, claims)
+        return firebase_user.uid
+
+    def delete_account(self, uid: str):
+        try:
+            auth.delete_user(uid)
+        except auth.UserNotFoundError:
+            pass
+
+
+class FakeIdentityProvider:
+    """In-memory identity provider, `failures` makes the next calls raise."""
+
+    def __init__(self, failures: int = 0):
+        self.accounts: Dict[str, dict] = {}
+        self.failures = failures
+
+    def fail_if_requested(self):
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("Identity provider is unavailable")
+
+    def create_account(self, email: str, password: str, display_name: str,
+                       claims: dict) -> str:
+        self.fail_if_requested()
+
+        uid = f"fake-{email}"
+        self.accounts[uid] = {"email": email, "password": password,
+                              "display_name": display_name, "claims": claims}
+        return uid
+
+    def delete_account(self, uid: str):
+        self.fail_if_requested()
+        self.accounts.pop(uid, None)
+
+
+def new_message(kind: str, user_id: int, payload: dict) -> OutboxMessage:
+    now = get_current_time()
+    return OutboxMessage(
+        kind=kind,
+        user_id=user_id,
+        payload=payload,
+        status=OutboxStatus.pending,
+        attempts=0,
+        available_at=now,
+        created_at=now,
+    )
+
+
+def account_created(user: User, hospital_id: Optional[int]) -> OutboxMessage:
+    """Message creating `user`'s account, the user must be flushed so it has an id.
+
+    The payload carries no password, the account's random password is only
+    generated when the message is sent and only its hash is stored.
+    """
+    return new_message(CREATE_ACCOUNT, user.id, {
+        "email": user.email,
+        "display_name": f"{user.name} {user.last_name}",
+        "claims": {
+            "id": user.id,
+            "user_role": UserRole(user.user_role).value,
+            "hospital_id": hospital_id,
+        },
+    })
+
+
+def account_deleted(user: User) -> OutboxMessage:
+    return new_message(DELETE_ACCOUNT, user.id, {"uid": user.uid})
+
+
+def send(provider: IdentityProvider, kind: str, payload: dict,
+         password: Optional[str] = None) -> Optional[str]:
+    if kind == CREATE_ACCOUNT:
+        return provider.create_account(
+            payload["email"], password, payload["display_name"], payload["claims"])
+
+    if kind == DELETE_ACCOUNT:
+        provider.delete_account(payload["uid"])
+        return None
+
+    raise ValueError(f"Unknown outbox message kind {kind}")
+
+
+async def dispatch_pending(db: AsyncSession, provider: IdentityProvider,
+                           batch_size: int = None) -> int:
+    """Sends one batch of due messages and returns how many were picked up.
+
+    Rows are locked with SKIP LOCKED, so every worker can run a dispatcher
+    without sending a message twice. Failed sends are retried with an
+    exponential backoff until OUTBOX_MAX_ATTEMPTS is reached.
+    """
+    now = get_current_time()
+
+    result = await db.execute(
+        select(OutboxMessage)
+        .where(OutboxMessage.status == OutboxStatus.pending,
+               OutboxMessage.available_at <= now)
+        .order_by(OutboxMessage.id)
+        .limit(batch_size or get_batch_size())
+        .with_for_update(skip_locked=True)
+    )
+    messages: List[OutboxMessage] = result.scalars().all()
+    if not messages:
+        await db.commit()
+        return 0
+
+    # Users deleted before their account was created don't need one anymore.
+    create_user_ids = [message.user_id for message in messages
+                       if message.kind == CREATE_ACCOUNT]
+    result = await db.execute(select(User.id).where(User.id.in_(create_user_ids)))
+    existing_user_ids = set(result.scalars().all())
+
+    to_send = [message for message in messages
+               if message.kind != CREATE_ACCOUNT or message.user_id in existing_user_ids]
+
+    # Every attempt gets a new password, the user row stores its hash once
+    # the account was created with it.
+    passwords = {message.id: generate_password() for message in to_send
+                 if message.kind == CREATE_ACCOUNT}
+    hashed_passwords = {
+        message_id: hashed.decode("ascii") for message_id, hashed in
+        zip(passwords, await hash_passwords(list(passwords.values())))
+    }
+
+    outcomes = await asyncio.gather(*[
+        run_in_threadpool(send, provider, message.kind, message.payload,
+                          passwords.get(message.id))
+        for message in to_send
+    ], return_exceptions=True)
+    outcomes = dict(zip([message.id for message in to_send], outcomes))
+
+    for message in messages:
+        outcome = outcomes.get(message.id)
+
+        if isinstance(outcome, Exception):
+            print("".join(traceback.format_exception(
+                type(outcome), outcome, outcome.__traceback__)))
+
+            message.attempts += 1
+            message.last_error = f"Unexpected error: {outcome}"
+
+            if message.attempts >= get_max_attempts():
+                message.status = OutboxStatus.failed
+                message.processed_at = now
+            else:
+                message.available_at = now + get_retry_delay(message.attempts)
+            continue
+
+        if message.kind == CREATE_ACCOUNT and outcome is not None:
+            result = await db.execute(
+                update(User).where(User.id == message.user_id)
+                .values(uid=outcome, password=hashed_passwords[message.id]))
+
+            if result.rowcount == 0:
+                # Deleted while the account was being created.
+                await run_in_threadpool(provider.delete_account, outcome)
+
+        message.status = OutboxStatus.sent
+        message.processed_at = now
+
+    await db.commit()
+    return len(messages)
+
+
+class OutboxDispatcher:
+    def __init__(self, session_factory: sessionmaker, provider: IdentityProvider,
+                 poll_interval: float = None):
+        self.session_factory = session_factory
+        self.provider = provider
+        self.poll_interval = poll_interval or get_poll_interval()
+        self.wake_up = asyncio.Event()
+        self.task: asyncio.Task = None
+
+    async def run(self):
+        while True:
+            try:
+                async with self.session_factory() as db:
+                    dispatched = await dispatch_pending(db, self.provider)
+            except Exception:
+                print(traceback.format_exc())
+                dispatched = 0
+
+            # A full batch means more messages are probably waiting.
+            if dispatched >= get_batch_size():
+                continue
+
+            try:
+                await asyncio.wait_for(self.wake_up.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake_up.clear()
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+
+def start_dispatcher(session_factory: sessionmaker, provider: IdentityProvider):
+    global _dispatcher
+    _dispatcher = OutboxDispatcher(session_factory, provider)
+    _dispatcher.start()
+
+
+async def stop_dispatcher():
+    global _dispatcher
+    if _dispatcher is not None:
+        await _dispatcher.stop()
+        _dispatcher = None
+
+
+def notify():
+    """Wakes the dispatcher up after messages were committed."""
+    if _dispatcher is not None:
+        _dispatcher.wake_up.set()
@@ -1,16 +1,18 @@
-import bcrypt
 import traceback
-from typing import List
+from typing import Dict, List
 
-from firebase_admin import initialize_app
-from firebase_admin import auth
-from sqlalchemy import or_
-from sqlalchemy.sql import text
+from sqlalchemy import or_, select
+from sqlalchemy.sql import Select
 
-from dependencies import Session
+import outbox
+from dependencies import AsyncSession
 from common.schemas.user import User, UserIn, UserRole, UserUpdate
-from common.models import Base, Patient, User, Admin, Doctor, Specialty, Checkup
-from utils import generate_password
+from common.models import (
+    Base, Patient, User, Admin, Doctor, Specialty, Checkup, ImportJob, CareRelationship,
+)
+from common.loaders import USER_LOADING_OPTIONS, fetch_users_page
+from common.pagination import DEFAULT_PAGE_SIZE, Page, build_page, paginate
+from common.rollups import record_staff
 from common.utils import get_current_time
 
 ALLOWED_USER_UPDATES = ["name", "last_name",
@@ -20,210 +22,178 @@ ALLOWED_PATIENT_UPDATES = ["medical_background"]
 
 ALLOWED_DOCTOR_UPDATES = ["schedule", "specialties"]
 
-firebase_app = initialize_app()
-
-
-def create_patient(db: Session, user: UserIn, is_test: bool = False) -> User:
-    random_password = generate_password()
-    hashed_password = bcrypt.hashpw(
-        random_password.encode("utf-8"), bcrypt.gensalt())
 
+async def create_patient(db: AsyncSession, user: UserIn, is_test: bool = False) -> User:
     try:
-        db_user = User(
-            **user.dict(exclude={"patient"}), password=hashed_password)
+        # The password is set by the outbox once the account is created.
+        db_user = User(**user.dict(exclude={"patient"}))
         db_user.created_at = get_current_time()
         db_patient = Patient(**user.patient.dict(), user=db_user)
 
         db.add(db_user)
         db.add(db_patient)
 
-        db.commit()
-        db.refresh(db_user)
-
         if not is_test:
-            firebase_patient: auth.UserInfo = auth.create_user(
-                email=user.email,
-                password=random_password,
-                display_name=f"{user.name} {user.last_name}",
-            )
+            await db.flush()
+            db.add(outbox.account_created(db_user, None))
 
-            auth.set_custom_user_claims(
-                firebase_patient.uid,
-                {"id": db_user.id, "user_role": UserRole.patient, "hospital_id": None},
-            )
-            db_user.uid = firebase_patient.uid
+        await db.commit()
+        outbox.notify()
 
-        return db_user
+        return await get_user(db, db_user.id)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(traceback.format_exc())
         raise Exception(f"Unexpected error: {e}")
 
 
-def create_admin(db: Session, user: UserIn, is_test: bool = False) -> User:
-    random_password = generate_password()
-    hashed_password = bcrypt.hashpw(
-        random_password.encode("utf-8"), bcrypt.gensalt())
-
+async def create_admin(db: AsyncSession, user: UserIn, is_test: bool = False) -> User:
     try:
-        db_user = User(
-            **user.dict(exclude={"admin"}), password=hashed_password)
+        db_user = User(**user.dict(exclude={"admin"}))
         db_user.created_at = get_current_time()
 
         db_admin = Admin(**user.admin.dict(), user=db_user)
 
         db.add(db_user)
         db.add(db_admin)
-
-        db.commit()
-        db.refresh(db_user)
+        await record_staff(db, [(db_admin.hospital_id, UserRole.admin, 1)])
 
         if not is_test:
-            firebase_admin: auth.UserInfo = auth.create_user(
-                email=user.email,
-                password=random_password,
-                display_name=f"{user.name} {user.last_name}",
-            )
+            await db.flush()
+            db.add(outbox.account_created(db_user, db_admin.hospital_id))
 
-            auth.set_custom_user_claims(
-                firebase_admin.uid,
-                {
-                    "id": db_user.id,
-                    "user_role": UserRole.admin,
-                    "hospital_id": db_admin.hospital_id,
-                },
-            )
-            db_user.uid = firebase_admin.uid
+        await db.commit()
+        outbox.notify()
 
-        return db_user
+        return await get_user(db, db_user.id)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(traceback.format_exc())
         raise Exception(f"Unexpected error: {e}")
 
 
-def create_doctor(db: Session, user: UserIn, is_test: bool = False) -> User:
-    random_password = generate_password()
-    hashed_password = bcrypt.hashpw(
-        random_password.encode("utf-8"), bcrypt.gensalt())
-
+async def create_doctor(db: AsyncSession, user: UserIn, is_test: bool = False) -> User:
     try:
-        db_user = User(
-            **user.dict(exclude={"doctor"}), password=hashed_password)
+        db_user = User(**user.dict(exclude={"doctor"}))
         db_user.created_at = get_current_time()
 
         db_doctor = Doctor(
             **user.doctor.dict(exclude={"specialties"}), user=db_user)
 
-        specialties = db.query(Specialty).filter(
-            Specialty.id.in_(user.doctor.specialties)).all()
+        result = await db.execute(select(Specialty).where(
+            Specialty.id.in_(user.doctor.specialties)))
+        specialties = result.scalars().all()
 
         db_doctor.specialties = specialties
 
         db.add(db_user)
         db.add(db_doctor)
-
-        db.commit()
-        db.refresh(db_doctor)
+        await record_staff(db, [(db_doctor.hospital_id, UserRole.doctor, 1)])
 
         if not is_test:
-            firebase_doctor: auth.UserInfo = auth.create_user(
-                email=user.email,
-                password=random_password,
-                display_name=f"{user.name} {user.last_name}",
-            )
+            await db.flush()
+            db.add(outbox.account_created(db_user, db_doctor.hospital_id))
 
-            auth.set_custom_user_claims(
-                firebase_doctor.uid,
-                {
-                    "id": db_user.id,
-                    "user_role": UserRole.doctor,
-                    "hospital_id": db_doctor.hospital_id,
-                },
-            )
-            db_user.uid = firebase_doctor.uid
+        await db.commit()
+        outbox.notify()
 
-        return db_user
+        return await get_user(db, db_user.id)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(traceback.format_exc())
         raise Exception(f"Unexpected error: {e}")
 
 
-def get_user(db: Session, user_id: int = None, document_number: str = None) -> User:
+async def get_user(db: AsyncSession, user_id: int = None, document_number: str = None) -> User:
+    statement = select(User).options(*USER_LOADING_OPTIONS)
+
     if user_id:
-        return db.query(User).filter(User.id == user_id).first()
+        statement = statement.where(User.id == user_id)
+    else:
+        statement = statement.where(User.document_number == document_number)
 
-    return db.query(User).filter(User.document_number == document_number).first()
+    result = await db.execute(statement)
+    return result.scalars().first()
 
 
-def get_users(
-    db: Session, user_role: UserRole = None, hospital_id: int = None,
-) -> List[User]:
+async def get_users(
+    db: AsyncSession, user_role: UserRole = None, hospital_id: int = None,
+    cursor: str = None, limit: int = DEFAULT_PAGE_SIZE,
+) -> Page:
+    statement = select(User)
+
     if user_role and hospital_id:
         if user_role.value == UserRole.admin:
-            return (
-                db.query(User)
+            statement = (
+                statement
                 .join(Admin)
-                .filter(
+                .where(
                     User.user_role == user_role.value, Admin.hospital_id == hospital_id
                 )
-                .all()
             )
         elif user_role.value == UserRole.doctor:
-            return (
-                db.query(User)
+            statement = (
+                statement
                 .join(Doctor)
-                .filter(
+                .where(
                     User.user_role == user_role.value, Doctor.hospital_id == hospital_id
                 )
-                .all()
             )
+        else:
+            return None
     elif hospital_id:
-        return (
-            db.query(User)
+        statement = (
+            statement
             .outerjoin(Doctor)
             .outerjoin(Admin)
-            .filter(
+            .where(
                 or_(Doctor.hospital_id == hospital_id,
                     Admin.hospital_id == hospital_id)
             )
-            .all()
         )
     elif user_role:
-        return db.query(User).filter(User.user_role == user_role.value).all()
-    else:
-        return db.query(User).all()
+        statement = statement.where(User.user_role == user_role.value)
+
+    return await fetch_users_page(db, statement, cursor, limit)
 
 
-def get_user_by_email(db: Session, email: str) -> User:
+async def get_user_by_email(db: AsyncSession, email: str) -> User:
     try:
-        return db.query(User).filter(User.email == email).first()
+        result = await db.execute(select(User).where(User.email == email))
+        return result.scalars().first()
     except Exception as e:
         print(traceback.format_exc())
         raise Exception(f"Unexpected error: {e}")
 
 
-def delete_user(db: Session, user_id: int, test=False) -> User:
-    user = get_user(db, user_id)
+async def delete_user(db: AsyncSession, user_id: int, test=False) -> User:
+    user = await get_user(db, user_id)
     if not user:
         return None
 
     try:
-        if not test:
-            auth.delete_user(user.uid)
-        db.delete(user)
-        db.commit()
+        # Users without a uid have no account yet, the pending creation is
+        # skipped once the dispatcher sees the user is gone.
+        if not test and user.uid:
+            db.add(outbox.account_deleted(user))
+
+        staff = user.admin or user.doctor
+        if staff is not None:
+            await record_staff(db, [(staff.hospital_id, user.user_role, -1)])
+
+        await db.delete(user)
+        await db.commit()
+        outbox.notify()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(traceback.format_exc())
         raise Exception(f"Unexpected error: {e}")
 
     return user
 
 
-def update_user(db: Session, user_id: int, updated_user: UserUpdate) -> User:
-    user = get_user(db, user_id)
+async def update_user(db: AsyncSession, user_id: int, updated_user: UserUpdate) -> User:
+    user = await get_user(db, user_id)
     if not user:
         return None
 
@@ -246,19 +216,19 @@ def update_user(db: Session, user_id: int, updated_user: UserUpdate) -> User:
             for key, value in dict(updated_user.doctor).items():
                 if do_key_and_value_exist(key, value) and key in ALLOWED_DOCTOR_UPDATES:
                     if key == "specialties":
-                        value = db.query(Specialty).filter(
-                            Specialty.id.in_(updated_user.doctor.specialties)).all()
+                        result = await db.execute(select(Specialty).where(
+                            Specialty.id.in_(updated_user.doctor.specialties)))
+                        value = result.scalars().all()
 
                     setattr(user.doctor, key, value)
 
         user.updated_at = get_current_time()
 
-        db.commit()
-        db.refresh(user)
+        await db.commit()
 
         return user
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(traceback.format_exc())
         raise Exception(f"Unexpected error: {e}")
 
@@ -267,62 +237,121 @@ def do_key_and_value_exist(key, value) -> bool:
     return key is not None and value is not None
 
 
-def get_doctors_by_hospital_id(db: Session, hospital_id: int) -> List[User]:
-    return db.query(User).join(Doctor).filter(Doctor.hospital_id == hospital_id).all()
+async def get_doctors_by_hospital_id(db: AsyncSession, hospital_id: int, cursor: str = None,
+                                     limit: int = DEFAULT_PAGE_SIZE) -> Page:
+    statement = select(User).join(Doctor).where(Doctor.hospital_id == hospital_id)
+    return await fetch_users_page(db, statement, cursor, limit)
 
 
-def get_history(db: Session, user_id: int) -> List[User]:
-    user = get_user(db, user_id)
+async def get_history(db: AsyncSession, user_id: int, cursor: str = None,
+                      limit: int = DEFAULT_PAGE_SIZE) -> Page:
+    user = await get_user(db, user_id)
     if not user:
         return None
 
     if user.user_role.name == UserRole.patient.name:
-        return get_patient_history(db, user.patient.id)
+        return await get_patient_history(db, user.patient.id, cursor, limit)
 
-    return get_doctor_history(db, user.doctor.id)
+    return await get_doctor_history(db, user.doctor.id, cursor, limit)
 
 
-def get_patient_history(db: Session, patient_id: int) -> List[User]:
-    statement = text("""
-    SELECT
-	    "user".id
-    FROM
-        checkup
-    INNER JOIN doctor
-        ON doctor.id = checkup.doctor_id
-    INNER JOIN "user"
-        ON "user".id = doctor.user_id
-    WHERE
-        patient_id = :patient_id;
-    """)
+async def get_patient_history(db: AsyncSession, patient_id: int, cursor: str = None,
+                              limit: int = DEFAULT_PAGE_SIZE) -> Page:
+    statement = (
+        select(User, CareRelationship.last_seen, CareRelationship.doctor_id)
+        .join(Doctor, Doctor.user_id == User.id)
+        .join(CareRelationship, CareRelationship.doctor_id == Doctor.id)
+        .where(CareRelationship.patient_id == patient_id)
+    )
 
-    parameters = {"patient_id": patient_id}
+    page_key = (CareRelationship.last_seen, CareRelationship.doctor_id)
+    return await fetch_history_page(db, statement, page_key, cursor, limit)
 
-    output = db.execute(statement, params=parameters).all()
 
-    doctor_ids = [value for (value,) in output]
+async def get_doctor_history(db: AsyncSession, doctor_id: int, cursor: str = None,
+                             limit: int = DEFAULT_PAGE_SIZE) -> Page:
+    statement = (
+        select(User, CareRelationship.last_seen, CareRelationship.patient_id)
+        .join(Patient, Patient.user_id == User.id)
+        .join(CareRelationship, CareRelationship.patient_id == Patient.id)
+        .where(CareRelationship.doctor_id == doctor_id)
+    )
 
-    return db.query(User).filter(User.id.in_(doctor_ids)).all()
+    page_key = (CareRelationship.last_seen, CareRelationship.patient_id)
+    return await fetch_history_page(db, statement, page_key, cursor, limit)
 
 
-def get_doctor_history(db: Session, doctor_id: int) -> List[User]:
-    statement = text("""
-    SELECT
-        "user".id
-    FROM
-        checkup
-    INNER JOIN patient
-        ON patient.id = checkup.patient_id
-    INNER JOIN "user"
-        ON "user".id = patient.user_id
-    WHERE
-        doctor_id = 1;
-    """)
+async def fetch_history_page(db: AsyncSession, statement: Select, page_key: tuple,
+                             cursor: str, limit: int) -> Page:
+    # Most recently seen first. The page key columns are selected next to the
+    # users so the cursor can be built from the last row.
+    statement = paginate(statement.options(*USER_LOADING_OPTIONS), page_key,
+                         cursor, limit, descending=True)
+
+    result = await db.execute(statement)
+    page = build_page(result.all(), page_key, limit)
+
+    return Page([row.User for row in page.items], page.next_cursor)
+
+
+async def create_import_job(db: AsyncSession, hospital_id: int, total_rows: int) -> ImportJob:
+    try:
+        job = ImportJob(
+            hospital_id=hospital_id,
+            total_rows=total_rows,
+            processed_rows=0,
+            created_at=get_current_time(),
+        )
+
+        db.add(job)
+        await db.commit()
+
+        return job
+    except Exception as e:
+        await db.rollback()
+        print(traceback.format_exc())
+        raise Exception(f"Unexpected error: {e}")
+
+
+async def get_import_job(db: AsyncSession, job_id: int) -> ImportJob:
+    result = await db.execute(select(ImportJob).where(ImportJob.id == job_id))
+    return result.scalars().first()
+
+
+def add_imported_users(
+    db: AsyncSession, users: List[UserIn], specialties: Dict[int, Specialty],
+) -> List[User]:
+    # Passwords are set by the outbox, like for the users created one by one.
+    created_at = get_current_time()
+    db_users = []
+
+    for user in users:
+        db_user = User(**user.dict(exclude={"patient", "admin", "doctor"}))
+        db_user.created_at = created_at
+
+        if user.user_role == UserRole.patient:
+            db.add(Patient(**user.patient.dict(), user=db_user))
+        else:
+            db.add(Doctor(
+                **user.doctor.dict(exclude={"specialties"}),
+                user=db_user,
+                specialties=[specialties[specialty]
+                             for specialty in user.doctor.specialties],
+            ))
+
+        db.add(db_user)
+        db_users.append(db_user)
 
-    parameters = {"doctor_id": doctor_id}
+    return db_users
 
-    output = db.execute(statement, params=parameters).all()
 
-    patient_ids = [value for (value,) in output]
+async def add_account_messages(
+    db: AsyncSession, users: List[User], hospital_id: int,
+):
+    await db.flush()
 
-    return db.query(User).filter(User.id.in_(patient_ids)).all()
+    db.add_all([
+        outbox.account_created(
+            user, hospital_id if user.user_role == UserRole.doctor else None)
+        for user in users
+    ])
@@ -3,13 +3,17 @@ from typing import List
 from pydantic.main import BaseModel
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 import pytest
 from common.database import start_engine
-from common.models import Base, Hospital, User, Patient, Specialty, Doctor, Admin, Checkup
+from common.models import (
+    Base, Hospital, User, Patient, Specialty, Doctor, Admin, Checkup, CareRelationship,
+)
 from common.schemas.auth import FirebaseUser
 from common.schemas.user import UserRole
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
@@ -18,18 +22,28 @@ engine = create_engine(
 TestingSessionLocal = sessionmaker(
     autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+
+TestingAsyncSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+    bind=async_engine,
+    class_=AsyncSession,
+)
+
 
 class CurrentUser(BaseModel):
     email: str
     uid: str
 
 
-def override_get_db():
+async def override_get_db():
+    db = TestingAsyncSessionLocal()
     try:
-        db = TestingSessionLocal()
         yield db
     finally:
-        db.close()
+        await db.close()
 
 
 def override_get_current_user():
@@ -119,9 +133,17 @@ def test_db():
         Specialty(name="general", hospital_id=1),
     ]
 
+    visited_at = datetime.datetime(2021, 11, 1, tzinfo=datetime.timezone.utc)
+
     checkups = [
-        Checkup(doctor_id=1, patient_id=1),
-        Checkup(doctor_id=2, patient_id=1)
+        Checkup(doctor_id=1, patient_id=1, date=visited_at),
+        Checkup(doctor_id=2, patient_id=1, date=visited_at + datetime.timedelta(days=1))
+    ]
+
+    care_relationships = [
+        CareRelationship(patient_id=1, doctor_id=checkup.doctor_id, first_seen=checkup.date,
+                         last_seen=checkup.date, visit_count=1)
+        for checkup in checkups
     ]
 
     db.add(admin_user)
@@ -133,6 +155,7 @@ def test_db():
     db.add_all(doctor_users)
     db.add_all(doctors)
     db.add_all(checkups)
+    db.add_all(care_relationships)
     db.commit()
 
     yield
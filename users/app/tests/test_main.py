@@ -1,11 +1,29 @@
+import asyncio
+import json
+from typing import List
+
+import bcrypt
+import orjson
+from fastapi.encoders import jsonable_encoder
 from fastapi.testclient import TestClient
-from fastapi import responses, status
+from pydantic import parse_obj_as
+from fastapi import Response, responses, status
 from common.schemas.auth import FirebaseUser
 from main import app
-from dependencies import get_db, get_current_user
-from tests.test_db import test_db, override_get_db, override_get_current_user, override_get_current_patient_user
+from outbox import FakeIdentityProvider, dispatch_pending
+import imports
+import storage
+from common.models import HospitalRollup, OutboxMessage, OutboxStatus, User as UserModel
+from common.schemas.user import User
+from common.serialization import render_json
+from sqlalchemy import event, select
+from dependencies import get_db, get_read_db, get_current_user, get_import_session_factory
+from common.rollups import reconcile_rollups
+from tests.test_db import async_engine, engine, test_db, TestingSessionLocal, override_get_db, override_get_current_user, override_get_current_patient_user, TestingAsyncSessionLocal
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+app.dependency_overrides[get_import_session_factory] = lambda: TestingAsyncSessionLocal
 
 app.dependency_overrides[get_current_user] = override_get_current_user
 
@@ -58,6 +76,54 @@ def test_create_doctor(test_db):
     assert len(data["doctor"]["specialties"]) == 2
 
 
+def get_hospital_rollup(hospital_id: int):
+    db = TestingSessionLocal()
+    try:
+        rollup = db.query(HospitalRollup).get(hospital_id)
+        return {"doctors": rollup.doctors, "admins": rollup.admins} if rollup else None
+    finally:
+        db.close()
+
+
+def test_staff_changes_update_hospital_rollup(test_db):
+    payload = {
+        "user_role": "doctor",
+        "document_type": "national_id",
+        "name": "Ana",
+        "last_name": "Perez",
+        "email": "ana.perez@gmail.com",
+        "document_number": "33333333333",
+        "date_of_birth": "1990-03-12",
+        "doctor": {"schedule": "L - V 8:00 - 12:00", "hospital_id": 1, "specialties": []},
+    }
+    headers = {"Authorization": "Bearer test-token"}
+
+    doctor = client.post("/users?test=True", json=payload, headers=headers).json()
+
+    assert get_hospital_rollup(1) == {"doctors": 1, "admins": 0}
+
+    client.delete(f"/users/{doctor['id']}?test=True", headers=headers)
+
+    assert get_hospital_rollup(1) == {"doctors": 0, "admins": 0}
+
+
+def test_reconcile_rollups_skips_deleted_staff(test_db):
+    headers = {"Authorization": "Bearer test-token"}
+
+    # Counts the fixture's staff, inserted without going through the rollups.
+    reconcile_rollups(engine)
+    rollup = get_hospital_rollup(1)
+
+    client.delete("/users/3?test=True", headers=headers)
+
+    assert get_hospital_rollup(1) == {**rollup, "doctors": rollup["doctors"] - 1}
+
+    # The deleted user's doctor row stays for its checkups but isn't counted.
+    reconcile_rollups(engine)
+
+    assert get_hospital_rollup(1) == {**rollup, "doctors": rollup["doctors"] - 1}
+
+
 def test_create_admin(test_db):
     payload = {
         "user_role": "admin",
@@ -212,6 +278,225 @@ def test_get_user_by_document_number(test_db):
     assert data["document_number"] == "12345654322"
 
 
+IMPORT_CSV = """user_role,document_type,name,last_name,email,document_number,date_of_birth,blood_type,medical_background,schedule,specialties
+patient,national_id,Ana,Perez,ana.perez@gmail.com,40000000001,1990-02-01,o_plus,,,
+patient,passport,Luis,Gomez,luis.gomez@gmail.com,40000000002,1985-07-12,a_minus,Asthma,,
+doctor,national_id,Maria,Diaz,maria.diaz@gmail.com,40000000003,1979-11-30,,,L 8:00 - 12:00,1;2
+"""
+
+
+def test_import_users(test_db):
+    response = client.post(
+        "/users/import?test=True",
+        data=IMPORT_CSV,
+        headers={"Authorization": "Bearer test-token", "Content-Type": "text/csv"},
+    )
+    job = response.json()
+
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert job["total_rows"] == 3
+
+    response = client.get(
+        response.headers["location"],
+        headers={"Authorization": "Bearer test-token"},
+    )
+    job = response.json()
+
+    assert job["status"] == "completed"
+    assert job["processed_rows"] == 3
+
+    response = client.get(
+        "/users/document-number/40000000003",
+        headers={"Authorization": "Bearer test-token"},
+    )
+    data = response.json()
+
+    assert len(data["doctor"]["specialties"]) == 2
+
+
+def test_import_users_keeps_committed_batches_on_failure(test_db, monkeypatch):
+    monkeypatch.setattr(imports, "IMPORT_BATCH_SIZE", 2)
+
+    add_imported_users = storage.add_imported_users
+    batches = []
+
+    def fail_second_batch(db, users, *args):
+        batches.append(users)
+        if len(batches) == 2:
+            raise RuntimeError("connection lost")
+
+        return add_imported_users(db, users, *args)
+
+    monkeypatch.setattr(storage, "add_imported_users", fail_second_batch)
+
+    response = client.post(
+        "/users/import?test=True",
+        data=IMPORT_CSV,
+        headers={"Authorization": "Bearer test-token", "Content-Type": "text/csv"},
+    )
+    job = client.get(
+        response.headers["location"], headers={"Authorization": "Bearer test-token"},
+    ).json()
+
+    assert job["status"] == "failed"
+    assert job["processed_rows"] == 2
+    assert job["error"] == "Unexpected error after importing 2 rows: connection lost"
+
+
+def test_import_users_rejects_invalid_rows(test_db):
+    rows = IMPORT_CSV.replace("ana.perez@gmail.com", "test@gmail.com").replace(
+        "a_minus", "unknown")
+
+    response = client.post(
+        "/users/import?test=True",
+        data=rows,
+        headers={"Authorization": "Bearer test-token", "Content-Type": "text/csv"},
+    )
+    data = response.json()
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert [error["row"] for error in data["errors"]] == [1, 2]
+    assert data["errors"][0]["error"] == "email is already used"
+
+
+def test_metrics_exports_hashing_usage(test_db):
+    response = client.get("/metrics")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert 'password_hashing_queue_depth{service="users"} 0' in response.text
+    assert 'password_hashing_duration_seconds_count{service="users"}' in response.text
+
+
+def test_get_users_list_takes_fixed_number_of_queries(test_db):
+    statements = []
+
+    def record(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        response = client.get("/users", headers={"Authorization": "Bearer test-token"})
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+    roles = {user["user_role"] for user in response.json()}
+
+    assert response.status_code == status.HTTP_200_OK
+    assert roles == {"admin", "doctor"}
+    assert len(statements) == 2
+
+
+def test_render_json_of_users_matches_response_model(test_db):
+    client.post(
+        "/users?test=True",
+        json={
+            "user_role": "doctor",
+            "document_type": "passport",
+            "name": "Ines",
+            "last_name": "Rosario",
+            "email": "ines.rosario@gmail.com",
+            "document_number": "55555555555",
+            "date_of_birth": "1980-04-02",
+            "doctor": {"schedule": "L 8:00 - 12:00", "hospital_id": 1, "specialties": [1, 2]},
+        },
+        headers={"Authorization": "Bearer test-token"},
+    )
+
+    async def load_users():
+        async with TestingAsyncSessionLocal() as db:
+            return (await storage.get_users(db)).items
+
+    users = asyncio.get_event_loop().run_until_complete(load_users())
+    expected = json.loads(json.dumps(
+        jsonable_encoder(parse_obj_as(List[User], users), exclude_none=True)))
+
+    assert orjson.loads(render_json(users, Response(), exclude_none=True).body) == expected
+
+
+def dispatch_outbox(provider):
+    async def dispatch():
+        async with TestingAsyncSessionLocal() as db:
+            return await dispatch_pending(db, provider)
+
+    return asyncio.get_event_loop().run_until_complete(dispatch())
+
+
+def get_outbox_messages():
+    async def query():
+        async with TestingAsyncSessionLocal() as db:
+            result = await db.execute(select(OutboxMessage).order_by(OutboxMessage.id))
+            return result.scalars().all()
+
+    return asyncio.get_event_loop().run_until_complete(query())
+
+
+OUTBOX_PATIENT = {
+    "user_role": "patient",
+    "document_type": "national_id",
+    "name": "Rosa",
+    "last_name": "Mejia",
+    "email": "rosa.mejia@gmail.com",
+    "document_number": "33333333333",
+    "date_of_birth": "1995-03-14",
+    "patient": {"medical_background": "None", "blood_type": "b_plus"},
+}
+
+
+def test_register_provisions_account_through_outbox(test_db, monkeypatch):
+    monkeypatch.setenv("HASHING_WORKERS", "1")
+    monkeypatch.setenv("BCRYPT_ROUNDS", "4")
+
+    response = client.post("/register", json=OUTBOX_PATIENT)
+    user_id = response.json()["id"]
+
+    assert response.status_code == status.HTTP_201_CREATED
+
+    message, = get_outbox_messages()
+    assert message.status == OutboxStatus.pending
+    assert message.payload["claims"] == {
+        "id": user_id, "user_role": "patient", "hospital_id": None}
+    assert "password" not in message.payload
+
+    provider = FakeIdentityProvider()
+    assert dispatch_outbox(provider) == 1
+
+    message, = get_outbox_messages()
+    assert message.status == OutboxStatus.sent
+
+    uid = "fake-rosa.mejia@gmail.com"
+    assert provider.accounts[uid]["claims"]["id"] == user_id
+
+    # The stored hash is the one of the password the account was created with.
+    db = TestingSessionLocal()
+    stored_hash = db.query(UserModel).get(user_id).password
+    db.close()
+    assert bcrypt.checkpw(
+        provider.accounts[uid]["password"].encode("utf-8"), stored_hash.encode("ascii"))
+
+    response = client.get(
+        f"/users/{user_id}", headers={"Authorization": "Bearer test-token"})
+    assert response.json()["uid"] == uid
+
+
+def test_outbox_retries_failed_messages_later(test_db, monkeypatch):
+    monkeypatch.setenv("HASHING_WORKERS", "1")
+    monkeypatch.setenv("BCRYPT_ROUNDS", "4")
+
+    client.post("/register", json=OUTBOX_PATIENT)
+
+    provider = FakeIdentityProvider(failures=1)
+    assert dispatch_outbox(provider) == 1
+
+    message, = get_outbox_messages()
+    assert message.status == OutboxStatus.pending
+    assert message.attempts == 1
+    assert message.last_error is not None
+
+    # The retry is backed off, nothing is due yet.
+    assert dispatch_outbox(provider) == 0
+    assert provider.accounts == {}
+
+
 def test_get_user_medical_history(test_db):
     app.dependency_overrides[get_current_user] = override_get_current_patient_user
 
@@ -222,4 +507,35 @@ def test_get_user_medical_history(test_db):
     data = response.json()
 
     assert response.status_code == status.HTTP_200_OK
-    assert len(data) == 2
+    # Most recently seen doctor first.
+    assert [user["id"] for user in data] == [4, 3]
+
+
+def test_get_doctor_patient_history(test_db):
+    app.dependency_overrides[get_current_user] = override_get_current_patient_user
+
+    response = client.get(
+        "/users/4/history",
+        headers={"Authorization": "Bearer test-token"},
+    )
+    data = response.json()
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [user["id"] for user in data] == [2]
+
+
+def test_get_user_medical_history_paginated(test_db):
+    app.dependency_overrides[get_current_user] = override_get_current_patient_user
+
+    response = client.get(
+        "/users/2/history?limit=1",
+        headers={"Authorization": "Bearer test-token"},
+    )
+    next_url = response.links["next"]["url"]
+
+    assert [user["id"] for user in response.json()] == [4]
+
+    response = client.get(next_url, headers={"Authorization": "Bearer test-token"})
+
+    assert [user["id"] for user in response.json()] == [3]
+    assert "next" not in response.links
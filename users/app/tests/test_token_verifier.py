@@ -0,0 +1,163 @@
+import asyncio
+import time
+
+import pytest
+import requests
+from fastapi import HTTPException
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+
+import dependencies
+from token_verifier import (
+    GoogleCertificateSource,
+    StaticKeySource,
+    TokenVerificationError,
+    TokenVerifier,
+)
+
+PROJECT_ID = "hospicloud-test"
+KEY_ID = "test-key"
+
+private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+PRIVATE_PEM = private_key.private_bytes(
+    serialization.Encoding.PEM,
+    serialization.PrivateFormat.PKCS8,
+    serialization.NoEncryption(),
+).decode("ascii")
+
+PUBLIC_PEM = private_key.public_key().public_bytes(
+    serialization.Encoding.PEM,
+    serialization.PublicFormat.SubjectPublicKeyInfo,
+).decode("ascii")
+
+
+class CountingKeySource(StaticKeySource):
+    def __init__(self, keys):
+        super().__init__(keys)
+        self.calls = 0
+
+    def get_keys(self, refresh=False):
+        self.calls += 1
+        return super().get_keys(refresh)
+
+
+class RotatingKeySource(StaticKeySource):
+    """Only hands out the current keys once asked to refresh."""
+
+    def __init__(self, stale_keys, keys):
+        super().__init__(keys)
+        self.stale_keys = stale_keys
+
+    def get_keys(self, refresh=False):
+        return self.keys if refresh else self.stale_keys
+
+
+def make_token(now: float, lifetime: int = 3600, **claims) -> str:
+    payload = {
+        "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+        "aud": PROJECT_ID,
+        "sub": "firebase-uid",
+        "email": "doctor@hospicloud.com",
+        "iat": int(now),
+        "auth_time": int(now),
+        "exp": int(now) + lifetime,
+    }
+    payload.update(claims)
+
+    return jwt.encode(payload, PRIVATE_PEM, algorithm="RS256", headers={"kid": KEY_ID})
+
+
+def test_verify_returns_claims():
+    verifier = TokenVerifier(PROJECT_ID, StaticKeySource({KEY_ID: PUBLIC_PEM}))
+
+    claims = verifier.verify(make_token(time.time()))
+
+    assert claims["uid"] == "firebase-uid"
+    assert claims["email"] == "doctor@hospicloud.com"
+
+
+def test_verify_caches_verified_tokens():
+    key_source = CountingKeySource({KEY_ID: PUBLIC_PEM})
+    verifier = TokenVerifier(PROJECT_ID, key_source)
+    token = make_token(time.time())
+
+    verifier.verify(token)
+    verifier.verify(token)
+
+    assert key_source.calls == 1
+
+
+def test_verify_drops_cached_token_after_expiry():
+    now = time.time()
+    clock = [now]
+    verifier = TokenVerifier(PROJECT_ID, StaticKeySource({KEY_ID: PUBLIC_PEM}),
+                             clock=lambda: clock[0])
+    token = make_token(now, lifetime=60)
+
+    verifier.verify(token)
+    clock[0] = now + 120
+
+    assert verifier.get_cached(token) is None
+    with pytest.raises(TokenVerificationError):
+        verifier.verify(token)
+
+
+def test_verify_rejects_expired_token():
+    verifier = TokenVerifier(PROJECT_ID, StaticKeySource({KEY_ID: PUBLIC_PEM}))
+
+    with pytest.raises(TokenVerificationError):
+        verifier.verify(make_token(time.time() - 7200))
+
+
+def test_verify_rejects_other_project():
+    verifier = TokenVerifier(PROJECT_ID, StaticKeySource({KEY_ID: PUBLIC_PEM}))
+
+    with pytest.raises(TokenVerificationError):
+        verifier.verify(make_token(time.time(), aud="another-project"))
+
+
+def test_verify_rejects_unknown_key():
+    verifier = TokenVerifier(PROJECT_ID, StaticKeySource({}))
+
+    with pytest.raises(TokenVerificationError):
+        verifier.verify(make_token(time.time()))
+
+
+@pytest.mark.parametrize("claim", ["aud", "iss", "exp", "iat", "sub"])
+def test_verify_rejects_missing_claims(claim):
+    verifier = TokenVerifier(PROJECT_ID, StaticKeySource({KEY_ID: PUBLIC_PEM}))
+    token = make_token(time.time())
+    claims = jwt.get_unverified_claims(token)
+    del claims[claim]
+
+    with pytest.raises(TokenVerificationError):
+        verifier.verify(jwt.encode(
+            claims, PRIVATE_PEM, algorithm="RS256", headers={"kid": KEY_ID}))
+
+
+def test_verifier_requires_project_id():
+    with pytest.raises(ValueError):
+        TokenVerifier(None, StaticKeySource({KEY_ID: PUBLIC_PEM}))
+
+
+def test_verify_refreshes_keys_for_unknown_key_id():
+    verifier = TokenVerifier(PROJECT_ID, RotatingKeySource({}, {KEY_ID: PUBLIC_PEM}))
+
+    assert verifier.verify(make_token(time.time()))["uid"] == "firebase-uid"
+
+
+def test_unavailable_certificates_answer_503(monkeypatch):
+    def fail(*args, **kwargs):
+        raise requests.ConnectionError("googleapis.com is unreachable")
+
+    monkeypatch.setattr(requests, "get", fail)
+    verifier = TokenVerifier(PROJECT_ID, GoogleCertificateSource())
+    monkeypatch.setattr(dependencies, "get_token_verifier", lambda: verifier)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.get_event_loop().run_until_complete(
+            dependencies.get_current_user(make_token(time.time())))
+
+    assert error.value.status_code == 503
@@ -0,0 +1,217 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Protocol
+
+import requests
+from jose import jwt
+from jose.exceptions import JOSEError
+from starlette.concurrency import run_in_threadpool
+
+# Certificates Firebase signs ID tokens with, rotated every few hours.
+GOOGLE_CERTIFICATES_URL = (
+    "https://www.googleapis.com/robot/v1/metadata/x509/"
+    "securetoken@system.gserviceaccount.com"
+)
+
+# Used when the certificates response carries no max-age.
+DEFAULT_CERTIFICATES_MAX_AGE = 3600
+
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+# Tokens signed with an unknown key refresh the certificates at most this
+# often, so made-up key ids can't turn every request into a download.
+MIN_REFRESH_INTERVAL = 60
+
+# Claims a token is rejected without, on top of the signature.
+REQUIRED_CLAIMS = ("aud", "iss", "exp", "iat", "sub")
+
+
+class TokenVerificationError(ValueError):
+    pass
+
+
+class KeysUnavailableError(RuntimeError):
+    """Raised when the verification keys can't be fetched."""
+
+
+class KeySource(Protocol):
+    def get_keys(self, refresh: bool = False) -> Dict[str, str]:
+        """Returns the PEM encoded verification keys by key id.
+
+        `refresh` asks for keys newer than the cached ones, after a token
+        was signed with a key id they don't have.
+        """
+
+
+class StaticKeySource:
+    def __init__(self, keys: Dict[str, str]):
+        self.keys = keys
+
+    def get_keys(self, refresh: bool = False) -> Dict[str, str]:
+        return self.keys
+
+
+class GoogleCertificateSource:
+    """Fetches Google's signing certificates and keeps them for their HTTP cache lifetime."""
+
+    def __init__(self, url: str = GOOGLE_CERTIFICATES_URL, timeout: float = 5,
+                 clock: Callable[[], float] = time.time):
+        self.url = url
+        self.timeout = timeout
+        self.clock = clock
+        self._keys: Dict[str, str] = {}
+        self._fetched_at = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get_keys(self, refresh: bool = False) -> Dict[str, str]:
+        with self._lock:
+            now = self.clock()
+            if refresh and self._fetched_at is not None:
+                refresh = now - self._fetched_at >= MIN_REFRESH_INTERVAL
+
+            if not refresh and now < self._expires_at:
+                return self._keys
+
+            try:
+                response = requests.get(self.url, timeout=self.timeout)
+                response.raise_for_status()
+                keys = response.json()
+            except (requests.RequestException, ValueError) as e:
+                raise KeysUnavailableError(f"Could not fetch the signing certificates: {e}")
+
+            match = MAX_AGE_PATTERN.search(response.headers.get("Cache-Control", ""))
+            max_age = int(match.group(1)) if match else DEFAULT_CERTIFICATES_MAX_AGE
+
+            self._keys = keys
+            self._fetched_at = now
+            self._expires_at = now + max_age
+
+            return self._keys
+
+
+class TokenVerifier:
+    """Verifies Firebase ID tokens locally and remembers the ones it already checked.
+
+    Verified claims are kept in an LRU keyed by the token's SHA-256 until the
+    token expires, so repeated requests with the same token skip the
+    signature check entirely.
+    """
+
+    def __init__(self, project_id: str, key_source: KeySource, cache_size: int = 10000,
+                 clock: Callable[[], float] = time.time):
+        if not project_id:
+            raise ValueError("A Firebase project id is required to verify tokens")
+
+        self.project_id = project_id
+        self.key_source = key_source
+        self.cache_size = cache_size
+        self.clock = clock
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_cached(self, token: str) -> Optional[dict]:
+        token_hash = hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+        with self._lock:
+            claims = self._cache.get(token_hash)
+            if claims is None:
+                return None
+
+            if claims["exp"] <= self.clock():
+                del self._cache[token_hash]
+                return None
+
+            self._cache.move_to_end(token_hash)
+            return claims
+
+    def remember(self, token: str, claims: dict):
+        token_hash = hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+        with self._lock:
+            self._cache[token_hash] = claims
+            self._cache.move_to_end(token_hash)
+
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def decode(self, token: str) -> dict:
+        try:
+            header = jwt.get_unverified_header(token)
+        except JOSEError as e:
+            raise TokenVerificationError(f"Malformed token: {e}")
+
+        if header.get("alg") != "RS256":
+            raise TokenVerificationError("Token is not signed with RS256")
+
+        key_id = header.get("kid")
+        key = self.key_source.get_keys().get(key_id)
+        if key is None:
+            # The keys may have rotated before the cached ones expired.
+            key = self.key_source.get_keys(refresh=True).get(key_id)
+
+        if key is None:
+            raise TokenVerificationError("Token is signed with an unknown key")
+
+        try:
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=["RS256"],
+                audience=self.project_id,
+                issuer=f"https://securetoken.google.com/{self.project_id}",
+                options={
+                    "verify_at_hash": False,
+                    **{f"require_{claim}": True for claim in REQUIRED_CLAIMS},
+                },
+            )
+        except JOSEError as e:
+            raise TokenVerificationError(f"Invalid token: {e}")
+
+        now = self.clock()
+        if claims["exp"] <= now:
+            raise TokenVerificationError("Token has expired")
+
+        if claims.get("iat", now) > now or claims.get("auth_time", now) > now:
+            raise TokenVerificationError("Token was issued in the future")
+
+        if not claims.get("sub"):
+            raise TokenVerificationError("Token has no subject")
+
+        # Same shape as firebase_admin.auth.verify_id_token.
+        claims["uid"] = claims["sub"]
+        return claims
+
+    def verify(self, token: str) -> dict:
+        claims = self.get_cached(token)
+        if claims is None:
+            claims = self.decode(token)
+            self.remember(token, claims)
+
+        return claims
+
+    async def verify_async(self, token: str) -> dict:
+        # Cache hits are answered on the loop, signature checks and
+        # certificate downloads run in the thread pool.
+        claims = self.get_cached(token)
+        if claims is None:
+            claims = await run_in_threadpool(self.decode, token)
+            self.remember(token, claims)
+
+        return claims
+
+
+_verifier: TokenVerifier = None
+
+
+def get_token_verifier() -> TokenVerifier:
+    global _verifier
+    if _verifier is None:
+        project_id = os.getenv("PROJECT_ID") or os.getenv("GOOGLE_CLOUD_PROJECT")
+        _verifier = TokenVerifier(project_id, GoogleCertificateSource())
+
+    return _verifier
@@ -0,0 +1,165 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+import orjson
+from fastapi import Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+
+from common.routing import CONSISTENCY_TOKEN_HEADER
+
+HOSPITALS = "hospitals"
+SPECIALTIES = "specialties"
+TEMPLATES = "templates"
+TEMPLATE_STATS = "template_stats"
+
+# Headers of the original response kept with the cached body.
+CACHED_HEADERS = ("link",)
+
+
+def get_cache_size() -> int:
+    return int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+
+
+def get_stats_cache_ttl() -> float:
+    # Checkups are written by another service and never invalidate the
+    # stats, each result is reused for one bucket of this many seconds.
+    return float(os.getenv("STATS_CACHE_TTL", "300"))
+
+
+def get_cache_ttl() -> float:
+    # Writes only invalidate the worker that handled them, the TTL bounds
+    # how long the other workers keep serving the previous version.
+    return float(os.getenv("RESPONSE_CACHE_TTL", "30"))
+
+
+class CacheEntry(NamedTuple):
+    body: bytes
+    etag: str
+    headers: Dict[str, str]
+    expires_at: float
+
+
+def make_etag(body: bytes) -> str:
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+
+    # If-None-Match uses the weak comparison, W/ prefixes are ignored.
+    candidates = {candidate.strip() for candidate in if_none_match.split(",")}
+    candidates = {candidate[2:] if candidate.startswith("W/") else candidate
+                  for candidate in candidates}
+
+    return "*" in candidates or etag in candidates
+
+
+def render(request: Request, entry: CacheEntry) -> Response:
+    headers = {**entry.headers, "ETag": entry.etag, "Cache-Control": "no-cache"}
+
+    if etag_matches(request, entry.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(entry.body, media_type="application/json", headers=headers)
+
+
+class CacheLookup:
+    def __init__(self, cache: "ResponseCache", request: Request, key: Optional[Tuple],
+                 generation: int, response: Optional[Response]):
+        self.cache = cache
+        self.request = request
+        self.key = key
+        self.generation = generation
+        self.response = response
+
+    def respond(self, model: Any, value: Any, response: Response = None,
+                exclude_none: bool = False) -> Response:
+        """Encodes `value` as `model`, caches it and answers the request.
+
+        The entry is only stored if nothing in its scope was written since
+        the lookup, so a slow read cannot cache data that is already stale.
+        """
+        content = jsonable_encoder(parse_obj_as(model, value), exclude_none=exclude_none)
+        body = orjson.dumps(content)
+
+        headers = {}
+        if response is not None:
+            headers = {name: value for name, value in response.headers.items()
+                       if name in CACHED_HEADERS}
+
+        entry = CacheEntry(body, make_etag(body), headers,
+                           self.cache.clock() + self.cache.ttl)
+
+        if self.key is not None:
+            self.cache.put(self.key, self.generation, entry)
+
+        return render(self.request, entry)
+
+
+class ResponseCache:
+    """In-process LRU of encoded GET responses with a TTL, invalidated per scope."""
+
+    def __init__(self, max_entries: int = None, ttl: float = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries or get_cache_size()
+        self.ttl = ttl if ttl is not None else get_cache_ttl()
+        self.clock = clock
+        self.entries: "OrderedDict[Tuple, CacheEntry]" = OrderedDict()
+        self.generations: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def lookup(self, request: Request, scope: str) -> CacheLookup:
+        generation = self.generations.get(scope, 0)
+
+        # Read-your-writes requests skip the cache, another worker may still
+        # hold the version from before the write.
+        if request.headers.get(CONSISTENCY_TOKEN_HEADER):
+            return CacheLookup(self, request, None, generation, None)
+
+        key = (scope, request.url.path, tuple(sorted(request.query_params.multi_items())))
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at <= self.clock():
+                del self.entries[key]
+                entry = None
+            elif entry is not None:
+                self.entries.move_to_end(key)
+
+        response = render(request, entry) if entry is not None else None
+        return CacheLookup(self, request, key, generation, response)
+
+    def put(self, key: Tuple, generation: int, entry: CacheEntry):
+        with self.lock:
+            if self.generations.get(key[0], 0) != generation:
+                return
+
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, *scopes: str):
+        with self.lock:
+            for scope in scopes:
+                self.generations[scope] = self.generations.get(scope, 0) + 1
+
+            for key in [key for key in self.entries if key[0] in scopes]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+response_cache = ResponseCache()
+
+stats_cache = ResponseCache(ttl=get_stats_cache_ttl())
@@ -1,11 +1,31 @@
 from sqlalchemy.engine import create
-from common.models import SessionLocal, Session, create_tables
+from typing import Optional
+from fastapi import Header
 
+from common.models import AsyncSessionLocal, AsyncReadSessionLocal, AsyncSession
+from common.routing import CONSISTENCY_TOKEN_HEADER, apply_consistency_token
 
-def get_db():
-    create_tables()
-    db = SessionLocal()
+
+async def get_db():
+    db = AsyncSessionLocal()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+async def get_read_db(
+    consistency_token: Optional[str] = Header(None, alias=CONSISTENCY_TOKEN_HEADER),
+):
+    db = AsyncReadSessionLocal()
     try:
+        await apply_consistency_token(db, consistency_token)
         yield db
     finally:
-        db.close()
+        await db.close()
+
+
+def get_export_session_factory():
+    # Exports open their own session inside the streamed body, so the
+    # connection is held while rows are sent and released right after.
+    return AsyncReadSessionLocal
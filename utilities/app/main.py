@@ -1,11 +1,16 @@
 from fastapi import FastAPI, status
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, PlainTextResponse
+from common.models import engine
+from common.migrations import check_schema_version
+from common.metrics import render_metrics
 from routers import templates, specialty, hospital
 
 app = FastAPI(
     title="Utilities",
-    description="Utilities service for HospiCloud app."
+    description="Utilities service for HospiCloud app.",
+    default_response_class=ORJSONResponse,
 )
 
 app.include_router(templates.router)
@@ -23,6 +28,16 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+def verify_schema_version():
+    check_schema_version(engine)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_metrics("utilities"))
+
+
 @app.get("/")
 async def home():
     return JSONResponse(
@@ -1,13 +1,36 @@
+import datetime
 from typing import List, Optional
-from fastapi import APIRouter, Depends, status
-from fastapi.responses import JSONResponse
-from common.schemas.hospital import Hospital, HospitalIn, HospitalUpdate
+from fastapi import APIRouter, Depends, Query, Request, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from common.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    InvalidCursorError,
+    invalid_cursor_response,
+    set_next_link,
+)
+from common.schemas.hospital import (
+    Hospital,
+    HospitalIn,
+    HospitalStats,
+    HospitalSuggestion,
+    HospitalUpdate,
+)
 from common.schemas.user import User
-from dependencies import get_db, Session
+from common.serialization import render_json
+from common.utils import DR_TIMEZONE, get_current_time
+from cache import HOSPITALS, response_cache
+from dependencies import get_db, get_read_db, get_export_session_factory, AsyncSession
 from storage import hospital as hospitals
+from storage import search
+from storage.export import ExportKind, export_hospital
 
 router = APIRouter()
 
+# Days covered by the hospital stats when no range is given, and at most.
+STATS_DAYS = 30
+MAX_STATS_DAYS = 366
+
 
 @router.post(
     "/hospitals",
@@ -15,16 +38,16 @@ router = APIRouter()
     status_code=status.HTTP_201_CREATED,
     tags=["hospitals"]
 )
-async def create_hospital(hospital: HospitalIn, db: Session = Depends(get_db)):
+async def create_hospital(hospital: HospitalIn, db: AsyncSession = Depends(get_db)):
     try:
-        existing_hospital = hospitals.get_hospital_by_name(db, hospital.name)
+        existing_hospital = await hospitals.get_hospital_by_name(db, hospital.name)
         if existing_hospital:
             return JSONResponse(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 content={"message": "Hospital already exists"}
             )
 
-        return hospitals.create_hospital(db, hospital)
+        return await hospitals.create_hospital(db, hospital)
     except ValueError:
         return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -37,21 +60,91 @@ async def create_hospital(hospital: HospitalIn, db: Session = Depends(get_db)):
         )
 
 
+@router.get(
+    "/hospitals/search",
+    response_model=List[Hospital],
+    status_code=status.HTTP_200_OK,
+    tags=["hospitals"]
+)
+async def search_hospitals(q: str, request: Request,
+                           limit: int = Query(search.DEFAULT_SEARCH_LIMIT, ge=1,
+                                              le=search.MAX_SEARCH_LIMIT),
+                           db: AsyncSession = Depends(get_read_db)):
+    lookup = response_cache.lookup(request, HOSPITALS)
+    if lookup.response is not None:
+        return lookup.response
+
+    db_hospitals = await search.search_hospitals(db, q, limit)
+    return lookup.respond(List[Hospital], db_hospitals)
+
+
+@router.get(
+    "/hospitals/autocomplete",
+    response_model=List[HospitalSuggestion],
+    status_code=status.HTTP_200_OK,
+    tags=["hospitals"]
+)
+async def autocomplete_hospitals(q: str, request: Request,
+                                 limit: int = Query(search.DEFAULT_SEARCH_LIMIT, ge=1,
+                                                    le=search.MAX_SEARCH_LIMIT),
+                                 db: AsyncSession = Depends(get_read_db)):
+    lookup = response_cache.lookup(request, HOSPITALS)
+    if lookup.response is not None:
+        return lookup.response
+
+    db_hospitals = await search.autocomplete_hospitals(db, q, limit)
+    return lookup.respond(List[HospitalSuggestion], db_hospitals)
+
+
 @router.get(
     "/hospitals/{hospital_id}",
     response_model=Hospital,
     status_code=status.HTTP_200_OK,
     tags=["hospitals"]
 )
-async def get_hospital(hospital_id: int, db: Session = Depends(get_db)):
-    db_hospital = hospitals.get_hospital_by_id(db, hospital_id)
+async def get_hospital(hospital_id: int, request: Request,
+                       db: AsyncSession = Depends(get_read_db)):
+    lookup = response_cache.lookup(request, HOSPITALS)
+    if lookup.response is not None:
+        return lookup.response
+
+    db_hospital = await hospitals.get_hospital_by_id(db, hospital_id)
+    if db_hospital is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": "Hospital not found"}
+        )
+
+    return lookup.respond(Hospital, db_hospital)
+
+
+@router.get(
+    "/hospitals/{hospital_id}/stats",
+    response_model=HospitalStats,
+    status_code=status.HTTP_200_OK,
+    tags=["hospitals"]
+)
+async def get_hospital_stats(hospital_id: int,
+                             date_from: Optional[datetime.date] = None,
+                             date_to: Optional[datetime.date] = None,
+                             db: AsyncSession = Depends(get_read_db)):
+    date_to = date_to or get_current_time().astimezone(DR_TIMEZONE).date()
+    date_from = date_from or date_to - datetime.timedelta(days=STATS_DAYS - 1)
+
+    if not 0 <= (date_to - date_from).days < MAX_STATS_DAYS:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"message": f"Invalid date range, at most {MAX_STATS_DAYS} days"}
+        )
+
+    db_hospital = await hospitals.get_hospital_by_id(db, hospital_id)
     if db_hospital is None:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content={"message": "Hospital not found"}
         )
 
-    return db_hospital
+    return await hospitals.get_hospital_stats(db, hospital_id, date_from, date_to)
 
 
 @router.get(
@@ -60,8 +153,20 @@ async def get_hospital(hospital_id: int, db: Session = Depends(get_db)):
     status_code=status.HTTP_200_OK,
     tags=["hospitals"]
 )
-async def get_hospitals(db: Session = Depends(get_db), name: Optional[str] = None):
-    return hospitals.get_hospitals(db, name)
+async def get_hospitals(request: Request, response: Response, db: AsyncSession = Depends(get_read_db),
+                        name: Optional[str] = None, cursor: Optional[str] = None,
+                        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    lookup = response_cache.lookup(request, HOSPITALS)
+    if lookup.response is not None:
+        return lookup.response
+
+    try:
+        page = await hospitals.get_hospitals(db, name, cursor, limit)
+    except InvalidCursorError:
+        return invalid_cursor_response()
+
+    set_next_link(request, response, page)
+    return lookup.respond(List[Hospital], page.items, response)
 
 
 @router.put(
@@ -70,9 +175,9 @@ async def get_hospitals(db: Session = Depends(get_db), name: Optional[str] = Non
     status_code=status.HTTP_200_OK,
     tags=["hospitals"]
 )
-async def update_hospital(hospital_id: int, updated_hospital: HospitalUpdate, db: Session = Depends(get_db)):
+async def update_hospital(hospital_id: int, updated_hospital: HospitalUpdate, db: AsyncSession = Depends(get_db)):
     try:
-        db_hospital = hospitals.update_hospital(
+        db_hospital = await hospitals.update_hospital(
             db, hospital_id, updated_hospital)
         if db_hospital is None:
             return JSONResponse(
@@ -94,9 +199,9 @@ async def update_hospital(hospital_id: int, updated_hospital: HospitalUpdate, db
     status_code=status.HTTP_200_OK,
     tags=["hospitals"]
 )
-async def delete_hospital(hospital_id: int, db: Session = Depends(get_db)):
+async def delete_hospital(hospital_id: int, db: AsyncSession = Depends(get_db)):
     try:
-        db_hospital = hospitals.delete_hospital(db, hospital_id)
+        db_hospital = await hospitals.delete_hospital(db, hospital_id)
         if db_hospital is None:
             return JSONResponse(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -118,15 +223,23 @@ async def delete_hospital(hospital_id: int, db: Session = Depends(get_db)):
     response_model_exclude_none=True,
     tags=["hospitals"]
 )
-async def get_admins_by_hospital_id(hospital_id: int, db: Session = Depends(get_db)):
+async def get_admins_by_hospital_id(hospital_id: int, request: Request, response: Response,
+                                    cursor: Optional[str] = None,
+                                    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                                    db: AsyncSession = Depends(get_read_db)):
     try:
-        return hospitals.get_admins(db, hospital_id)
+        page = await hospitals.get_admins(db, hospital_id, cursor, limit)
+    except InvalidCursorError:
+        return invalid_cursor_response()
     except ValueError:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content={"message": "Hospital doesn't exist"}
         )
 
+    set_next_link(request, response, page)
+    return render_json(page.items, response, exclude_none=True)
+
 
 @router.get(
     "/hospitals/{hospital_id}/doctors",
@@ -135,11 +248,48 @@ async def get_admins_by_hospital_id(hospital_id: int, db: Session = Depends(get_
     response_model_exclude_none=True,
     tags=["hospitals"]
 )
-async def get_doctors_by_hospital_id(hospital_id: int, db: Session = Depends(get_db)):
+async def get_doctors_by_hospital_id(hospital_id: int, request: Request, response: Response,
+                                     cursor: Optional[str] = None,
+                                     limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                                     db: AsyncSession = Depends(get_read_db)):
     try:
-        return hospitals.get_doctors(db, hospital_id)
+        page = await hospitals.get_doctors(db, hospital_id, cursor, limit)
+    except InvalidCursorError:
+        return invalid_cursor_response()
     except ValueError:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content={"message": "Hospital doesn't exist"}
         )
+
+    set_next_link(request, response, page)
+    return render_json(page.items, response, exclude_none=True)
+
+
+@router.get(
+    "/hospitals/{hospital_id}/export",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    tags=["hospitals"]
+)
+async def export_hospital_data(hospital_id: int, kind: ExportKind,
+                               db: AsyncSession = Depends(get_read_db),
+                               session_factory=Depends(get_export_session_factory)):
+    db_hospital = await hospitals.get_hospital_by_id(db, hospital_id)
+    if db_hospital is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": "Hospital not found"}
+        )
+
+    # The lookup session would otherwise keep its connection until the
+    # whole export has been sent.
+    await db.close()
+
+    return StreamingResponse(
+        export_hospital(session_factory, hospital_id, kind),
+        media_type="application/x-ndjson",
+        headers={
+            "Content-Disposition": f'attachment; filename="hospital-{hospital_id}-{kind.value}.ndjson"'
+        },
+    )
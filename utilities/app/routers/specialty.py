@@ -1,11 +1,19 @@
 import traceback
-from typing import List
-from fastapi import APIRouter, Depends, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, Query, Request, Response, status
 from fastapi.responses import JSONResponse
 
+from common.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    InvalidCursorError,
+    invalid_cursor_response,
+    set_next_link,
+)
 from common.schemas.specialty import Specialty, SpecialtyIn, SpecialtyUpdate
 from storage import specialty as specialties
-from dependencies import get_db, Session
+from dependencies import get_db, get_read_db, AsyncSession
+from cache import SPECIALTIES, response_cache
 
 router = APIRouter()
 
@@ -16,9 +24,9 @@ router = APIRouter()
     status_code=status.HTTP_201_CREATED,
     tags=["specialties"]
 )
-async def create_specialty(specialty: SpecialtyIn, db: Session = Depends(get_db)):
+async def create_specialty(specialty: SpecialtyIn, db: AsyncSession = Depends(get_db)):
     try:
-        existing_specialty = specialties.get_specialty_by_name(
+        existing_specialty = await specialties.get_specialty_by_name(
             db, specialty.name, specialty.hospital_id)
         if existing_specialty:
             return JSONResponse(
@@ -26,7 +34,7 @@ async def create_specialty(specialty: SpecialtyIn, db: Session = Depends(get_db)
                 content={"message": "Specialty exists in the current hospital"}
             )
 
-        return specialties.create_specialty(db, specialty)
+        return await specialties.create_specialty(db, specialty)
     except ValueError:
         return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -45,15 +53,20 @@ async def create_specialty(specialty: SpecialtyIn, db: Session = Depends(get_db)
     status_code=status.HTTP_200_OK,
     tags=["specialties"]
 )
-async def get_specialty(specialty_id: int, db: Session = Depends(get_db)):
-    db_specialty = specialties.get_specialty_by_id(db, specialty_id)
+async def get_specialty(specialty_id: int, request: Request,
+                        db: AsyncSession = Depends(get_read_db)):
+    lookup = response_cache.lookup(request, SPECIALTIES)
+    if lookup.response is not None:
+        return lookup.response
+
+    db_specialty = await specialties.get_specialty_by_id(db, specialty_id)
     if db_specialty is None:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content={"message": "Specialty not found"}
         )
 
-    return db_specialty
+    return lookup.respond(Specialty, db_specialty)
 
 
 @router.get(
@@ -62,8 +75,21 @@ async def get_specialty(specialty_id: int, db: Session = Depends(get_db)):
     status_code=status.HTTP_200_OK,
     tags=["specialties"]
 )
-async def get_specialties_by_hospital_id(hospital_id: int, db: Session = Depends(get_db)):
-    return specialties.get_specialties(db, hospital_id)
+async def get_specialties_by_hospital_id(hospital_id: int, request: Request, response: Response,
+                                         cursor: Optional[str] = None,
+                                         limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                                         db: AsyncSession = Depends(get_read_db)):
+    lookup = response_cache.lookup(request, SPECIALTIES)
+    if lookup.response is not None:
+        return lookup.response
+
+    try:
+        page = await specialties.get_specialties(db, hospital_id, cursor, limit)
+    except InvalidCursorError:
+        return invalid_cursor_response()
+
+    set_next_link(request, response, page)
+    return lookup.respond(List[Specialty], page.items, response)
 
 
 @router.put(
@@ -72,9 +98,9 @@ async def get_specialties_by_hospital_id(hospital_id: int, db: Session = Depends
     status_code=status.HTTP_200_OK,
     tags=["specialties"]
 )
-async def update_specialty(specialty_id: int, specialty: SpecialtyUpdate, db: Session = Depends(get_db)):
+async def update_specialty(specialty_id: int, specialty: SpecialtyUpdate, db: AsyncSession = Depends(get_db)):
     try:
-        db_specialty = specialties.update_specialty(
+        db_specialty = await specialties.update_specialty(
             db, specialty, specialty_id)
         if db_specialty is None:
             return JSONResponse(
@@ -96,9 +122,9 @@ async def update_specialty(specialty_id: int, specialty: SpecialtyUpdate, db: Se
     status_code=status.HTTP_200_OK,
     tags=["specialties"]
 )
-async def delete_specialty(specialty_id: int, db: Session = Depends(get_db)):
+async def delete_specialty(specialty_id: int, db: AsyncSession = Depends(get_db)):
     try:
-        db_specialty = specialties.delete_specialty(db, specialty_id)
+        db_specialty = await specialties.delete_specialty(db, specialty_id)
         if db_specialty is None:
             return JSONResponse(
                 status_code=status.HTTP_404_NOT_FOUND,
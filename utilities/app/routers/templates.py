@@ -1,11 +1,20 @@
+import datetime
 import traceback
 from typing import Optional, List
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Query, Request, Response, status
 from starlette.responses import JSONResponse
 
-from storage import templates
-from common.schemas.template import Template, TemplateIn, TemplateUpdate
-from dependencies import get_db, Session
+from storage import stats, templates
+from common.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    InvalidCursorError,
+    invalid_cursor_response,
+    set_next_link,
+)
+from common.schemas.template import Template, TemplateIn, TemplateStats, TemplateUpdate
+from dependencies import get_db, get_read_db, AsyncSession
+from cache import TEMPLATE_STATS, TEMPLATES, response_cache, stats_cache
 
 router = APIRouter()
 
@@ -17,9 +26,9 @@ router = APIRouter()
     response_model_exclude_none=True,
     tags=["templates"]
 )
-def create_template(template: TemplateIn, db: Session = Depends(get_db)):
+async def create_template(template: TemplateIn, db: AsyncSession = Depends(get_db)):
     try:
-        existing_template = templates.get_template_by_specialty_id(
+        existing_template = await templates.get_template_by_specialty_id(
             db, template.specialty_id, template.hospital_id)
         if existing_template:
             return JSONResponse(
@@ -27,7 +36,7 @@ def create_template(template: TemplateIn, db: Session = Depends(get_db)):
                 content={"message": "Specialty already has a template assigned"}
             )
 
-        return templates.create_template(db, template)
+        return await templates.create_template(db, template)
     except Exception:
         print(traceback.format_exc())
 
@@ -44,15 +53,48 @@ def create_template(template: TemplateIn, db: Session = Depends(get_db)):
     response_model_exclude_none=True,
     tags=["templates"]
 )
-async def get_template(template_id: int, db: Session = Depends(get_db)):
-    db_template = templates.get_template_by_id(db, template_id)
+async def get_template(template_id: int, request: Request,
+                       db: AsyncSession = Depends(get_read_db)):
+    lookup = response_cache.lookup(request, TEMPLATES)
+    if lookup.response is not None:
+        return lookup.response
+
+    db_template = await templates.get_template_by_id(db, template_id)
+    if db_template is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": "Template not found"}
+        )
+
+    return lookup.respond(Template, db_template, exclude_none=True)
+
+
+@router.get(
+    "/templates/{template_id}/stats",
+    response_model=TemplateStats,
+    status_code=status.HTTP_200_OK,
+    response_model_exclude_none=True,
+    tags=["templates"]
+)
+async def get_template_stats(template_id: int, request: Request,
+                             date_from: Optional[datetime.datetime] = None,
+                             date_to: Optional[datetime.datetime] = None,
+                             bins: int = Query(stats.DEFAULT_HISTOGRAM_BINS, ge=1,
+                                               le=stats.MAX_HISTOGRAM_BINS),
+                             db: AsyncSession = Depends(get_read_db)):
+    lookup = stats_cache.lookup(request, TEMPLATE_STATS)
+    if lookup.response is not None:
+        return lookup.response
+
+    db_template = await templates.get_template_by_id(db, template_id)
     if db_template is None:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content={"message": "Template not found"}
         )
 
-    return db_template
+    template_stats = await stats.get_template_stats(db, db_template, date_from, date_to, bins)
+    return lookup.respond(TemplateStats, template_stats, exclude_none=True)
 
 
 @router.get(
@@ -62,8 +104,21 @@ async def get_template(template_id: int, db: Session = Depends(get_db)):
     response_model_exclude_none=True,
     tags=["templates"]
 )
-async def get_templates(hospital_id: Optional[int] = None, db: Session = Depends(get_db)):
-    return templates.get_templates_by_hospital_id(db, hospital_id)
+async def get_templates(request: Request, response: Response, hospital_id: Optional[int] = None,
+                        cursor: Optional[str] = None,
+                        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                        db: AsyncSession = Depends(get_read_db)):
+    lookup = response_cache.lookup(request, TEMPLATES)
+    if lookup.response is not None:
+        return lookup.response
+
+    try:
+        page = await templates.get_templates_by_hospital_id(db, hospital_id, cursor, limit)
+    except InvalidCursorError:
+        return invalid_cursor_response()
+
+    set_next_link(request, response, page)
+    return lookup.respond(List[Template], page.items, response, exclude_none=True)
 
 
 @router.put(
@@ -73,9 +128,9 @@ async def get_templates(hospital_id: Optional[int] = None, db: Session = Depends
     response_model_exclude_none=True,
     tags=["templates"]
 )
-async def update_template(template_id: int, template: TemplateUpdate, db: Session = Depends(get_db)):
+async def update_template(template_id: int, template: TemplateUpdate, db: AsyncSession = Depends(get_db)):
     try:
-        db_template = templates.update_template(db, template_id, template)
+        db_template = await templates.update_template(db, template_id, template)
         if db_template is None:
             return JSONResponse(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -97,9 +152,9 @@ async def update_template(template_id: int, template: TemplateUpdate, db: Sessio
     response_model_exclude_none=True,
     tags=["templates"]
 )
-async def delete_template(template_id: int, db: Session = Depends(get_db)):
+async def delete_template(template_id: int, db: AsyncSession = Depends(get_db)):
     try:
-        db_template = templates.delete_template(db, template_id)
+        db_template = await templates.delete_template(db, template_id)
         if db_template is None:
             return JSONResponse(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -121,5 +176,14 @@ async def delete_template(template_id: int, db: Session = Depends(get_db)):
     response_model_exclude_none=True,
     tags=["templates"]
 )
-async def get_templates_by_doctor_id(doctor_id: int, db: Session = Depends(get_db)):
-    return templates.get_templates_by_doctor_id(db, doctor_id)
+async def get_templates_by_doctor_id(doctor_id: int, request: Request, response: Response,
+                                     cursor: Optional[str] = None,
+                                     limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                                     db: AsyncSession = Depends(get_read_db)):
+    try:
+        page = await templates.get_templates_by_doctor_id(db, doctor_id, cursor, limit)
+    except InvalidCursorError:
+        return invalid_cursor_response()
+
+    set_next_link(request, response, page)
+    return page.items
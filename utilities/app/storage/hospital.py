@@ -1,10 +1,19 @@
+import datetime
 import traceback
-from typing import List
+
+from sqlalchemy import select
 from common.schemas.hospital import Hospital, HospitalIn, HospitalUpdate
 from common.schemas.location import Province
-from common.models import Hospital, Location, User, Admin, Doctor
+from common.models import (
+    Hospital, Location, User, Admin, Doctor, HospitalDailyCheckups, HospitalRollup,
+)
+from common.loaders import fetch_users_page
+from common.pagination import DEFAULT_PAGE_SIZE, Page, fetch_page
+from common.rollups import NO_SPECIALTY
 from common.utils import get_current_time
-from dependencies import Session
+from dependencies import AsyncSession
+from cache import HOSPITALS, SPECIALTIES, TEMPLATE_STATS, TEMPLATES, response_cache, stats_cache
+from storage.search import normalize, search_name
 
 
 def is_province_valid(province: str) -> bool:
@@ -16,7 +25,7 @@ def is_province_valid(province: str) -> bool:
     return True
 
 
-def create_hospital(db: Session, hospital: HospitalIn) -> Hospital:
+async def create_hospital(db: AsyncSession, hospital: HospitalIn) -> Hospital:
     try:
         if not is_province_valid(hospital.location.province):
             raise ValueError("Invalid province")
@@ -32,34 +41,46 @@ def create_hospital(db: Session, hospital: HospitalIn) -> Hospital:
         db.add(db_location)
         db.add(db_hospital)
 
-        db.commit()
-        db.refresh(db_hospital)
+        await db.commit()
+        response_cache.invalidate(HOSPITALS)
 
-        return db_hospital
+        return await get_hospital_by_id(db, db_hospital.id)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(traceback.format_exc())
         raise Exception(f'Unexpected error: {e}')
 
 
-def get_hospital_by_name(db: Session, hospital_name: str) -> Hospital:
-    return db.query(Hospital).filter(Hospital.name == hospital_name).first()
+async def get_hospital_by_name(db: AsyncSession, hospital_name: str) -> Hospital:
+    result = await db.execute(
+        select(Hospital).where(Hospital.name == hospital_name))
+    return result.scalars().first()
+
 
+async def get_hospital_by_id(db: AsyncSession, hospital_id: int) -> Hospital:
+    result = await db.execute(
+        select(Hospital).where(Hospital.id == hospital_id))
+    return result.scalars().first()
 
-def get_hospital_by_id(db: Session, hospital_id: int) -> Hospital:
-    return db.query(Hospital).filter(Hospital.id == hospital_id).first()
 
+async def get_hospitals(db: AsyncSession, name: str, cursor: str = None,
+                        limit: int = DEFAULT_PAGE_SIZE) -> Page:
+    statement = select(Hospital)
 
-def get_hospitals(db: Session, name: str) -> List[Hospital]:
     if name:
-        expression = f'%{name}%'
-        return db.query(Hospital).where(Hospital.name.ilike(expression)).all()
+        if db.bind.dialect.name == "postgresql":
+            # Accent-insensitive and served by the trigram index.
+            statement = statement.where(
+                search_name().contains(normalize(name), autoescape=True))
+        else:
+            expression = f'%{name}%'
+            statement = statement.where(Hospital.name.ilike(expression))
 
-    return db.query(Hospital).all()
+    return await fetch_page(db, statement, (Hospital.id,), cursor, limit)
 
 
-def update_hospital(db: Session, hospital_id: int, updated_hospital: HospitalUpdate) -> Hospital:
-    hospital = get_hospital_by_id(db, hospital_id)
+async def update_hospital(db: AsyncSession, hospital_id: int, updated_hospital: HospitalUpdate) -> Hospital:
+    hospital = await get_hospital_by_id(db, hospital_id)
     if not hospital:
         return None
 
@@ -85,43 +106,88 @@ def update_hospital(db: Session, hospital_id: int, updated_hospital: HospitalUpd
 
         hospital.updated_at = get_current_time()
 
-        db.commit()
-        db.refresh(hospital)
+        await db.commit()
+        response_cache.invalidate(HOSPITALS)
 
         return hospital
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(traceback.format_exc())
         raise Exception(f'Unexpected error: {e}')
 
 
-def delete_hospital(db: Session, hospital_id: int) -> Hospital:
-    hospital = get_hospital_by_id(db, hospital_id)
+async def delete_hospital(db: AsyncSession, hospital_id: int) -> Hospital:
+    hospital = await get_hospital_by_id(db, hospital_id)
     if not hospital:
         return None
 
     try:
-        db.delete(hospital)
-        db.commit()
+        await db.delete(hospital)
+        await db.commit()
+        response_cache.invalidate(HOSPITALS, SPECIALTIES, TEMPLATES)
+        stats_cache.invalidate(TEMPLATE_STATS)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(traceback.format_exc())
         raise Exception(f'Unexpected error: {e}')
 
     return hospital
 
 
-def get_admins(db: Session, hospital_id: int) -> List[User]:
-    hospital = get_hospital_by_id(db, hospital_id)
+async def get_admins(db: AsyncSession, hospital_id: int, cursor: str = None,
+                     limit: int = DEFAULT_PAGE_SIZE) -> Page:
+    hospital = await get_hospital_by_id(db, hospital_id)
     if not hospital:
         raise ValueError("hospital doesn't exist")
 
-    return db.query(User).join(Admin).filter(Admin.hospital_id == hospital_id).all()
+    statement = select(User).join(Admin).where(Admin.hospital_id == hospital_id)
+    return await fetch_users_page(db, statement, cursor, limit)
 
 
-def get_doctors(db: Session, hospital_id: int) -> List[User]:
-    hospital = get_hospital_by_id(db, hospital_id)
+async def get_doctors(db: AsyncSession, hospital_id: int, cursor: str = None,
+                      limit: int = DEFAULT_PAGE_SIZE) -> Page:
+    hospital = await get_hospital_by_id(db, hospital_id)
     if not hospital:
         raise ValueError("hospital doesn't exist")
 
-    return db.query(User).join(Doctor).filter(Doctor.hospital_id == hospital_id).all()
+    statement = select(User).join(Doctor).where(Doctor.hospital_id == hospital_id)
+    return await fetch_users_page(db, statement, cursor, limit)
+
+
+async def get_hospital_stats(db: AsyncSession, hospital_id: int, date_from: datetime.date,
+                             date_to: datetime.date) -> dict:
+    """Counters and daily checkups of a hospital, read from the rollups in common/rollups.py.
+
+    Both reads go through primary keys, so the cost depends on the number of
+    days asked for, not on how many users or checkups the hospital has.
+    """
+    rollup = await db.get(HospitalRollup, hospital_id)
+
+    result = await db.execute(
+        select(HospitalDailyCheckups.day, HospitalDailyCheckups.specialty_id,
+               HospitalDailyCheckups.checkups)
+        .where(HospitalDailyCheckups.hospital_id == hospital_id,
+               HospitalDailyCheckups.day >= date_from,
+               HospitalDailyCheckups.day <= date_to,
+               HospitalDailyCheckups.checkups > 0)
+        .order_by(HospitalDailyCheckups.day, HospitalDailyCheckups.specialty_id)
+    )
+    checkups = [
+        {
+            "day": day,
+            "specialty_id": None if specialty_id == NO_SPECIALTY else specialty_id,
+            "checkups": count,
+        }
+        for day, specialty_id, count in result.all()
+    ]
+
+    return {
+        "hospital_id": hospital_id,
+        "doctors": rollup.doctors if rollup else 0,
+        "admins": rollup.admins if rollup else 0,
+        "patients": rollup.patients if rollup else 0,
+        "date_from": date_from,
+        "date_to": date_to,
+        "total_checkups": sum(day["checkups"] for day in checkups),
+        "checkups": checkups,
+    }
@@ -0,0 +1,135 @@
+import re
+import unicodedata
+from typing import List, Set
+
+from sqlalchemy import case, func, or_, select
+
+from common.models import Hospital
+from dependencies import AsyncSession
+
+DEFAULT_SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+
+# Same default as pg_trgm.word_similarity_threshold.
+WORD_SIMILARITY_THRESHOLD = 0.6
+
+
+def normalize(text: str) -> str:
+    """Lowercases `text` and strips its accents, like search_name() in Postgres."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).lower().strip()
+
+
+def trigrams(text: str) -> Set[str]:
+    # pg_trgm pads every word with two spaces in front and one behind.
+    grams = set()
+    for word in re.findall(r"\w+", normalize(text)):
+        padded = f"  {word} "
+        grams.update(padded[index:index + 3] for index in range(len(padded) - 2))
+
+    return grams
+
+
+def word_similarity(query: str, text: str) -> float:
+    """Share of the query's trigrams found in `text`.
+
+    Approximates pg_trgm's word_similarity, which only looks at the best
+    matching stretch of `text`.
+    """
+    query_trigrams = trigrams(query)
+    if not query_trigrams:
+        return 0.0
+
+    return len(query_trigrams & trigrams(text)) / len(query_trigrams)
+
+
+def is_prefix_match(query: str, name: str) -> bool:
+    return name.startswith(query) or f" {query}" in name
+
+
+def search_name():
+    # Backed by the ix_hospital_name_trgm expression index, see migration v008.
+    return func.search_name(Hospital.name)
+
+
+async def search_hospitals(db: AsyncSession, query: str,
+                           limit: int = DEFAULT_SEARCH_LIMIT) -> List[Hospital]:
+    """Hospitals whose name matches `query`, best match first, ignoring case and accents."""
+    query = normalize(query)
+    if not query:
+        return []
+
+    if db.bind.dialect.name != "postgresql":
+        return await search_hospitals_in_python(db, query, limit)
+
+    name = search_name()
+    result = await db.execute(
+        select(Hospital)
+        .where(or_(name.op("%>")(query), name.contains(query, autoescape=True)))
+        .order_by(func.word_similarity(query, name).desc(), Hospital.id)
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+
+async def autocomplete_hospitals(db: AsyncSession, query: str,
+                                 limit: int = DEFAULT_SEARCH_LIMIT) -> List[Hospital]:
+    """Hospitals with a word in their name starting with `query`.
+
+    Names starting with `query` come first, then shorter names.
+    """
+    query = normalize(query)
+    if not query:
+        return []
+
+    if db.bind.dialect.name != "postgresql":
+        return await autocomplete_hospitals_in_python(db, query, limit)
+
+    name = search_name()
+    name_prefix = name.startswith(query, autoescape=True)
+    result = await db.execute(
+        select(Hospital)
+        .where(or_(name_prefix, name.contains(f" {query}", autoescape=True)))
+        .order_by(case((name_prefix, 0), else_=1), func.length(Hospital.name), Hospital.id)
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+
+async def get_hospitals_by_ids(db: AsyncSession, ids: List[int]) -> List[Hospital]:
+    if not ids:
+        return []
+
+    result = await db.execute(select(Hospital).where(Hospital.id.in_(ids)))
+    hospitals = {hospital.id: hospital for hospital in result.scalars().all()}
+
+    return [hospitals[hospital_id] for hospital_id in ids]
+
+
+async def search_hospitals_in_python(db: AsyncSession, query: str, limit: int) -> List[Hospital]:
+    # Fallback for databases without pg_trgm (SQLite in the tests), scores
+    # every name so it is only fit for small tables.
+    result = await db.execute(select(Hospital.id, Hospital.name))
+
+    matches = []
+    for hospital_id, name in result.all():
+        score = word_similarity(query, name)
+        if score >= WORD_SIMILARITY_THRESHOLD or query in normalize(name):
+            matches.append((-score, hospital_id))
+
+    return await get_hospitals_by_ids(
+        db, [hospital_id for _, hospital_id in sorted(matches)[:limit]])
+
+
+async def autocomplete_hospitals_in_python(db: AsyncSession, query: str,
+                                           limit: int) -> List[Hospital]:
+    result = await db.execute(select(Hospital.id, Hospital.name))
+
+    matches = sorted(
+        (not normalize(name).startswith(query), len(name), hospital_id)
+        for hospital_id, name in result.all()
+        if is_prefix_match(query, normalize(name))
+    )
+
+    return await get_hospitals_by_ids(
+        db, [hospital_id for _, _, hospital_id in matches[:limit]])
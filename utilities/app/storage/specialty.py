@@ -1,14 +1,17 @@
 import traceback
-from typing import List, Optional
+from typing import Optional
 
+from sqlalchemy import select
 from sqlalchemy.sql.elements import and_
 
 from common.schemas.specialty import Specialty, SpecialtyIn, SpecialtyUpdate
 from common.models import Specialty
-from dependencies import Session
+from common.pagination import DEFAULT_PAGE_SIZE, Page, fetch_page
+from dependencies import AsyncSession
+from cache import SPECIALTIES, TEMPLATE_STATS, TEMPLATES, response_cache, stats_cache
 
 
-def create_specialty(db: Session, specialty: SpecialtyIn) -> Specialty:
+async def create_specialty(db: AsyncSession, specialty: SpecialtyIn) -> Specialty:
     if not specialty.name:
         raise ValueError("Specialty name is empty")
 
@@ -20,33 +23,38 @@ def create_specialty(db: Session, specialty: SpecialtyIn) -> Specialty:
 
         db.add(db_specialty)
 
-        db.commit()
-        db.refresh(db_specialty)
+        await db.commit()
+        response_cache.invalidate(SPECIALTIES)
 
         return db_specialty
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(traceback.format_exc())
         raise Exception(f'Unexpected error: {e}')
 
 
-def get_specialties(db: Session, hospital_id: int) -> List[Specialty]:
-    return db.query(Specialty).filter(Specialty.hospital_id == hospital_id).all()
+async def get_specialties(db: AsyncSession, hospital_id: int, cursor: str = None,
+                          limit: int = DEFAULT_PAGE_SIZE) -> Page:
+    statement = select(Specialty).where(Specialty.hospital_id == hospital_id)
+    return await fetch_page(db, statement, (Specialty.id,), cursor, limit)
 
 
-def get_specialty_by_name(db: Session, specialty_name: str, hospital_id: int) -> Specialty:
-    return db.query(Specialty).filter(
+async def get_specialty_by_name(db: AsyncSession, specialty_name: str, hospital_id: int) -> Specialty:
+    result = await db.execute(select(Specialty).where(
         Specialty.name == specialty_name,
         Specialty.hospital_id == hospital_id
-    ).first()
+    ))
+    return result.scalars().first()
 
 
-def get_specialty_by_id(db: Session, specialty_id: int) -> Specialty:
-    return db.query(Specialty).filter(Specialty.id == specialty_id).first()
+async def get_specialty_by_id(db: AsyncSession, specialty_id: int) -> Specialty:
+    result = await db.execute(
+        select(Specialty).where(Specialty.id == specialty_id))
+    return result.scalars().first()
 
 
-def update_specialty(db: Session, updated_specialty: SpecialtyUpdate, specialty_id: int) -> Specialty:
-    specialty = get_specialty_by_id(db, specialty_id)
+async def update_specialty(db: AsyncSession, updated_specialty: SpecialtyUpdate, specialty_id: int) -> Specialty:
+    specialty = await get_specialty_by_id(db, specialty_id)
     if not specialty:
         return None
 
@@ -54,26 +62,28 @@ def update_specialty(db: Session, updated_specialty: SpecialtyUpdate, specialty_
         if updated_specialty.name:
             specialty.name = updated_specialty.name
 
-        db.commit()
-        db.refresh(specialty)
+        await db.commit()
+        response_cache.invalidate(SPECIALTIES)
 
         return specialty
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(traceback.format_exc())
         raise Exception(f'Unexpected error: {e}')
 
 
-def delete_specialty(db: Session, specialty_id: int) -> Specialty:
-    specialty = get_specialty_by_id(db, specialty_id)
+async def delete_specialty(db: AsyncSession, specialty_id: int) -> Specialty:
+    specialty = await get_specialty_by_id(db, specialty_id)
     if not specialty:
         return None
 
     try:
-        db.delete(specialty)
-        db.commit()
+        await db.delete(specialty)
+        await db.commit()
+        response_cache.invalidate(SPECIALTIES, TEMPLATES)
+        stats_cache.invalidate(TEMPLATE_STATS)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(traceback.format_exc())
         raise Exception(f'Unexpected error: {e}')
 
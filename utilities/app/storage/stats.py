@@ -0,0 +1,119 @@
+import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import Float, func, literal, select
+from sqlalchemy.sql import Select
+
+from common.models import Checkup, Template, json_number
+from common.templates import VALID_HEADER_TYPE
+from dependencies import AsyncSession
+
+DEFAULT_HISTOGRAM_BINS = 10
+MAX_HISTOGRAM_BINS = 100
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def numeric_fields(template: Template) -> List[str]:
+    return [name for name, header_type in (template.headers or {}).items()
+            if VALID_HEADER_TYPE.get(header_type) == "int"]
+
+
+def filter_checkups(statement: Select, template_id: int,
+                    date_from: datetime.datetime = None,
+                    date_to: datetime.datetime = None) -> Select:
+    statement = statement.where(Checkup.template_id == template_id)
+
+    # Bounds on the partition key let Postgres skip the partitions outside the range.
+    if date_from:
+        statement = statement.where(Checkup.date >= date_from)
+
+    if date_to:
+        statement = statement.where(Checkup.date < date_to)
+
+    return statement
+
+
+async def load_columns(db: AsyncSession, template_id: int, fields: List[str],
+                       date_from: datetime.datetime = None,
+                       date_to: datetime.datetime = None) -> np.ndarray:
+    """Numeric fields of the template's checkups as a (checkups, fields) array.
+
+    Values are extracted in the database, so only floats travel over the
+    wire, and missing values come back as NaN.
+    """
+    if db.bind.dialect.name == "postgresql":
+        # One float8[] per field instead of one row per checkup: asyncpg
+        # decodes the arrays in C, building a million rows in Python would
+        # take longer than computing the stats.
+        statement = filter_checkups(
+            select(*[
+                func.array_agg(func.coalesce(json_number(Checkup.data, field),
+                                             literal(float("nan"), Float)))
+                for field in fields
+            ]),
+            template_id, date_from, date_to)
+
+        result = await db.execute(statement)
+        return np.column_stack([
+            np.array(column or [], dtype=float) for column in result.one()])
+
+    statement = filter_checkups(
+        select(*[json_number(Checkup.data, field) for field in fields]),
+        template_id, date_from, date_to)
+
+    result = await db.execute(statement)
+    rows = result.all()
+    if not rows:
+        return np.empty((0, len(fields)))
+
+    return np.array(rows, dtype=float)
+
+
+def describe(values: np.ndarray, bins: int) -> dict:
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return {"count": 0, "percentiles": {}}
+
+    counts, edges = np.histogram(values, bins=bins)
+    percentiles = np.percentile(values, PERCENTILES)
+
+    return {
+        "count": int(values.size),
+        "mean": float(values.mean()),
+        "stddev": float(values.std(ddof=1)) if values.size > 1 else 0.0,
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "percentiles": {f"p{percentile}": float(value)
+                        for percentile, value in zip(PERCENTILES, percentiles)},
+        "histogram": {"edges": edges.tolist(), "counts": counts.tolist()},
+    }
+
+
+async def get_template_stats(db: AsyncSession, template: Template,
+                             date_from: Optional[datetime.datetime] = None,
+                             date_to: Optional[datetime.datetime] = None,
+                             bins: int = DEFAULT_HISTOGRAM_BINS) -> dict:
+    """Distribution of every numeric field of the template's checkups."""
+    fields = numeric_fields(template)
+    stats: Dict[str, dict] = {}
+
+    if fields:
+        columns = await load_columns(db, template.id, fields, date_from, date_to)
+        checkups = columns.shape[0]
+
+        for index, field in enumerate(fields):
+            stats[field] = describe(columns[:, index], bins)
+    else:
+        result = await db.execute(filter_checkups(
+            select(func.count()).select_from(Checkup), template.id, date_from, date_to))
+        checkups = result.scalar()
+
+    return {
+        "template_id": template.id,
+        "date_from": date_from,
+        "date_to": date_to,
+        "checkups": checkups,
+        "fields": stats,
+    }
@@ -1,22 +1,17 @@
-import json
 import traceback
-from typing import List
 
-from sqlalchemy.sql import text
-from sqlalchemy import and_
+from sqlalchemy import and_, select
 
 from common.schemas.template import Template, TemplateIn, TemplateUpdate
-from common.models import Template
+from common.models import Template, doctor_to_specialty_association
+from common.pagination import DEFAULT_PAGE_SIZE, Page, fetch_page
+from common.templates import CompiledTemplate
 from common.utils import get_current_time
-from dependencies import Session
+from dependencies import AsyncSession
+from cache import TEMPLATE_STATS, TEMPLATES, response_cache, stats_cache
 
-VALID_HEADER_TYPE = {
-    "string": "str",
-    "int": "int"
-}
 
-
-def create_template(db: Session, template: TemplateIn) -> Template:
+async def create_template(db: AsyncSession, template: TemplateIn) -> Template:
     numeric_fields, alphanumeric_fields = calculate_template_fields(template)
 
     template.numeric_fields = numeric_fields
@@ -28,40 +23,45 @@ def create_template(db: Session, template: TemplateIn) -> Template:
 
         db.add(db_template)
 
-        db.commit()
-        db.refresh(db_template)
+        await db.commit()
+        response_cache.invalidate(TEMPLATES)
 
         return db_template
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(traceback.format_exc())
         raise Exception(f'Unexpected error: {e}')
 
 
-def get_template_by_specialty_id(db: Session, specialty_id: int, hospital_id: int) -> Template:
-    return db.query(Template).filter(
+async def get_template_by_specialty_id(db: AsyncSession, specialty_id: int, hospital_id: int) -> Template:
+    result = await db.execute(select(Template).where(
         and_(
             Template.specialty_id == specialty_id,
             Template.hospital_id == hospital_id
         )
-    ).first()
+    ))
+    return result.scalars().first()
 
 
-def get_template_by_id(db: Session, template_id: int) -> Template:
-    return db.query(Template).filter(Template.id == template_id).first()
+async def get_template_by_id(db: AsyncSession, template_id: int) -> Template:
+    result = await db.execute(
+        select(Template).where(Template.id == template_id))
+    return result.scalars().first()
 
 
-def get_templates_by_hospital_id(db: Session, hospital_id: int) -> Template:
+async def get_templates_by_hospital_id(db: AsyncSession, hospital_id: int, cursor: str = None,
+                                       limit: int = DEFAULT_PAGE_SIZE) -> Page:
     filter_params: dict = {"hospital_id": hospital_id}
 
     filter_params = {key: value for (
         key, value) in filter_params.items() if value}
 
-    return db.query(Template).filter_by(**filter_params).all()
+    statement = select(Template).filter_by(**filter_params)
+    return await fetch_page(db, statement, (Template.id,), cursor, limit)
 
 
-def update_template(db: Session, template_id: int, updated_template: TemplateUpdate) -> Template:
-    template = get_template_by_id(db, template_id)
+async def update_template(db: AsyncSession, template_id: int, updated_template: TemplateUpdate) -> Template:
+    template = await get_template_by_id(db, template_id)
     if not template:
         return None
 
@@ -79,65 +79,49 @@ def update_template(db: Session, template_id: int, updated_template: TemplateUpd
 
         template.updated_at = get_current_time()
 
-        db.commit()
-        db.refresh(template)
+        await db.commit()
+        response_cache.invalidate(TEMPLATES)
+        stats_cache.invalidate(TEMPLATE_STATS)
 
         return template
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(traceback.format_exc())
         raise Exception(f'Unexpected error: {e}')
 
 
-def delete_template(db: Session, template_id: int) -> Template:
-    template = get_template_by_id(db, template_id)
+async def delete_template(db: AsyncSession, template_id: int) -> Template:
+    template = await get_template_by_id(db, template_id)
     if not template:
         return None
 
     try:
-        db.delete(template)
-        db.commit()
+        await db.delete(template)
+        await db.commit()
+        response_cache.invalidate(TEMPLATES)
+        stats_cache.invalidate(TEMPLATE_STATS)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(traceback.format_exc())
         raise Exception(f'Unexpected error: {e}')
 
     return template
 
 
-def get_templates_by_doctor_id(db: Session, doctor_id: int) -> List[Template]:
-    statement = text("""
-        SELECT
-            t.*
-        FROM
-            doctor as d
-        INNER JOIN doctor_specialty as ds
-            ON d.id = ds.doctor_id
-        INNER JOIN specialty as s
-            ON s.id = ds.specialty_id
-        INNER JOIN template as t
-            ON t.specialty_id = s.id
-        WHERE
-            d.id = :doctor_id;
-    """)
-
-    parameters = {"doctor_id": doctor_id}
-
-    return db.execute(statement, params=parameters).all()
+async def get_templates_by_doctor_id(db: AsyncSession, doctor_id: int, cursor: str = None,
+                                     limit: int = DEFAULT_PAGE_SIZE) -> Page:
+    statement = (
+        select(Template)
+        .join(
+            doctor_to_specialty_association,
+            doctor_to_specialty_association.c.specialty_id == Template.specialty_id,
+        )
+        .where(doctor_to_specialty_association.c.doctor_id == doctor_id)
+    )
+    return await fetch_page(db, statement, (Template.id,), cursor, limit)
 
 
 def calculate_template_fields(template: TemplateIn):
-    json_template: dict = json.loads(template.headers)
-
-    numeric_fields: int = 0
-    alphanumeric_fields: int = 0
-
-    for _, value in json_template.items():
-        header_type = VALID_HEADER_TYPE[value]
-
-        if header_type == "int":
-            numeric_fields = numeric_fields + 1
-        elif header_type == "str":
-            alphanumeric_fields = alphanumeric_fields + 1
+    compiled = CompiledTemplate(template.headers)
 
-    return numeric_fields, alphanumeric_fields
+    return compiled.numeric_fields, compiled.alphanumeric_fields
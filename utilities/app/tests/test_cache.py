@@ -0,0 +1,67 @@
+from starlette.requests import Request
+
+from cache import HOSPITALS, TEMPLATES, ResponseCache, make_etag
+from common.schemas.specialty import Specialty
+
+SPECIALTY = {"id": 1, "name": "general", "hospital_id": 1}
+
+
+def make_request(path: str = "/hospitals", headers: dict = None) -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": b"",
+        "headers": [(name.lower().encode(), value.encode())
+                    for name, value in (headers or {}).items()],
+    })
+
+
+def test_lookup_returns_cached_response():
+    cache = ResponseCache(max_entries=10, ttl=60)
+    cache.lookup(make_request(), HOSPITALS).respond(Specialty, SPECIALTY)
+
+    response = cache.lookup(make_request(), HOSPITALS).response
+
+    assert response.status_code == 200
+    assert response.headers["etag"] == make_etag(response.body)
+
+
+def test_entries_expire_after_ttl():
+    now = [0.0]
+    cache = ResponseCache(max_entries=10, ttl=60, clock=lambda: now[0])
+    cache.lookup(make_request(), HOSPITALS).respond(Specialty, SPECIALTY)
+
+    now[0] = 61
+
+    assert cache.lookup(make_request(), HOSPITALS).response is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=1, ttl=60)
+    cache.lookup(make_request("/hospitals/1"), HOSPITALS).respond(Specialty, SPECIALTY)
+    cache.lookup(make_request("/hospitals/2"), HOSPITALS).respond(Specialty, SPECIALTY)
+
+    assert cache.lookup(make_request("/hospitals/1"), HOSPITALS).response is None
+    assert cache.lookup(make_request("/hospitals/2"), HOSPITALS).response is not None
+
+
+def test_invalidate_only_drops_its_scope():
+    cache = ResponseCache(max_entries=10, ttl=60)
+    cache.lookup(make_request("/hospitals"), HOSPITALS).respond(Specialty, SPECIALTY)
+    cache.lookup(make_request("/templates"), TEMPLATES).respond(Specialty, SPECIALTY)
+
+    cache.invalidate(HOSPITALS)
+
+    assert cache.lookup(make_request("/hospitals"), HOSPITALS).response is None
+    assert cache.lookup(make_request("/templates"), TEMPLATES).response is not None
+
+
+def test_reads_started_before_a_write_are_not_cached():
+    cache = ResponseCache(max_entries=10, ttl=60)
+    lookup = cache.lookup(make_request(), HOSPITALS)
+
+    cache.invalidate(HOSPITALS)
+    lookup.respond(Specialty, SPECIALTY)
+
+    assert cache.lookup(make_request(), HOSPITALS).response is None
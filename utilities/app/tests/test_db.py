@@ -1,12 +1,15 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 import pytest
 import datetime
 
 from common.database import start_engine
 from common.models import Base, Template, Specialty, Hospital, Location, User, Admin, Doctor
+from cache import response_cache, stats_cache
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={
                        "check_same_thread": False})
@@ -14,13 +17,23 @@ engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={
 TestingSessionLocal = sessionmaker(
     autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
 
-def override_get_db():
+TestingAsyncSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+    bind=async_engine,
+    class_=AsyncSession,
+)
+
+
+async def override_get_db():
+    db = TestingAsyncSessionLocal()
     try:
-        db = TestingSessionLocal()
         yield db
     finally:
-        db.close()
+        await db.close()
 
 
 @pytest.fixture()
@@ -57,7 +70,7 @@ def test_db():
     templates = [
         Template(
             title="Mock template",
-            headers="{\"name\":\"string\",\"last_name\":\"string\",\"condition\":\"string\",\"age\":\"int\"}",
+            headers={"name": "string", "last_name": "string", "condition": "string", "age": "int"},
             specialty_id=2,
             hospital_id=1,
             numeric_fields=1,
@@ -65,7 +78,7 @@ def test_db():
         ),
         Template(
             title="Mock template",
-            headers="{\"name\":\"string\",\"last_name\":\"string\",\"condition\":\"string\",\"age\":\"int\"}",
+            headers={"name": "string", "last_name": "string", "condition": "string", "age": "int"},
             specialty_id=1,
             hospital_id=2,
             numeric_fields=1,
@@ -155,3 +168,5 @@ def test_db():
 
     yield
     Base.metadata.drop_all(bind=engine)
+    response_cache.clear()
+    stats_cache.clear()
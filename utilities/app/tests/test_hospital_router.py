@@ -1,10 +1,20 @@
+import datetime
+import json
 from fastapi.testclient import TestClient
 from fastapi import status
 from main import app
-from dependencies import get_db
-from tests.test_db import override_get_db, test_db
+from common.models import Checkup, HospitalDailyCheckups, HospitalRollup
+from dependencies import get_db, get_read_db, get_export_session_factory
+from tests.test_db import (
+    TestingAsyncSessionLocal,
+    TestingSessionLocal,
+    override_get_db,
+    test_db,
+)
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+app.dependency_overrides[get_export_session_factory] = lambda: TestingAsyncSessionLocal
 
 client = TestClient(app)
 
@@ -45,6 +55,28 @@ def test_get_hospitals(test_db):
     assert len(data) > 1
 
 
+def test_get_hospitals_paginated(test_db):
+    response = client.get("/hospitals?limit=2")
+    first_page = response.json()
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [hospital["id"] for hospital in first_page] == [1, 2]
+
+    next_url = response.headers["link"].split(">;")[0].lstrip("<")
+    response = client.get(next_url)
+    second_page = response.json()
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [hospital["id"] for hospital in second_page] == [3]
+    assert "link" not in response.headers
+
+
+def test_get_hospitals_invalid_cursor(test_db):
+    response = client.get("/hospitals?cursor=not-a-cursor")
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
 def test_get_hospitals_by_name(test_db):
     keyword = "pri"
 
@@ -55,6 +87,48 @@ def test_get_hospitals_by_name(test_db):
     assert len(data) == 2
 
 
+def create_hospital(name: str) -> int:
+    payload = {
+        "name": name,
+        "schedule": "L - V 8:00 - 17:00",
+        "description": "Lorem ipsum dolor sit amet, consectetur adipiscing elit.",
+        "location": {
+            "address": "Calle Duarte 12, San José de Ocoa",
+            "province": "san_jose_de_ocoa"
+        }
+    }
+    return client.post("/hospitals", json=payload).json()["id"]
+
+
+def test_search_hospitals_ignores_accents(test_db):
+    hospital_id = create_hospital("Hospital San José de Ocoa")
+
+    response = client.get("/hospitals/search?q=JOSE")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [hospital["id"] for hospital in response.json()] == [hospital_id]
+
+
+def test_search_hospitals_ranks_best_match_first(test_db):
+    response = client.get("/hospitals/search?q=private hospital&limit=2")
+    data = response.json()
+
+    assert len(data) == 2
+    assert data[0]["name"] == "Private hospital"
+
+
+def test_autocomplete_hospitals(test_db):
+    create_hospital("Clínica Primavera")
+
+    response = client.get("/hospitals/autocomplete?q=pri")
+    data = response.json()
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [hospital["name"] for hospital in data] == [
+        "Prius hospital", "Private hospital", "Clínica Primavera"]
+    assert set(data[0]) == {"id", "name"}
+
+
 def test_update_hospital(test_db):
     payload = {
         "name": "Updated hospital",
@@ -103,6 +177,73 @@ def test_delete_hospital(test_db):
     assert response.status_code == status.HTTP_404_NOT_FOUND
 
 
+def test_get_hospital_answers_if_none_match(test_db):
+    response = client.get("/hospitals/1")
+    etag = response.headers["etag"]
+
+    response = client.get("/hospitals/1", headers={"If-None-Match": etag})
+
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+
+def test_cached_hospital_is_invalidated_by_update(test_db):
+    etag = client.get("/hospitals/1").headers["etag"]
+
+    client.put("/hospitals/1", json={"name": "Renamed hospital"})
+    response = client.get("/hospitals/1", headers={"If-None-Match": etag})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["etag"] != etag
+    assert response.json()["name"] == "Renamed hospital"
+
+
+def test_get_hospital_stats(test_db):
+    db = TestingSessionLocal()
+    db.add(HospitalRollup(hospital_id=1, doctors=2, admins=1, patients=7))
+    db.add_all([
+        HospitalDailyCheckups(hospital_id=1, day=datetime.date(2021, 3, 1),
+                              specialty_id=1, checkups=4),
+        HospitalDailyCheckups(hospital_id=1, day=datetime.date(2021, 3, 2),
+                              specialty_id=0, checkups=3),
+        HospitalDailyCheckups(hospital_id=1, day=datetime.date(2021, 4, 1),
+                              specialty_id=1, checkups=5),
+    ])
+    db.commit()
+    db.close()
+
+    response = client.get("/hospitals/1/stats?date_from=2021-03-01&date_to=2021-03-31")
+    data = response.json()
+
+    assert response.status_code == status.HTTP_200_OK
+    assert (data["doctors"], data["admins"], data["patients"]) == (2, 1, 7)
+    assert data["total_checkups"] == 7
+    assert data["checkups"] == [
+        {"day": "2021-03-01", "specialty_id": 1, "checkups": 4},
+        {"day": "2021-03-02", "specialty_id": None, "checkups": 3},
+    ]
+
+
+def test_get_hospital_stats_without_rollups(test_db):
+    data = client.get("/hospitals/2/stats").json()
+
+    assert (data["doctors"], data["admins"], data["patients"]) == (0, 0, 0)
+    assert data["checkups"] == []
+
+
+def test_get_hospital_stats_invalid_range(test_db):
+    response = client.get("/hospitals/1/stats?date_from=2021-03-01&date_to=2020-03-01")
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_get_hospital_stats_not_found(test_db):
+    response = client.get("/hospitals/123/stats")
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
 def test_get_admins_by_hospital_id(test_db):
     response = client.get("/hospitals/1/admins")
     data = response.json()
@@ -129,3 +270,39 @@ def test_get_doctors_hospital_not_found(test_db):
     response = client.get("/hospitals/123/doctors")
 
     assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_export_hospital_users(test_db):
+    response = client.get("/hospitals/1/export?kind=users")
+    users = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [user["id"] for user in users] == [1, 2, 3]
+    assert [user["doctor_id"] for user in users] == [None, 1, 2]
+    assert all("password" not in user for user in users)
+
+
+def test_export_hospital_checkups(test_db):
+    db = TestingSessionLocal()
+    db.add_all([
+        Checkup(template_id=1, doctor_id=1, data={"weight": 80},
+                date=datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)),
+        Checkup(template_id=1, doctor_id=2, data={"weight": 70},
+                date=datetime.datetime(2021, 1, 2, tzinfo=datetime.timezone.utc)),
+    ])
+    db.commit()
+    db.close()
+
+    response = client.get("/hospitals/1/export?kind=checkups")
+    checkups = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [checkup["data"] for checkup in checkups] == [{"weight": 80}, {"weight": 70}]
+    assert [checkup["date"] for checkup in checkups] == ["2021-01-01T00:00:00", "2021-01-02T00:00:00"]
+
+
+def test_export_hospital_not_found(test_db):
+    response = client.get("/hospitals/123/export?kind=users")
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -0,0 +1,73 @@
+import pytest
+
+from storage import specialty as specialties
+from storage import templates
+from common import testing
+from common.models import Base, Specialty, Template
+from .test_db import engine, async_engine, TestingSessionLocal, TestingAsyncSessionLocal
+
+INDEXED_TABLES = ("specialty", "template")
+
+
+@pytest.fixture()
+def seeded_db():
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+
+    db.add_all([
+        Specialty(name=f"specialty {index}", hospital_id=index % 50)
+        for index in range(1000)
+    ])
+    db.add_all([
+        Template(
+            title="Mock template",
+            headers={"name": "string"},
+            specialty_id=index,
+            hospital_id=index % 50,
+        )
+        for index in range(1000)
+    ])
+    db.commit()
+    db.execute("ANALYZE")
+    db.close()
+
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+def capture_query_plans(query):
+    return testing.capture_query_plans(engine, async_engine, TestingAsyncSessionLocal, query)
+
+
+def assert_no_table_scans(plans):
+    testing.assert_no_table_scans(plans, INDEXED_TABLES)
+
+
+def test_get_specialty_by_name_uses_indexes(seeded_db):
+    plans = capture_query_plans(
+        lambda db: specialties.get_specialty_by_name(db, "specialty 42", 42))
+
+    assert_no_table_scans(plans)
+    assert any("ix_specialty_hospital_id_name" in detail for detail in plans)
+
+
+def test_get_specialties_uses_indexes(seeded_db):
+    plans = capture_query_plans(
+        lambda db: specialties.get_specialties(db, 7))
+
+    assert_no_table_scans(plans)
+
+
+def test_get_template_by_specialty_id_uses_indexes(seeded_db):
+    plans = capture_query_plans(
+        lambda db: templates.get_template_by_specialty_id(db, 42, 42))
+
+    assert_no_table_scans(plans)
+    assert any("ix_template_specialty_id_hospital_id" in detail for detail in plans)
+
+
+def test_get_templates_by_hospital_id_uses_indexes(seeded_db):
+    plans = capture_query_plans(
+        lambda db: templates.get_templates_by_hospital_id(db, 7))
+
+    assert_no_table_scans(plans)
@@ -2,10 +2,11 @@ from fastapi.testclient import TestClient
 from fastapi import status
 
 from main import app
-from dependencies import get_db
+from dependencies import get_db, get_read_db
 from tests.test_db import override_get_db, test_db
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
 
 client = TestClient(app)
 
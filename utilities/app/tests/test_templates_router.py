@@ -1,11 +1,15 @@
+import datetime
+
 from fastapi.testclient import TestClient
 from fastapi import status
 
 from main import app
-from dependencies import get_db
-from tests.test_db import override_get_db, test_db
+from common.models import Checkup
+from dependencies import get_db, get_read_db
+from tests.test_db import TestingSessionLocal, override_get_db, test_db
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
 
 client = TestClient(app)
 
@@ -13,7 +17,7 @@ client = TestClient(app)
 def test_create_template(test_db):
     payload = {
         "title": "Cardiac conditions",
-        "headers": "{\"name\":\"string\",\"last_name\":\"string\",\"condition\":\"string\",\"age\":\"int\"}",
+        "headers": {"name": "string", "last_name": "string", "condition": "string", "age": "int"},
         "specialty_id": 1,
         "hospital_id": 1
     }
@@ -60,7 +64,7 @@ def test_get_templates(test_db):
 def test_update_template(test_db):
     payload = {
         "title": "Updated cardiac conditions",
-        "headers": "{\"name\":\"string\",\"last_name\":\"string\"}",
+        "headers": {"name": "string", "last_name": "string"},
     }
 
     response = client.put("/templates/1", json=payload)
@@ -68,7 +72,7 @@ def test_update_template(test_db):
 
     assert response.status_code == status.HTTP_200_OK
     assert data["title"] == "Updated cardiac conditions"
-    assert data["headers"] == "{\"name\":\"string\",\"last_name\":\"string\"}"
+    assert data["headers"] == {"name": "string", "last_name": "string"}
     assert data["numeric_fields"] == 0
     assert data["alphanumeric_fields"] == 2
     assert data["updated_at"] is not None
@@ -90,3 +94,61 @@ def test_get_templates_by_doctor_id(test_db):
 
     assert response.status_code == status.HTTP_200_OK
     assert len(data) == 1
+
+
+def add_checkups(ages):
+    db = TestingSessionLocal()
+    db.add_all([
+        Checkup(
+            template_id=1,
+            data={"name": "Juan", "age": age},
+            date=datetime.datetime(2021, 1, day, tzinfo=datetime.timezone.utc),
+        )
+        for day, age in enumerate(ages, start=1)
+    ])
+    db.commit()
+    db.close()
+
+
+def test_get_template_stats(test_db):
+    add_checkups([10, 20, 30, 40, "fifty", None])
+
+    response = client.get("/templates/1/stats?bins=3")
+    data = response.json()
+
+    assert response.status_code == status.HTTP_200_OK
+    assert data["checkups"] == 6
+    assert list(data["fields"]) == ["age"]
+
+    age = data["fields"]["age"]
+    assert age["count"] == 4
+    assert age["mean"] == 25
+    assert age["min"] == 10 and age["max"] == 40
+    assert age["percentiles"]["p50"] == 25
+    assert age["histogram"] == {"edges": [10, 20, 30, 40], "counts": [1, 1, 2]}
+
+
+def test_get_template_stats_within_dates(test_db):
+    add_checkups([10, 20, 30, 40])
+
+    response = client.get(
+        "/templates/1/stats?date_from=2021-01-02T00:00:00Z&date_to=2021-01-04T00:00:00Z")
+    age = response.json()["fields"]["age"]
+
+    assert age["count"] == 2
+    assert age["mean"] == 25
+
+
+def test_get_template_stats_without_checkups(test_db):
+    response = client.get("/templates/1/stats")
+    data = response.json()
+
+    assert response.status_code == status.HTTP_200_OK
+    assert data["checkups"] == 0
+    assert data["fields"]["age"] == {"count": 0, "percentiles": {}}
+
+
+def test_get_template_stats_not_found(test_db):
+    response = client.get("/templates/123/stats")
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND